@@ -1,7 +1,54 @@
-from django.contrib import admin
+from datetime import date
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import Profile, Period, Lesson, Schedule, Mark, HomeTask
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .caching import invalidate_students
+from .events import mark_event, publish_on_commit, student_channel
+from .models import Profile, Period, Lesson, Schedule, Mark, HomeTask, Holiday, TimetableTemplate, TimetableSlot, Job
+from .statistics import lesson_pairs, refresh_mark_statistics
+
+
+class EstimatedCountPaginator(Paginator):
+    """Counts at most ADMIN_COUNT_LIMIT rows instead of the whole table.
+
+    Past the limit an unfiltered PostgreSQL table reports the planner's row
+    estimate, anything else reports the limit, so the last pages of a very
+    large changelist are reached by filtering rather than paging.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_COUNT_LIMIT
+        queryset = self.object_list
+        counted = queryset.order_by()[:limit + 1].count()
+        if counted <= limit:
+            return counted
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row:
+                return max(row[0], limit)
+        return limit
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # The "N total" link would count the whole table on every filtered page
+    show_full_result_count = False
+    list_per_page = 50
 
 
 class ProfileInline(admin.StackedInline):
@@ -9,15 +56,178 @@ class ProfileInline(admin.StackedInline):
     can_delete = False
     verbose_name_plural = 'Profile'
 
+class TimetableSlotInline(admin.TabularInline):
+    model = TimetableSlot
+    extra = 0
+
+class TimetableTemplateAdmin(admin.ModelAdmin):
+    inlines = (TimetableSlotInline,)
+
 class UserAdmin(BaseUserAdmin):
     inlines = (ProfileInline,)
 
+
+class ScheduleAdmin(LargeTableAdmin):
+    list_display = ('date', 'period', 'lesson')
+    list_select_related = ('lesson', 'period')
+    # Both use an index: (date, period) and (lesson, date)
+    date_hierarchy = 'date'
+    list_filter = ('lesson', 'period')
+    # Used by the schedule autocomplete of marks and hometasks
+    search_fields = ('lesson__name',)
+    autocomplete_fields = ('lesson',)
+    ordering = ('-date', 'period__number')
+
+    def get_queryset(self, request):
+        # __str__ follows lesson and period, autocomplete results included
+        return super().get_queryset(request).select_related('lesson', 'period')
+
+    def get_search_results(self, request, queryset, search_term):
+        try:
+            day = date.fromisoformat(search_term.strip())
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(date=day), False
+
+
+class HomeTaskAdmin(LargeTableAdmin):
+    list_display = ('schedule_date', 'lesson', 'period', 'description')
+    list_select_related = ('schedule__lesson', 'schedule__period')
+    date_hierarchy = 'schedule__date'
+    list_filter = ('schedule__lesson',)
+    search_fields = ('description',)
+    autocomplete_fields = ('schedule',)
+
+    @admin.display(description='Date', ordering='schedule__date')
+    def schedule_date(self, hometask):
+        return hometask.schedule.date
+
+    @admin.display(ordering='schedule__lesson__name')
+    def lesson(self, hometask):
+        return hometask.schedule.lesson
+
+    @admin.display(ordering='schedule__period__number')
+    def period(self, hometask):
+        return hometask.schedule.period
+
+
+class MarkActionForm(ActionForm):
+    mark = forms.IntegerField(required=False, help_text='New mark for "Re-grade".')
+    schedule = forms.IntegerField(required=False, label='Schedule id', help_text='Target for "Move".')
+
+
+def update_marks(marks, **changes):
+    """Apply ``changes`` to ``marks`` in one UPDATE, with what the Mark signals would do.
+
+    Refreshes the statistics of every pair the marks leave or join, bumps
+    ``updated_at`` for the change feeds, expires the students' cached
+    responses and publishes an event per mark.
+    """
+    marks = list(marks)
+    if not marks:
+        return 0
+    with transaction.atomic():
+        pairs = lesson_pairs(marks)
+        Mark.objects.filter(pk__in=[mark.pk for mark in marks]).update(updated_at=timezone.now(), **changes)
+        for mark in marks:
+            for field, value in changes.items():
+                setattr(mark, field, value)
+        refresh_mark_statistics(pairs | lesson_pairs(marks))
+        invalidate_students(student for student, _ in pairs | lesson_pairs(marks))
+        for mark in marks:
+            publish_on_commit(student_channel(mark.student_id), mark_event(mark, 'updated'))
+    return len(marks)
+
+
+class MarkAdmin(LargeTableAdmin):
+    list_display = ('student', 'mark', 'schedule_date', 'lesson', 'period', 'updated_at')
+    list_select_related = ('student', 'schedule__lesson', 'schedule__period')
+    date_hierarchy = 'schedule__date'
+    # Related filters list the few lessons and periods, never every student or schedule
+    list_filter = ('schedule__lesson', 'schedule__period')
+    search_fields = ('student__username', 'student__last_name')
+    autocomplete_fields = ('student', 'schedule')
+    action_form = MarkActionForm
+    actions = ('regrade_marks', 'move_marks')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('student', 'schedule__lesson', 'schedule__period')
+
+    @admin.display(description='Date', ordering='schedule__date')
+    def schedule_date(self, mark):
+        return mark.schedule.date
+
+    @admin.display(ordering='schedule__lesson__name')
+    def lesson(self, mark):
+        return mark.schedule.lesson
+
+    @admin.display(ordering='schedule__period__number')
+    def period(self, mark):
+        return mark.schedule.period
+
+    def _selected(self, queryset):
+        return queryset.only('id', 'student_id', 'schedule_id', 'mark')
+
+    def _action_value(self, request, field):
+        """The cleaned ``field`` of the submitted MarkActionForm, or None when it is missing or invalid."""
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        if not form.is_valid():
+            return None
+        return form.cleaned_data[field]
+
+    @admin.action(description='Re-grade selected marks', permissions=['change'])
+    def regrade_marks(self, request, queryset):
+        value = self._action_value(request, 'mark')
+        if value is None:
+            self.message_user(request, 'Enter the new mark to re-grade.', messages.ERROR)
+            return
+        changed = update_marks((mark for mark in self._selected(queryset) if mark.mark != value), mark=value)
+        self.message_user(request, f'Re-graded {changed} mark(s) to {value}.')
+
+    @admin.action(description='Move selected marks to another schedule', permissions=['change'])
+    def move_marks(self, request, queryset):
+        target = self._action_value(request, 'schedule')
+        schedule = Schedule.objects.filter(pk=target).first() if target is not None else None
+        if schedule is None:
+            self.message_user(request, 'Enter the id of an existing schedule to move to.', messages.ERROR)
+            return
+        marks = [mark for mark in self._selected(queryset) if mark.schedule_id != schedule.pk]
+        # A student has one mark per schedule, keep the existing one
+        taken = set(
+            Mark.objects.filter(schedule=schedule, student_id__in={mark.student_id for mark in marks})
+            .values_list('student_id', flat=True)
+        )
+        moving = []
+        for mark in marks:
+            if mark.student_id not in taken:
+                taken.add(mark.student_id)
+                moving.append(mark)
+        moved = update_marks(moving, schedule_id=schedule.pk)
+        self.message_user(request, f'Moved {moved} mark(s) to {schedule}.')
+        if len(marks) > moved:
+            self.message_user(
+                request,
+                f'Skipped {len(marks) - moved} mark(s) of students already marked on {schedule}.',
+                messages.WARNING,
+            )
+
+
 admin.site.unregister(User)
 
 admin.site.register(User, UserAdmin)
 
 admin.site.register(Period)
-admin.site.register(Lesson)
-admin.site.register(Schedule)
-admin.site.register(Mark)
-admin.site.register(HomeTask)
+admin.site.register(Lesson, search_fields=('name',))
+admin.site.register(Schedule, ScheduleAdmin)
+admin.site.register(Mark, MarkAdmin)
+admin.site.register(HomeTask, HomeTaskAdmin)
+admin.site.register(Holiday)
+admin.site.register(TimetableTemplate, TimetableTemplateAdmin)
+admin.site.register(
+    Job,
+    list_display=('id', 'kind', 'status', 'progress', 'owner', 'created_at', 'finished_at'),
+    list_filter=('status', 'kind'),
+    list_select_related=('owner',),
+    raw_id_fields=('owner',),
+)
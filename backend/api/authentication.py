@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Profile
+
+REVOKED_TOKEN_KEY = 'api:jwt:revoked-token:{}'
+REVOKED_USER_KEY = 'api:jwt:revoked-user:{}'
+
+
+def _deny_list_timeout(*lifetimes):
+    # Nothing needs remembering once every token it could match has expired
+    return int(max(lifetime.total_seconds() for lifetime in lifetimes)) + 60
+
+
+def revoke_token(token):
+    """Reject one access token, by its ``jti``, for the rest of its lifetime."""
+    cache.set(
+        REVOKED_TOKEN_KEY.format(token[api_settings.JTI_CLAIM]),
+        True,
+        _deny_list_timeout(api_settings.ACCESS_TOKEN_LIFETIME),
+    )
+
+
+def revoke_user_tokens(user_id, issued_before):
+    """Reject every access and refresh token of a user issued before the given Unix timestamp."""
+    cache.set(
+        REVOKED_USER_KEY.format(user_id),
+        int(issued_before),
+        _deny_list_timeout(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME),
+    )
+
+
+def is_revoked(token):
+    token_key = REVOKED_TOKEN_KEY.format(token.get(api_settings.JTI_CLAIM))
+    user_key = REVOKED_USER_KEY.format(token.get(api_settings.USER_ID_CLAIM))
+    revoked = cache.get_many([token_key, user_key])
+    if token_key in revoked:
+        return True
+    issued_before = revoked.get(user_key)
+    return issued_before is not None and token.get('iat', 0) <= issued_before
+
+
+class ClaimsUser(TokenUser):
+    """A user built from the access token claims written by CustomTokenObtainPairSerializer.
+
+    It exposes ``profile.role`` so IsTeacher works unchanged. Tokens issued
+    before the role claim existed fall back to loading the profile.
+    """
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def first_name(self):
+        return self.token.get('first_name', '')
+
+    @cached_property
+    def last_name(self):
+        return self.token.get('last_name', '')
+
+    @cached_property
+    def profile(self):
+        if 'role' in self.token:
+            return SimpleNamespace(role=self.token['role'])
+        try:
+            return Profile.objects.get(user_id=self.id)
+        except Profile.DoesNotExist:
+            raise AttributeError('profile')
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """JWT authentication that trusts the token claims instead of loading the User.
+
+    Enabled with the JWT_STATELESS_AUTH setting. Revocation goes through a
+    cache deny-list kept only as long as an access token lives.
+    """
+
+    def get_user(self, validated_token):
+        super().get_user(validated_token)
+        if is_revoked(validated_token):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return ClaimsUser(validated_token)
+
+
+def user_from_raw_token(raw_token):
+    """ClaimsUser for a raw access token, or None if it is invalid or revoked.
+
+    For callers outside DRF, such as the event stream, which must not block
+    on database queries.
+    """
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return None
+    if api_settings.USER_ID_CLAIM not in token or is_revoked(token):
+        return None
+    return ClaimsUser(token)
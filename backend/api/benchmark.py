@@ -0,0 +1,133 @@
+import logging
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.test import Client
+from django.urls import URLPattern, URLResolver
+
+from . import urls
+from .instrumentation import execute_wrapper
+from .serializers import CustomTokenObtainPairSerializer
+
+ROUTE_PREFIX = '/api/'
+# Values for URL parameters that are not a primary key
+SAMPLE_KWARGS = {'dataset': 'marks', 'extension': 'csv'}
+# Streams that never end on their own
+SKIP_ROUTES = {'student/events/'}
+
+_REGEX_GROUP = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+_PATH_CONVERTER = re.compile(r'<(?:\w+:)?(\w+)>')
+
+
+def _walk(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _walk(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern):
+            yield prefix + str(pattern.pattern), pattern.callback
+
+
+def _handles_get(callback):
+    actions = getattr(callback, 'actions', None)
+    if actions is not None:
+        return 'get' in actions
+    view_class = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None)
+    return view_class is not None and hasattr(view_class, 'get')
+
+
+def _sample_pk(callback):
+    view_class = getattr(callback, 'cls', None)
+    queryset = getattr(view_class, 'queryset', None)
+    if queryset is None:
+        return None
+    return queryset.values_list('pk', flat=True).order_by('pk').first()
+
+
+def discover_routes(student):
+    """GET routes of api.urls as concrete paths, with parameters filled from the database."""
+    routes = {}
+    for route, callback in _walk(urls.urlpatterns):
+        route = route.lstrip('^').rstrip('$')
+        names = set(_PATH_CONVERTER.findall(route)) | set(_REGEX_GROUP.findall(route))
+        # Format suffix variants of the router's routes
+        if 'format' in names or route in SKIP_ROUTES or not _handles_get(callback):
+            continue
+        values = dict(SAMPLE_KWARGS, student_id=student.pk)
+        if 'pk' in names:
+            values['pk'] = _sample_pk(callback)
+            if values['pk'] is None:
+                continue
+        path = _REGEX_GROUP.sub(lambda match: str(values[match.group(1)]), route)
+        path = _PATH_CONVERTER.sub(lambda match: str(values[match.group(1)]), path)
+        routes.setdefault(ROUTE_PREFIX + path, route)
+    return routes
+
+
+def _client_for(user):
+    token = CustomTokenObtainPairSerializer.get_token(user).access_token
+    host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+    return Client(HTTP_AUTHORIZATION=f'Bearer {token}', HTTP_HOST=host)
+
+
+def _percentile(samples, share):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(share * (len(ordered) - 1)))]
+
+
+def measure(client, path, repeat):
+    timings, size, status, queries = [], 0, None, 0
+    for _ in range(repeat):
+        captured = []
+
+        def count(execute, sql, params, many, context):
+            captured.append(sql)
+            return execute(sql, params, many, context)
+
+        # Unlike CaptureQueriesContext, also counts the dashboard's pool threads
+        with execute_wrapper(count):
+            started = time.perf_counter()
+            response = client.get(path)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            timings.append((time.perf_counter() - started) * 1000)
+        status, size, queries = response.status_code, len(body), len(captured)
+    return {
+        'status': status,
+        'first_ms': round(timings[0], 2),
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(_percentile(timings, 0.95), 2),
+        'queries': queries,
+        'bytes': size,
+    }
+
+
+def run_benchmark(users, repeat=20):
+    """Call every GET route as each of ``users`` (a role -> User mapping).
+
+    The first call of each route is reported separately as ``first_ms``
+    since it fills the caches; ``queries`` and ``bytes`` come from the last.
+    """
+    routes = discover_routes(users['student'])
+    results = []
+    # Students calling teacher routes would log a warning per call
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.ERROR)
+    try:
+        for role, user in users.items():
+            client = _client_for(user)
+            for path, route in routes.items():
+                results.append({'route': route, 'path': path, 'role': role, **measure(client, path, repeat)})
+    finally:
+        request_logger.setLevel(level)
+    return results
+
+
+def compare(results, baseline):
+    """Pair each result with the baseline run's p50 and query count for the same route and role."""
+    previous = {(row['route'], row['role']): row for row in baseline}
+    for row in results:
+        before = previous.get((row['route'], row['role']))
+        if before:
+            yield row, before
@@ -0,0 +1,307 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .instrumentation import registry, route_name
+from .routing import primary_reads
+
+VERSION_KEY = 'api:version:{}'
+RESPONSE_KEY = 'api:response:{}'
+STUDENT_TAG = 'api:tag:student:{}'
+# The schedules a student's marks are on
+MARKED_SLOTS_TAG = 'api:tag:marked-slots:{}'
+DATE_TAG = 'api:tag:date:{}'
+# Bumped for every month up to a changed date, so listings of all dates
+# from some day on depend on the tag of that day's month alone
+FROM_MONTH_TAG = 'api:tag:from-month:{}'
+# Months around today within which those listings are cached
+MONTHS_BEHIND = 12
+MONTHS_AHEAD = 24
+
+
+def model_version(model):
+    """Current version of a model's table; a millisecond timestamp of its last change."""
+    key = VERSION_KEY.format(model._meta.label_lower)
+    version = cache.get(key)
+    if version is None:
+        # Unknown after a cache flush or restart, so anything cached before is stale
+        version = int(time.time() * 1000)
+        cache.add(key, version, timeout=None)
+        version = cache.get(key, version)
+    return version
+
+
+def _bump_version(key):
+    now = int(time.time() * 1000)
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        version = None
+    if version is None or version < now:
+        cache.set(key, now, timeout=None)
+
+
+def bump_model_version(model):
+    key = VERSION_KEY.format(model._meta.label_lower)
+    _bump_version(key)
+    if transaction.get_connection().in_atomic_block:
+        # A read before the commit would cache the old rows under the new version
+        transaction.on_commit(lambda: _bump_version(key))
+
+
+def model_tag(model):
+    """The key of a model's version, to list among the tags of a StudentCacheMixin response."""
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def _month(day):
+    return day.year * 12 + day.month - 1
+
+
+def month_window(today=None):
+    today = _month(today or date.today())
+    return today - MONTHS_BEHIND, today + MONTHS_AHEAD
+
+
+def from_month_tag(day):
+    """The tag of every listing from ``day`` on, or None when ``day`` is outside month_window()."""
+    low, high = month_window()
+    month = _month(day)
+    return FROM_MONTH_TAG.format(month) if low <= month <= high else None
+
+
+def tag_versions(tags):
+    """Current version of each of ``tags``, read in one cache round trip."""
+    versions = cache.get_many(tags)
+    missing = [tag for tag in tags if tag not in versions]
+    if missing:
+        # As for model_version, an unknown tag starts at the current time
+        now = int(time.time() * 1000)
+        for tag in missing:
+            cache.add(tag, now, timeout=None)
+        versions.update(cache.get_many(missing))
+        versions.update((tag, now) for tag in missing if tag not in versions)
+    return [versions[tag] for tag in tags]
+
+
+def _bump_tags(tags):
+    now = int(time.time() * 1000)
+    current = cache.get_many(tags)
+    cache.set_many({tag: max(now, current.get(tag, 0) + 1) for tag in tags}, timeout=None)
+
+
+def bump_tags(tags):
+    tags = list(tags)
+    if not tags:
+        return
+    _bump_tags(tags)
+    if transaction.get_connection().in_atomic_block:
+        # A read before the commit would cache the old rows under the new versions
+        transaction.on_commit(lambda: _bump_tags(tags))
+
+
+def invalidate_students(student_ids, tag=STUDENT_TAG):
+    """Expire the cached responses that show the marks of ``student_ids``.
+
+    With ``tag=MARKED_SLOTS_TAG``, only those showing the schedules the marks are on.
+    """
+    bump_tags(tag.format(student_id) for student_id in set(student_ids) if student_id is not None)
+
+
+def invalidate_dates(days):
+    """Expire the cached responses that show the schedules or hometasks of ``days``."""
+    days = {date.fromisoformat(day) if isinstance(day, str) else day for day in days if day is not None}
+    if not days:
+        return
+    low, high = month_window()
+    last = min(high, max(_month(day) for day in days))
+    tags = [DATE_TAG.format(day.isoformat()) for day in days]
+    tags.extend(FROM_MONTH_TAG.format(month) for month in range(low, last + 1))
+    bump_tags(tags)
+
+
+class ResponseCache:
+    """Rendered responses kept in this process, least recently used first out past STUDENT_CACHE_MAX_BYTES."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    @property
+    def max_bytes(self):
+        return settings.STUDENT_CACHE_MAX_BYTES
+
+    def get(self, key):
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, entry, size):
+        # One large response must not push out most of the others
+        if size > self.max_bytes // 8:
+            return
+        with self.lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (entry, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+            }
+
+    def clear(self):
+        with self.lock:
+            self._entries = OrderedDict()
+            self.bytes = self.hits = self.misses = self.evictions = 0
+
+
+response_cache = ResponseCache()
+
+
+class StudentCacheMixin:
+    """Serve repeated list requests of the student endpoints from response_cache.
+
+    ``get_cache_tags`` names the version tags a response depends on: the
+    student's (bumped when their marks change), each date's (bumped when its
+    schedules or hometasks change) and model_tag() of the reference models
+    it shows. Any of them moving makes a new key, so writes expire exactly
+    the responses that showed the written rows. Versions live in the default
+    cache: only when it is shared (CACHE_DIR) does every process see a
+    write. With the default per-process cache, other workers keep serving
+    their responses until their own writes or evictions move the versions
+    on. The responses themselves always stay in each process, as rendered
+    bytes. Misses read from the primary, never
+    from a replica that has not caught up with the write behind a version.
+    Change feed requests and other formats than JSON are not cached.
+    """
+    cache_per_user = True
+
+    def get_cache_tags(self):
+        """The tags of the current request, or None to leave it uncached."""
+        return []
+
+    def list(self, request, *args, **kwargs):
+        if 'since' in request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        tags = self.get_cache_tags()
+        if tags is None:
+            return super().list(request, *args, **kwargs)
+
+        user = request.user.pk if self.cache_per_user else None
+        key = hashlib.sha1(
+            f'{user}|{request.get_full_path()}|{request.accepted_media_type}|{tags}|{tag_versions(tags)}'.encode()
+        ).hexdigest()
+        cached = response_cache.get(key)
+        registry.record_cache_lookup((route_name(request), request.method), cached is not None)
+        if cached is not None:
+            return PrerenderedResponse(*cached)
+
+        # A lagging replica would store rows older than the versions just read
+        with primary_reads():
+            response = super().list(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        renderer = request.accepted_renderer
+        content_type = request.accepted_media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        content = renderer.render(response.data, request.accepted_media_type, self.get_renderer_context())
+        headers = {header: value for header, value in response.items() if header != 'Content-Type'}
+        # Only the bytes are kept, they are what STUDENT_CACHE_MAX_BYTES counts
+        entry = (content, content_type, headers)
+        response_cache.set(key, entry, len(content))
+        return PrerenderedResponse(*entry, data=response.data)
+
+
+class PrerenderedResponse(Response):
+    """A Response with its body already rendered; ``data`` is only set when it was just built."""
+
+    def __init__(self, content, content_type, headers, data=None):
+        super().__init__(data, headers=headers)
+        self.prerendered_content = content
+        self.prerendered_content_type = content_type
+
+    @property
+    def rendered_content(self):
+        self['Content-Type'] = self.prerendered_content_type
+        return self.prerendered_content
+
+
+class VersionedCacheMixin:
+    """Cache safe-method list and detail responses until one of ``cache_models`` changes.
+
+    Each model carries a version counter bumped by api.signals on save and
+    delete. Responses are stored under the request path and those versions, and
+    sent with an ``ETag`` and a ``Last-Modified`` so conditional requests get
+    a 304 without touching the database or rendering a body.
+    ``If-None-Match`` takes precedence. ``If-Modified-Since`` only has one
+    second resolution, so it gets a 304 only when every version is strictly
+    older than its second, never for a change made within that second.
+    """
+    cache_models = ()
+    cache_timeout = 60 * 60
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_response(super().retrieve, request, *args, **kwargs)
+
+    def versioned_response(self, handler, request, *args, **kwargs):
+        versions = [model_version(model) for model in self.cache_models]
+        digest = hashlib.sha1(
+            f'{request.get_full_path()}|{request.accepted_media_type}|{versions}'.encode()
+        ).hexdigest()
+        etag = quote_etag(digest)
+        last_modified = max(versions) if versions else None
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if last_modified is not None:
+            headers['Last-Modified'] = http_date(last_modified // 1000)
+
+        if self.not_modified(request, etag, last_modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        key = RESPONSE_KEY.format(digest)
+        data = cache.get(key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            cache.set(key, data, self.cache_timeout)
+        return Response(data, headers=headers)
+
+    @staticmethod
+    def not_modified(request, etag, last_modified):
+        """Whether the conditional headers match, ``last_modified`` being a version in milliseconds."""
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in (tag.strip() for tag in if_none_match.split(',')) or if_none_match.strip() == '*'
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        return last_modified is not None and if_modified_since is not None and last_modified < if_modified_since * 1000
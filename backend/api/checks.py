@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared(alias='default'):
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+@register(Tags.security)
+def check_stateless_auth_cache(app_configs, **kwargs):
+    """Token revocation must reach every worker, or demoted users keep their old role."""
+    if not settings.JWT_STATELESS_AUTH or cache_is_shared():
+        return []
+    return [Error(
+        'JWT_STATELESS_AUTH needs a cache shared by every worker process.',
+        hint=(
+            'Revoked tokens are kept in the default cache. A per-process cache only revokes them in the '
+            'process that handled the demotion or deactivation. Set CACHE_DIR or configure a shared backend.'
+        ),
+        id='api.E001',
+    )]
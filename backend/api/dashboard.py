@@ -0,0 +1,104 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import OuterRef, Subquery
+
+from .expansion import related_lookups
+from .instrumentation import inherited_execute_wrappers
+from .models import Schedule, Mark, HomeTask
+from .serializers import HomeTaskSerializer, MarkSerializer
+from .timetable import SNAPSHOT_RELATIONS, student_timetable
+
+RECENT_MARKS = 10
+HOMETASK_DAYS = 7
+
+
+def schedule_with_marks(student_id, start, end):
+    """Schedules between ``start`` and ``end`` annotated with the student's mark as ``student_mark``."""
+    student_mark = Mark.objects.filter(schedule=OuterRef('pk'), student_id=student_id)
+    return (
+        Schedule.objects.filter(date__range=(start, end))
+        .annotate(student_mark=Subquery(student_mark.values('mark')[:1]))
+        .order_by('date', 'period__number')
+    )
+
+
+@lru_cache(maxsize=None)
+def _executor():
+    return ThreadPoolExecutor(settings.DASHBOARD_WORKERS, thread_name_prefix='dashboard')
+
+
+def _in_worker(part):
+    try:
+        # Request metrics and benchmark query counts wrap the caller's connections only
+        with inherited_execute_wrappers():
+            return part()
+    finally:
+        # Pool threads outlive requests, treat each part like one for CONN_MAX_AGE
+        close_old_connections()
+
+
+def run_parts(parts):
+    """Call each of ``parts`` (name -> callable) and return name -> result.
+
+    The parts run concurrently on a shared thread pool, each thread with its
+    own database connection. They run in a copy of the caller's context, so
+    replica routing applies to them, and with its execute wrappers installed.
+    Inside a transaction the other connections would not see its writes, so
+    the parts run one after another instead.
+    """
+    if settings.DASHBOARD_WORKERS <= 1 or connection.in_atomic_block:
+        return {name: part() for name, part in parts.items()}
+    futures = {
+        name: _executor().submit(contextvars.copy_context().run, _in_worker, part)
+        for name, part in parts.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+
+def _serialize(serializer_class, queryset, request, expand, limit=None):
+    serializer = serializer_class(many=True, context={'request': request}, expand=expand)
+    serializer.instance = queryset.select_related(*related_lookups(serializer))[:limit]
+    return serializer.data
+
+
+def build_student_dashboard(request, day):
+    """Everything the student dashboard shows for ``day`` in one payload.
+
+    ``today`` is the day's timetable with the student's mark on each slot,
+    ``recent_marks`` the latest marks and ``hometasks`` those set for the
+    next HOMETASK_DAYS days. Relations come expanded as the separate
+    student endpoints return them with ``?expand=``.
+    """
+    user = request.user
+    parts = run_parts({
+        'today': lambda: student_timetable(user.pk, day, day, SNAPSHOT_RELATIONS),
+        'recent_marks': lambda: _serialize(
+            MarkSerializer,
+            Mark.objects.filter(student_id=user.pk).order_by('-schedule__date', '-id'),
+            request,
+            'schedule.lesson,schedule.period',
+            limit=RECENT_MARKS,
+        ),
+        'hometasks': lambda: _serialize(
+            HomeTaskSerializer,
+            HomeTask.objects.filter(schedule__date__range=(day, day + timedelta(days=HOMETASK_DAYS)))
+            .order_by('schedule__date', 'schedule__period__number'),
+            request,
+            'schedule.lesson,schedule.period',
+        ),
+    })
+    return {
+        'user': {
+            'id': user.pk,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+        },
+        'date': day,
+        **parts,
+    }
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import secrets
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+BROADCAST_CHANNEL = 'students'
+# Seconds between keep-alive comments on an idle stream
+STREAM_HEARTBEAT = 15
+TICKET_KEY = 'api:events:ticket:{}'
+# Seconds a stream ticket stays redeemable
+STREAM_TICKET_SECONDS = 30
+
+
+def student_channel(student_id):
+    return f'student:{student_id}'
+
+
+class InProcessBroker:
+    """Fans events out to subscribers in this process.
+
+    Enough for a single ASGI worker and for tests. A multi-node deployment
+    plugs in a broker with the same ``publish``/``subscribe`` interface
+    through the EVENT_BROKER setting.
+    """
+    queue_size = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, event):
+        """Deliver an event; safe to call from sync code on any thread."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for queue, loop in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    @staticmethod
+    def _offer(queue, event):
+        # A client that stopped reading loses events rather than growing memory
+        if not queue.full():
+            queue.put_nowait(event)
+
+    def subscribe(self, channels, heartbeat=None):
+        """Start receiving events on ``channels``; iterate the result with ``async for``.
+
+        Must be called from a running event loop. The subscription yields None
+        every ``heartbeat`` idle seconds and must be closed when done.
+        """
+        return Subscription(self, channels, heartbeat)
+
+    def _register(self, channels, entry):
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(entry)
+
+    def _unregister(self, channels, entry):
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].discard(entry)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+class Subscription:
+    def __init__(self, broker, channels, heartbeat):
+        self.broker = broker
+        self.channels = list(channels)
+        self.heartbeat = heartbeat
+        self.queue = asyncio.Queue(broker.queue_size)
+        self.entry = (self.queue, asyncio.get_running_loop())
+        broker._register(self.channels, self.entry)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await asyncio.wait_for(self.queue.get(), self.heartbeat)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker._unregister(self.channels, self.entry)
+
+
+def issue_stream_ticket(user_id):
+    """A single use ticket that opens ``user_id``'s event stream.
+
+    EventSource cannot send headers, so the stream is authenticated from
+    the URL; a ticket there is worthless once used or after
+    STREAM_TICKET_SECONDS, unlike an access token in the access logs.
+    Tickets live in the default cache, so only processes sharing it can
+    redeem them.
+    """
+    ticket = secrets.token_urlsafe(32)
+    cache.set(TICKET_KEY.format(ticket), user_id, STREAM_TICKET_SECONDS)
+    return ticket
+
+
+async def redeem_stream_ticket(ticket):
+    """The user id ``ticket`` was issued to, or None when it is unknown, expired or already used."""
+    key = TICKET_KEY.format(ticket)
+    user_id = await cache.aget(key)
+    if user_id is not None:
+        await cache.adelete(key)
+    return user_id
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.EVENT_BROKER)()
+
+
+def publish_on_commit(channel, event):
+    transaction.on_commit(lambda: get_broker().publish(channel, event))
+
+
+def mark_event(mark, action):
+    return {
+        'type': 'mark',
+        'action': action,
+        'id': mark.pk,
+        'schedule_id': mark.schedule_id,
+        'mark': mark.mark,
+    }
+
+
+def hometask_event(hometask, action):
+    return {
+        'type': 'hometask',
+        'action': action,
+        'id': hometask.pk,
+        'schedule_id': hometask.schedule_id,
+        'description': hometask.description,
+    }
+
+
+def format_sse(event, event_id):
+    data = json.dumps(event, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return f'id: {event_id}\nevent: {event["type"]}\ndata: {data}\n\n'
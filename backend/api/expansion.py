@@ -0,0 +1,122 @@
+from rest_framework import serializers
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def parse_paths(value):
+    """``'id,schedule.lesson'`` as ``{'id': [], 'schedule': ['lesson']}``, or None when not given."""
+    if value is None:
+        return None
+    paths = {}
+    for path in value.split(','):
+        head, _, rest = path.strip().partition('.')
+        if head:
+            paths.setdefault(head, [])
+            if rest:
+                paths[head].append(rest)
+    return paths
+
+
+class ExpandableFieldsMixin:
+    """Sparse fieldsets and explicit expansion for a serializer.
+
+    Relations in ``expandable_fields`` (name -> serializer class) render as
+    the related id unless listed in ``expand``, so an unexpanded relation
+    costs no query. ``fields`` limits the output to the named fields.
+    Both take comma separated names, dotted to reach into an expanded
+    relation: ``?expand=schedule.lesson&fields=id,mark,schedule.date``.
+    The top-level serializer reads them from the query string of a safe
+    request, nested ones get them from their parent.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, fields=None, expand=None, keep_id=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if fields is None and expand is None and request is not None and request.method in SAFE_METHODS:
+            fields = request.query_params.get('fields')
+            expand = request.query_params.get('expand')
+            # Side-loading replaces expanded objects by their id, so it must be output
+            keep_id = 'sideload' in request.query_params
+        self._requested_fields = parse_paths(fields) if isinstance(fields, str) else fields
+        self._expand = parse_paths(expand) if isinstance(expand, str) else (expand or {})
+        self._keep_id = keep_id
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name, serializer_class in self.expandable_fields.items():
+            if name in self._expand:
+                subfields = self._requested_fields.get(name) if self._requested_fields else None
+                fields[name] = serializer_class(
+                    read_only=True,
+                    fields=','.join(subfields) if subfields else None,
+                    expand=','.join(self._expand[name]),
+                    keep_id=self._keep_id,
+                )
+            elif not isinstance(fields.get(name), serializers.RelatedField):
+                # Reads the foreign key column, the related row is never loaded
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        if self._requested_fields:
+            keep = set(self._requested_fields) | ({'id'} if self._keep_id else set())
+            fields = {name: field for name, field in fields.items() if name in keep or field.write_only}
+        return fields
+
+
+def related_lookups(serializer, prefix=''):
+    """``select_related()`` lookups for every nested serializer ``serializer`` will output."""
+    serializer = getattr(serializer, 'child', serializer)
+    for field in serializer.fields.values():
+        if isinstance(field, serializers.BaseSerializer) and not field.write_only and field.source != '*':
+            if isinstance(field, serializers.ListSerializer):
+                continue
+            lookup = prefix + field.source.replace('.', '__')
+            yield lookup
+            yield from related_lookups(field, lookup + '__')
+
+
+def _collect(serializer, row, included):
+    for name, field in serializer.fields.items():
+        if name not in serializer._expand or name not in serializer.expandable_fields or name not in row:
+            continue
+        value = row[name]
+        if value is None:
+            continue
+        _collect(field, value, included)
+        model = field.Meta.model
+        included.setdefault(str(model._meta.verbose_name_plural), {}).setdefault(value['id'], value)
+        row[name] = value['id']
+
+
+def sideload(serializer, rows):
+    """Move expanded relations of ``rows`` into a de-duplicated ``included`` section.
+
+    Each expanded object is replaced by its id and listed once under its
+    model's plural name, expanded relations of its own side-loaded as well.
+    """
+    serializer = getattr(serializer, 'child', serializer)
+    included = {}
+    for row in rows:
+        _collect(serializer, row, included)
+    return {name: list(objects.values()) for name, objects in included.items()}
+
+
+class ExpandableViewMixin:
+    """Loads only the relations the request expands, and answers ``?sideload``."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        lookups = list(related_lookups(self.get_serializer()))
+        return queryset.select_related(*lookups) if lookups else queryset
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if 'sideload' not in request.query_params or response.status_code != 200:
+            return response
+        data = response.data
+        rows = data['results'] if isinstance(data, dict) else data
+        included = sideload(self.get_serializer(), rows)
+        if isinstance(data, dict):
+            data['included'] = included
+        else:
+            response.data = {'results': data, 'included': included}
+        return response
@@ -0,0 +1,273 @@
+import csv
+import io
+import zipfile
+from datetime import date, datetime, time
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import Schedule, Mark, HomeTask
+from .pagination import keyset_filter
+
+# Rows fetched per database round trip and written per streamed chunk
+EXPORT_CHUNK_SIZE = 2000
+
+# Each dataset is a list of (column, values() lookup) pairs, a base queryset
+# factory and the date field the ``start``/``end`` parameters filter on.
+# Orderings end on ``id`` so keyset chunks never split ties.
+EXPORTS = {
+    'marks': {
+        'columns': [
+            ('id', 'id'),
+            ('date', 'schedule__date'),
+            ('period', 'schedule__period__number'),
+            ('lesson', 'schedule__lesson__name'),
+            ('student_id', 'student_id'),
+            ('username', 'student__username'),
+            ('first_name', 'student__first_name'),
+            ('last_name', 'student__last_name'),
+            ('mark', 'mark'),
+        ],
+        'queryset': lambda: Mark.objects.order_by('schedule__date', 'schedule__period__number', 'student_id', 'id'),
+        'date_field': 'schedule__date',
+    },
+    'schedules': {
+        'columns': [
+            ('id', 'id'),
+            ('date', 'date'),
+            ('period', 'period__number'),
+            ('start_time', 'period__start_time'),
+            ('end_time', 'period__end_time'),
+            ('lesson', 'lesson__name'),
+        ],
+        'queryset': lambda: Schedule.objects.order_by('date', 'period__number', 'id'),
+        'date_field': 'date',
+    },
+    'hometasks': {
+        'columns': [
+            ('id', 'id'),
+            ('date', 'schedule__date'),
+            ('period', 'schedule__period__number'),
+            ('lesson', 'schedule__lesson__name'),
+            ('description', 'description'),
+        ],
+        'queryset': lambda: HomeTask.objects.order_by('schedule__date', 'schedule__period__number', 'id'),
+        'date_field': 'schedule__date',
+    },
+}
+
+
+class CSVEncoder:
+    def __init__(self, columns):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.writer.writerow(columns)
+
+    def encode(self, chunk):
+        self.writer.writerows(chunk)
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def finish(self):
+        return self.buffer.getvalue()
+
+
+class NDJSONEncoder:
+    def __init__(self, columns):
+        self.columns = columns
+        self.encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+    def encode(self, chunk):
+        return ''.join(self.encoder.encode(dict(zip(self.columns, row))) + '\n' for row in chunk)
+
+    def finish(self):
+        return ''
+
+
+class _ZipStream:
+    """Write-only file object that hands the bytes zipfile produced so far to a generator."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '<Relationship Id="rId2" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        '</Relationships>'
+    ),
+    # Style 1 shows a date serial as a date
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font/></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+        '<cellXfs count="2"><xf/><xf numFmtId="14" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return f'<c s="1"><v>{(value - _EXCEL_EPOCH).days}</v></c>'
+    if isinstance(value, time):
+        value = value.strftime('%H:%M')
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_rows(rows):
+    return ''.join('<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>' for row in rows)
+
+
+class XLSXEncoder:
+    """A single-sheet workbook, zipped as it is written.
+
+    Cells use inline strings rather than a shared string table, so nothing
+    but the current chunk is held in memory.
+    """
+
+    def __init__(self, columns, sheet='Export'):
+        self.out = _ZipStream()
+        self.archive = zipfile.ZipFile(self.out, 'w', zipfile.ZIP_DEFLATED)
+        for name, content in _XLSX_PARTS.items():
+            self.archive.writestr(name, content.replace('{sheet}', escape(sheet)))
+        self.worksheet = self.archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        self.worksheet.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            + _xlsx_rows([columns])
+        ).encode())
+
+    def encode(self, chunk):
+        self.worksheet.write(_xlsx_rows(chunk).encode())
+        return self.out.drain()
+
+    def finish(self):
+        self.worksheet.write(b'</sheetData></worksheet>')
+        self.worksheet.close()
+        self.archive.close()
+        return self.out.drain()
+
+
+FORMATS = {
+    'csv': (CSVEncoder, 'text/csv; charset=utf-8'),
+    'ndjson': (NDJSONEncoder, 'application/x-ndjson'),
+    'xlsx': (XLSXEncoder, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+class ExportStream:
+    """Encoded parts of an export, one keyset chunk of flat rows per part.
+
+    Every chunk is its own bounded query starting after the last row of the
+    previous one, so no cursor stays open between parts and a part can be
+    produced on whichever thread asks for it.
+    """
+
+    def __init__(self, queryset, lookups, encoder, chunk_size=None):
+        self.fields = list(queryset.query.order_by)
+        self.width = len(lookups)
+        self.rows = queryset.values_list(*lookups, *(field.lstrip('-') for field in self.fields))
+        self.encoder = encoder
+        self.chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+        self.after = None
+        self.done = False
+
+    def next_part(self):
+        """The next encoded part, or None once the export is complete."""
+        if self.done:
+            return None
+        rows = self.rows
+        if self.after is not None:
+            rows = rows.filter(keyset_filter(self.fields, self.after))
+        chunk = list(rows[:self.chunk_size])
+        if len(chunk) < self.chunk_size:
+            self.done = True
+        if chunk:
+            self.after = chunk[-1][self.width:]
+        part = self.encoder.encode([row[:self.width] for row in chunk])
+        return part + self.encoder.finish() if self.done else part
+
+    def __iter__(self):
+        return iter(self.next_part, None)
+
+    async def __aiter__(self):
+        # Queries and encoding run off the event loop, one chunk at a time
+        next_part = sync_to_async(self.next_part)
+        while (part := await next_part()) is not None:
+            yield part
+
+
+def export_response(dataset, queryset, extension, asynchronous=False):
+    """Stream a filtered dataset queryset as a file download.
+
+    Rows are read as flat tuples in keyset chunks so memory stays flat
+    however many rows the export holds. Under ASGI pass ``asynchronous``:
+    Django would collect a synchronous iterator into a list before sending
+    anything.
+    """
+    columns, lookups = zip(*EXPORTS[dataset]['columns'])
+    encoder, content_type = FORMATS[extension]
+    stream = ExportStream(queryset, lookups, encoder(list(columns)))
+    response = StreamingHttpResponse(aiter(stream) if asynchronous else iter(stream), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{extension}"'
+    return response
@@ -0,0 +1,159 @@
+from operator import itemgetter
+
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.response import Response
+
+from .instrumentation import serializer_timing
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the stdlib encoder is used instead
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson when it is installed.
+
+    Output is byte-for-byte what JSONRenderer produces for compact, non-ASCII
+    escaped JSON, which is what the API sends. Indented output, other
+    renderer settings and anything orjson cannot encode go through the
+    standard encoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or not settings.FAST_READ_PATH
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer escapes these so the output is also valid JavaScript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+# Fields whose to_representation returns a values() column unchanged
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+
+def _converter(field):
+    def convert(value):
+        return None if value is None else field.to_representation(value)
+    return convert
+
+
+def serializer_shape(serializer, prefix=''):
+    """The RowShape spec of what ``serializer`` outputs, or None if a field needs the model instance."""
+    serializer = getattr(serializer, 'child', serializer)
+    shape = {}
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source == '*' or isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+            return None
+        lookup = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.BaseSerializer):
+            nested = serializer_shape(field, lookup + '__')
+            if nested is None:
+                return None
+            shape[name] = nested
+        elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+            # values() returns the foreign key column for the relation name
+            shape[name] = lookup
+        elif isinstance(field, (serializers.RelatedField, serializers.SerializerMethodField,
+                                serializers.ReadOnlyField, serializers.MultipleChoiceField)):
+            return None
+        elif isinstance(field, PASSTHROUGH_FIELDS + (serializers.ChoiceField,)):
+            shape[name] = lookup
+        else:
+            shape[name] = (lookup, _converter(field))
+    return shape
+
+
+class RowShape:
+    """Builds serializer-shaped dicts from ``values()`` rows.
+
+    ``shape`` maps output keys, in output order, to a ``values()`` lookup,
+    a ``(lookup, converter)`` pair or a nested shape. The shape is compiled
+    once into getters, so building a row is a dict comprehension per level.
+    """
+
+    def __init__(self, shape):
+        self.lookups = []
+        self._build = self._compile(shape)
+
+    def _compile(self, shape):
+        getters = []
+        for key, spec in shape.items():
+            if isinstance(spec, dict):
+                getters.append((key, self._compile(spec)))
+                continue
+            lookup, convert = spec if isinstance(spec, tuple) else (spec, None)
+            if lookup not in self.lookups:
+                self.lookups.append(lookup)
+            getter = itemgetter(lookup)
+            if convert is not None:
+                getter = (lambda get, convert: lambda row: convert(get(row)))(getter, convert)
+            getters.append((key, getter))
+        return lambda row: {key: getter(row) for key, getter in getters}
+
+    def build(self, rows):
+        build = self._build
+        return [build(row) for row in rows]
+
+
+class FastListMixin:
+    """Serve ``list`` from ``values()`` rows shaped like the serializer's output.
+
+    The shape follows ``?fields=``/``?expand=`` and is compiled once per
+    combination. Serializers with fields that need a model instance, side
+    loaded responses, ``retrieve``, writes and the change feed go through
+    the serializer as before. FAST_READ_PATH turns it off.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    max_fast_shapes = 128
+    _fast_shapes = None
+
+    def get_fast_shape(self):
+        params = self.request.query_params
+        key = (self.get_serializer_class(), params.get('fields'), params.get('expand'))
+        shapes = type(self)._fast_shapes
+        if shapes is None or len(shapes) >= self.max_fast_shapes:
+            shapes = type(self)._fast_shapes = {}
+        if key not in shapes:
+            spec = serializer_shape(self.get_serializer())
+            shapes[key] = RowShape(spec) if spec is not None else None
+        return shapes[key]
+
+    def list(self, request, *args, **kwargs):
+        shape = self.get_fast_shape() if settings.FAST_READ_PATH and 'sideload' not in request.query_params else None
+        if shape is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lookups = list(shape.lookups)
+        paginator = self.paginator
+        if paginator is not None:
+            # The keyset paginator reads the cursor values from the rows
+            for field in paginator.get_ordering(request, queryset, self):
+                if field.lstrip('-') not in lookups:
+                    lookups.append(field.lstrip('-'))
+        rows = queryset.values(*lookups)
+
+        if paginator is not None:
+            rows = paginator.paginate_queryset(rows, request, view=self)
+        with serializer_timing(request):
+            data = shape.build(rows)
+        if paginator is not None:
+            return paginator.get_paginated_response(data)
+        return Response(data)
@@ -0,0 +1,73 @@
+from django.contrib.auth.models import User
+from django.db.models import Avg
+
+from .models import Lesson
+
+
+def _index(values):
+    return {value: i for i, value in enumerate(values)}
+
+
+def build_gradebook(marks, per_student=False):
+    """Pivot a Mark queryset into a lesson x date matrix.
+
+    Lessons, dates and (for a class) students are listed once and every mark
+    is a compact ``[lesson, date, mark]`` cell of indexes into those lists,
+    prefixed with the student index when ``per_student`` is set. Averages are
+    aggregated by the database rather than computed from the cells.
+
+    The reads are separate statements, so a concurrent write can add a mark,
+    or delete a lesson or student, between them. Rows that refer to
+    something the earlier reads did not list are left out rather than
+    failing the request.
+    """
+    marks = marks.order_by()
+    rows = list(
+        marks.order_by('schedule__date', 'schedule__period__number', 'student_id')
+        .values_list('student_id', 'schedule__lesson_id', 'schedule__date', 'mark')
+    )
+
+    lessons = list(
+        Lesson.objects.filter(id__in={row[1] for row in rows}).order_by('name').values('id', 'name')
+    )
+    lesson_index = _index(lesson['id'] for lesson in lessons)
+    rows = [row for row in rows if row[1] in lesson_index]
+    dates = sorted({row[2] for row in rows})
+    date_index = _index(dates)
+
+    averages = [None] * len(lessons)
+    for row in marks.values('schedule__lesson_id').annotate(average=Avg('mark')):
+        if row['schedule__lesson_id'] in lesson_index:
+            averages[lesson_index[row['schedule__lesson_id']]] = round(row['average'], 2)
+
+    gradebook = {
+        'lessons': lessons,
+        'dates': dates,
+        'averages': averages,
+    }
+
+    if not per_student:
+        gradebook['cells'] = [[lesson_index[lesson], date_index[day], mark] for _, lesson, day, mark in rows]
+        return gradebook
+
+    students = [
+        {'id': student['id'], 'name': f"{student['first_name']} {student['last_name']}".strip() or student['username']}
+        for student in User.objects.filter(id__in={row[0] for row in rows})
+        .order_by('last_name', 'first_name', 'username')
+        .values('id', 'username', 'first_name', 'last_name')
+    ]
+    student_index = _index(student['id'] for student in students)
+    gradebook['students'] = students
+    gradebook['cells'] = [
+        [student_index[student], lesson_index[lesson], date_index[day], mark]
+        for student, lesson, day, mark in rows
+        if student in student_index
+    ]
+    gradebook['student_averages'] = [
+        [student_index[row['student_id']], lesson_index[row['schedule__lesson_id']], round(row['average'], 2)]
+        for row in marks.values('student_id', 'schedule__lesson_id')
+        .annotate(average=Avg('mark'))
+        .order_by('student_id', 'schedule__lesson_id')
+        if row['student_id'] in student_index and row['schedule__lesson_id'] in lesson_index
+    ]
+    return gradebook
@@ -0,0 +1,319 @@
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger('api.slow_queries')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Execute wrappers of the current request, for the threads that run parts of it
+_execute_wrappers = ContextVar('api_execute_wrappers', default=())
+
+
+class Histogram:
+    """A Prometheus histogram kept in this process, labelled by route and method."""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            label_text = _labels(labels)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._series = {}
+
+    def inc(self, labels, amount=1):
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._series.items()):
+            lines.append(f'{self.name}_total{{{_labels(labels)}}} {value}')
+        return lines
+
+
+def _labels(labels):
+    route, method = labels
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'route="{route}",method="{method}"'
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.duration = Histogram('ediary_request_duration_seconds', 'Time to produce the response.', DURATION_BUCKETS)
+        self.db = Histogram('ediary_request_db_seconds', 'Time spent in SQL.', DURATION_BUCKETS)
+        self.serialize = Histogram(
+            'ediary_request_serialize_seconds', 'Time in serializers and fast path row building, outside SQL.',
+            DURATION_BUCKETS,
+        )
+        self.view = Histogram(
+            'ediary_request_view_seconds', 'Time in the view outside SQL and serializers.', DURATION_BUCKETS
+        )
+        self.render = Histogram('ediary_request_render_seconds', 'Time rendering the response body.', DURATION_BUCKETS)
+        self.queries = Histogram('ediary_request_queries', 'SQL queries per request.', QUERY_BUCKETS)
+        self.slow_queries = Counter('ediary_slow_queries', 'Queries slower than METRICS_SLOW_QUERY_MS.')
+        self.cache_hits = Counter('ediary_student_cache_hits', 'Student responses served from the response cache.')
+        self.cache_misses = Counter('ediary_student_cache_misses', 'Student responses built for the response cache.')
+
+    def record(self, labels, metrics):
+        with self.lock:
+            self.duration.observe(labels, metrics.total)
+            self.db.observe(labels, metrics.db_time)
+            self.serialize.observe(labels, metrics.serialize_time)
+            self.view.observe(labels, metrics.view_time)
+            self.render.observe(labels, metrics.render_time)
+            self.queries.observe(labels, metrics.queries)
+            if metrics.slow_queries:
+                self.slow_queries.inc(labels, metrics.slow_queries)
+
+    def record_cache_lookup(self, labels, hit):
+        with self.lock:
+            (self.cache_hits if hit else self.cache_misses).inc(labels)
+
+    def expose(self):
+        with self.lock:
+            lines = []
+            for metric in (
+                self.duration, self.db, self.serialize, self.view, self.render, self.queries, self.slow_queries,
+                self.cache_hits, self.cache_misses,
+            ):
+                lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        self.__init__()
+
+
+registry = Registry()
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """Install ``wrapper`` on this thread's connections for the duration of the block.
+
+    Threads running in a copy of the current context install it on their
+    own connections with inherited_execute_wrappers().
+    """
+    token = _execute_wrappers.set(_execute_wrappers.get() + (wrapper,))
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(wrapper))
+            yield
+    finally:
+        _execute_wrappers.reset(token)
+
+
+@contextmanager
+def inherited_execute_wrappers():
+    """Install the execute_wrapper() wrappers of the context this thread runs in on its connections."""
+    with ExitStack() as stack:
+        for wrapper in _execute_wrappers.get():
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    if not match.route:
+        return match.view_name
+    # Router patterns are regexes, 'api/^teacher/marks/$' reads better without anchors
+    return match.route.replace('^', '').replace('$', '')
+
+
+class RequestMetrics:
+    def __init__(self, request):
+        self.request = request
+        self.started_at = time.perf_counter()
+        # Dashboard parts run their queries on pool threads
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.slow_queries = 0
+        self.db_time = 0.0
+        self.view_started = self.view_finished = None
+        self.db_before_view = self.db_after_view = 0.0
+        self.total = self.serialize_time = self.view_time = self.render_time = 0.0
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            slow = elapsed * 1000 >= settings.METRICS_SLOW_QUERY_MS
+            with self.lock:
+                self.queries += 1
+                self.db_time += elapsed
+                self.slow_queries += slow
+            if slow:
+                logger.warning(
+                    'Slow query (%.1f ms) on %s %s: %s',
+                    elapsed * 1000, self.request.method, route_name(self.request), sql,
+                    extra={'sql': sql, 'duration': elapsed},
+                )
+
+    @contextmanager
+    def serializing(self):
+        """Count the block as serializer time, less the SQL it runs."""
+        started, db_before = time.perf_counter(), self.db_time
+        try:
+            yield
+        finally:
+            self.serialize_time += max(0.0, time.perf_counter() - started - (self.db_time - db_before))
+
+    def finish(self):
+        finished = time.perf_counter()
+        self.total = finished - self.started_at
+        if self.view_started is not None and self.view_finished is not None:
+            view_time = self.view_finished - self.view_started
+            self.view_time = max(0.0, view_time - (self.db_after_view - self.db_before_view) - self.serialize_time)
+            self.render_time = finished - self.view_finished
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize_time * 1000:.1f}',
+            f'view;dur={self.view_time * 1000:.1f}',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={self.total * 1000:.1f}',
+        ])
+
+
+class RequestMetricsMiddleware:
+    """Times SQL, view and rendering work for a sample of requests.
+
+    Sampled responses carry a ``Server-Timing`` header and feed the per
+    route histograms served at /metrics. ``serialize`` is the time spent in
+    serializers and fast path row building, as timed by views with
+    SerializerTimingMixin, ``view`` the rest of the view outside SQL, and
+    ``render`` is turning the response data into bytes. Queries slower than METRICS_SLOW_QUERY_MS are
+    logged to ``api.slow_queries`` without their parameters, which carry
+    user data.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = settings.METRICS_SAMPLE_RATE
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+
+        metrics = request._request_metrics = RequestMetrics(request)
+        with execute_wrapper(metrics.execute):
+            response = self.get_response(request)
+        metrics.finish()
+
+        registry.record((route_name(request), request.method), metrics)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, '_request_metrics', None)
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
+            metrics.db_before_view = metrics.db_time
+
+    def process_template_response(self, request, response):
+        # Called between the view returning a DRF Response and its rendering
+        metrics = getattr(request, '_request_metrics', None)
+        if metrics is not None:
+            metrics.view_finished = time.perf_counter()
+            metrics.db_after_view = metrics.db_time
+        return response
+
+
+def _is_admin(request):
+    """IsAdminUser for a plain Django view, authenticating like the API or the admin site."""
+    authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES] + [SessionAuthentication()]
+    try:
+        return IsAdminUser().has_permission(Request(request, authenticators=authenticators), None)
+    except APIException:
+        return False
+
+
+def serializer_timing(request):
+    """A context manager counting its block as the request's serializer time, when the request is sampled."""
+    metrics = getattr(request, '_request_metrics', None)
+    return metrics.serializing() if metrics is not None else nullcontext()
+
+
+@lru_cache(maxsize=None)
+def _timed_serializer_class(serializer_class):
+    def data(self):
+        with serializer_timing(self.context.get('request')):
+            return super(timed, self).data
+
+    timed = type(serializer_class.__name__, (serializer_class,), {'data': property(data)})
+    return timed
+
+
+class SerializerTimingMixin:
+    """Report the time reading ``serializer.data`` takes as the ``serialize`` timing."""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if getattr(self.request, '_request_metrics', None) is not None:
+            serializer.__class__ = _timed_serializer_class(type(serializer))
+        return serializer
+
+
+def metrics_view(request):
+    """Prometheus text exposition of the histograms gathered by this process.
+
+    Scrapers send ``Bearer METRICS_TOKEN``; without a token configured only
+    staff users may read it.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = request.headers.get('Authorization') == f'Bearer {token}'
+    else:
+        allowed = _is_admin(request)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,168 @@
+import csv
+import json
+import logging
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Avg, Count, Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import worker
+from .models import Job, Lesson, Mark
+
+logger = logging.getLogger('api.jobs')
+
+REPORT_CARD_BATCH = 200
+REPORT_CARD_COLUMNS = ['student_id', 'student', 'lesson', 'count', 'average', 'minimum', 'maximum']
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """Handed to a job handler to report progress and save its result."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, processed, total):
+        """Record progress, raising JobCancelled once the job has been cancelled."""
+        updated = Job.objects.filter(pk=self.job.pk, cancel_requested=False).update(
+            processed=processed, total=total, updated_at=timezone.now()
+        )
+        if not updated:
+            raise JobCancelled()
+
+    def save_result(self, name, content):
+        self.job.result.save(f'{self.job.pk}/{name}', ContentFile(content.encode()), save=False)
+
+
+def _student_name(student):
+    return f"{student['first_name']} {student['last_name']}".strip() or student['username']
+
+
+def report_cards(context, params):
+    """Per lesson mark count, average, minimum and maximum of each student within ``start``/``end``.
+
+    Covers one ``student`` or the whole class, written as JSON or CSV
+    depending on ``format``. Students are aggregated in batches of
+    REPORT_CARD_BATCH, with progress reported between batches.
+    """
+    start, end = parse_date(params['start']), parse_date(params['end'])
+    students = User.objects.filter(profile__role='student').order_by('last_name', 'first_name', 'username')
+    if params.get('student'):
+        students = students.filter(pk=params['student'])
+    students = list(students.values('id', 'username', 'first_name', 'last_name'))
+    lessons = dict(Lesson.objects.values_list('id', 'name'))
+
+    cards = []
+    context.progress(0, len(students))
+    for offset in range(0, len(students), REPORT_CARD_BATCH):
+        batch = students[offset:offset + REPORT_CARD_BATCH]
+        rows = (
+            Mark.objects.filter(student_id__in=[student['id'] for student in batch], schedule__date__range=(start, end))
+            .values('student_id', 'schedule__lesson_id')
+            .annotate(count=Count('id'), average=Avg('mark'), minimum=Min('mark'), maximum=Max('mark'))
+            .order_by()
+        )
+        by_student = {}
+        for row in rows:
+            by_student.setdefault(row['student_id'], []).append({
+                'lesson': lessons.get(row['schedule__lesson_id']),
+                'count': row['count'],
+                'average': round(row['average'], 2),
+                'minimum': row['minimum'],
+                'maximum': row['maximum'],
+            })
+        for student in batch:
+            cards.append({
+                'student_id': student['id'],
+                'student': _student_name(student),
+                'lessons': sorted(by_student.get(student['id'], []), key=lambda lesson: lesson['lesson'] or ''),
+            })
+        context.progress(offset + len(batch), len(students))
+
+    if params.get('format') == 'csv':
+        out = StringIO()
+        writer = csv.writer(out)
+        writer.writerow(REPORT_CARD_COLUMNS)
+        for card in cards:
+            for lesson in card['lessons']:
+                writer.writerow([card['student_id'], card['student'], *(lesson[column] for column in REPORT_CARD_COLUMNS[2:])])
+        context.save_result('report-cards.csv', out.getvalue())
+    else:
+        payload = {'start': start, 'end': end, 'students': cards}
+        context.save_result('report-cards.json', json.dumps(payload, cls=DjangoJSONEncoder))
+
+
+JOB_HANDLERS = {
+    'report_cards': report_cards,
+}
+
+
+def claim_next_job():
+    """Mark the oldest queued job as running and return it, or None when the queue is empty.
+
+    The conditional UPDATE is the lock, so workers sharing the database
+    never take the same job.
+    """
+    while True:
+        job = Job.objects.filter(status=Job.QUEUED).order_by('created_at', 'id').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        if Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(status=Job.RUNNING, started_at=now, updated_at=now):
+            job.status, job.started_at = Job.RUNNING, now
+            return job
+
+
+def requeue_stale_jobs():
+    """Queue again the running jobs that stopped reporting progress, left behind by a worker that died."""
+    stale_before = timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER)
+    return Job.objects.filter(status=Job.RUNNING, updated_at__lt=stale_before).update(
+        status=Job.QUEUED, processed=0, total=0, started_at=None
+    )
+
+
+def run_job(job_id):
+    """Run a claimed job to completion and record how it ended; returns the final status."""
+    job = Job.objects.get(pk=job_id)
+    try:
+        JOB_HANDLERS[job.kind](JobContext(job), job.params)
+    except JobCancelled:
+        status = Job.CANCELLED
+    except Exception:
+        logger.exception('Job %s failed', job.pk)
+        job.error = traceback.format_exc(limit=5)
+        status = Job.FAILED
+    else:
+        status = Job.DONE
+    job.status = status
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at', 'updated_at'])
+    return status
+
+
+def cancel_job(job):
+    """Cancel a queued job at once, or ask a running one to stop at its next progress report."""
+    if Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(status=Job.CANCELLED, finished_at=timezone.now()):
+        return
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(cancel_requested=True)
+
+
+def process_pool(workers):
+    """A pool of ``workers`` processes that each set up Django and open their own connections.
+
+    Jobs are submitted as ``api.worker.run``.
+    """
+    # Forked children would share the parent's database connections
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=worker.setup)
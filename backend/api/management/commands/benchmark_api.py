@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api.benchmark import compare, run_benchmark
+from api.seeding import SEED_PREFIX
+
+
+class Command(BaseCommand):
+    help = 'Time every GET route of the API as a teacher and as a student'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Calls per route and role')
+        parser.add_argument('--teacher', default=f'{SEED_PREFIX}-teacher')
+        parser.add_argument('--student', default=f'{SEED_PREFIX}-student-0000')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='A previous --output file to compare against')
+
+    def handle(self, *args, **options):
+        users = {}
+        for role in ('teacher', 'student'):
+            try:
+                users[role] = User.objects.select_related('profile').get(username=options[role])
+            except User.DoesNotExist:
+                raise CommandError(f'No user {options[role]!r}, run seed_school first or pass --{role}.')
+
+        results = run_benchmark(users, repeat=options['repeat'])
+        self.stdout.write(f"{'route':<55} {'role':<8} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'queries':>7} {'bytes':>9}")
+        for row in results:
+            self.stdout.write(
+                f"{row['path']:<55} {row['role']:<8} {row['status']:>6} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+                f"{row['queries']:>7} {row['bytes']:>9}"
+            )
+
+        if options['compare']:
+            baseline = json.loads(Path(options['compare']).read_text())['results']
+            self.stdout.write('\nChange against ' + options['compare'])
+            for row, before in compare(results, baseline):
+                self.stdout.write(
+                    f"{row['path']:<55} {row['role']:<8} p50 {before['p50_ms']} -> {row['p50_ms']} ms, "
+                    f"queries {before['queries']} -> {row['queries']}"
+                )
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps({
+                'recorded_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'results': results,
+            }, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Saved {len(results)} results to {options['output']}."))
@@ -0,0 +1,29 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.onboarding import import_students, parse_roster
+
+
+class Command(BaseCommand):
+    help = 'Enrol students from a CSV or JSON roster, hashing passwords in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help='Path to a .csv file with a header row or a .json list')
+        parser.add_argument('--format', choices=['csv', 'json'], help='Defaults to the file extension')
+        parser.add_argument('--workers', type=int, help='Password hashing processes, defaults to the CPU count')
+
+    def handle(self, *args, **options):
+        path = Path(options['roster'])
+        roster_format = options['format'] or ('json' if path.suffix.lower() == '.json' else 'csv')
+        try:
+            rows = parse_roster(path.read_bytes(), roster_format)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Could not read {path}: {exc}')
+
+        result = import_students(rows, workers=options['workers'])
+        for entry in result['rows']:
+            if entry['status'] == 'error':
+                self.stderr.write(f"row {entry['row']} ({entry['username']}): {json.dumps(entry['errors'])}")
+        self.stdout.write(self.style.SUCCESS(f"Created {result['created']} students, {result['errors']} errors."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.feeds import TOMBSTONE_RETENTION
+from api.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete change feed tombstones older than the retention window'
+
+    def handle(self, *args, **options):
+        deleted, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - TOMBSTONE_RETENTION).delete()
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} tombstones.'))
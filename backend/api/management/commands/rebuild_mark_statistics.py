@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.statistics import find_statistics_drift, rebuild_mark_statistics
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per student and lesson mark statistics from the marks table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drift between the statistics and the marks, exit with an error if any',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            expected, missing, stale, orphaned = find_statistics_drift()
+            self.stdout.write(
+                f'{len(expected)} pairs: {len(missing)} missing, {len(stale)} stale, {len(orphaned)} orphaned'
+            )
+            for student_id, lesson_id in sorted(missing | stale | orphaned):
+                self.stdout.write(f'  student {student_id}, lesson {lesson_id}')
+            if missing or stale or orphaned:
+                raise CommandError('Mark statistics have drifted, run rebuild_mark_statistics to fix them.')
+            return
+        count = rebuild_mark_statistics()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt statistics for {count} student and lesson pairs.'))
@@ -0,0 +1,72 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from api import worker
+from api.jobs import claim_next_job, process_pool, requeue_stale_jobs, run_job
+from api.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs on a pool of processes, polling the database for new ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Job processes, 0 runs jobs in this process')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds between checks of an empty queue')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} abandoned job(s).')
+        if options['workers'] > 0:
+            self.run_pool(options['workers'], options['poll'], options['once'])
+        else:
+            self.run_inline(options['poll'], options['once'])
+
+    def report(self, job_id, status):
+        style = self.style.SUCCESS if status == Job.DONE else self.style.WARNING
+        self.stdout.write(style(f'Job {job_id}: {status}'))
+
+    def run_inline(self, poll, once):
+        while True:
+            job = claim_next_job()
+            if job is not None:
+                self.report(job.pk, run_job(job.pk))
+            elif once:
+                return
+            else:
+                time.sleep(poll)
+
+    def run_pool(self, workers, poll, once):
+        running = {}
+        with process_pool(workers) as pool:
+            while True:
+                for future in [future for future in running if future.done()]:
+                    job_id = running.pop(future)
+                    if future.exception() is None:
+                        self.report(job_id, future.result())
+                        continue
+                    # The process died before the job could record its end
+                    Job.objects.filter(pk=job_id, status=Job.RUNNING).update(
+                        status=Job.FAILED, error=repr(future.exception()), finished_at=timezone.now()
+                    )
+                    self.report(job_id, Job.FAILED)
+
+                while len(running) < workers:
+                    job = claim_next_job()
+                    if job is None:
+                        break
+                    running[pool.submit(worker.run, job.pk)] = job.pk
+
+                if not running and once:
+                    return
+                # Idle connections would otherwise stay open between polls
+                connections.close_all()
+                if running:
+                    wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(poll)
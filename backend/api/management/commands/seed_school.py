@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.seeding import seed_school
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a reproducible synthetic school for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=300)
+        parser.add_argument('--lessons', type=int, default=12, help='At most 16')
+        parser.add_argument('--periods', type=int, default=6)
+        parser.add_argument('--start', type=parse_date, help='First school day, defaults to this September 1st')
+        parser.add_argument('--end', type=parse_date, help='Last school day, defaults to the end of May')
+        parser.add_argument('--mark-density', type=float, default=0.2, help='Share of students marked per lesson')
+        parser.add_argument('--hometask-density', type=float, default=0.6, help='Share of lessons with homework')
+        parser.add_argument('--password', default='secret', help='Password of every seeded user')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            counts = seed_school(
+                students=options['students'],
+                lessons=options['lessons'],
+                periods=options['periods'],
+                start=options['start'],
+                end=options['end'],
+                mark_density=options['mark_density'],
+                hometask_density=options['hometask_density'],
+                password=options['password'],
+                seed=options['seed'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded ' + ', '.join(f'{count} {name}' for name, count in counts.items()) + '.'
+        ))
@@ -11,6 +11,12 @@ class Profile(models.Model):
     date_of_birth = models.DateField(null=True, blank=True)
     address = models.TextField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Roster queries join users on profile__role='student'
+            models.Index(fields=['role', 'user'], name='profile_role_user_idx'),
+        ]
+
     def __str__(self):
         return self.user.username
     
@@ -29,27 +35,77 @@ class Period(models.Model):
         return f"Period {self.number}: {self.start_time} - {self.end_time}"
     
 class Schedule(models.Model):
-    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE)
+    # Covered by schedule_lesson_date_idx
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, db_index=False)
     date = models.DateField()
     period = models.ForeignKey(Period, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ('date', 'period')
+        indexes = [
+            # Gradebook and per-lesson date range filters
+            models.Index(fields=['lesson', 'date'], name='schedule_lesson_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.lesson.name} on {self.date} during Period {self.period.number}"
 
+class Holiday(models.Model):
+    """A day without lessons, skipped when a timetable template is applied."""
+    date = models.DateField(unique=True)
+    name = models.CharField(max_length=100, blank=True)
+
+    def __str__(self):
+        return f"{self.name or 'Holiday'} on {self.date}"
+
+class TimetableTemplate(models.Model):
+    """A repeating week of lessons, expanded into Schedule rows by api.timetable."""
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.name
+
+class TimetableSlot(models.Model):
+    WEEKDAY_CHOICES = (
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+        (5, 'Saturday'),
+        (6, 'Sunday'),
+    )
+    template = models.ForeignKey(TimetableTemplate, on_delete=models.CASCADE, related_name='slots')
+    # Numbered like date.weekday()
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    period = models.ForeignKey(Period, on_delete=models.CASCADE)
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('template', 'weekday', 'period')
+
+    def __str__(self):
+        return f"{self.lesson.name} on {self.get_weekday_display()} during Period {self.period.number}"
+
 class Mark(models.Model):
     student = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        limit_choices_to={'profile__role': 'student'}
+        limit_choices_to={'profile__role': 'student'},
+        # Covered by mark_student_schedule_idx
+        db_index=False,
     )
     schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE)
     mark = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ('schedule', 'student')
+        indexes = [
+            # A student's marks joined to their schedule without touching the table
+            models.Index(fields=['student', 'schedule', 'mark'], name='mark_student_schedule_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.username} - {self.mark} for {self.schedule}"
@@ -57,6 +113,97 @@ class Mark(models.Model):
 class HomeTask(models.Model):
     schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE)
     description = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Hometask for {self.schedule}"
+class Tombstone(models.Model):
+    """Records a deleted Mark, Schedule or HomeTask for the ``?since=`` change feeds."""
+    model = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    # Scope for per-student feeds, kept as plain ids since the rows are gone
+    student_id = models.BigIntegerField(null=True, blank=True)
+    schedule_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'deleted_at'], name='tombstone_model_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} deleted at {self.deleted_at}"
+
+class MarkStatistic(models.Model):
+    """Per student and lesson mark totals, kept up to date from api.statistics."""
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mark_statistics')
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='mark_statistics')
+    count = models.PositiveIntegerField(default=0)
+    total = models.IntegerField(default=0)
+    minimum = models.IntegerField(null=True, blank=True)
+    maximum = models.IntegerField(null=True, blank=True)
+    last_mark_date = models.DateField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('student', 'lesson')
+
+    @property
+    def average(self):
+        return self.total / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.student_id} - lesson {self.lesson_id}: {self.count} marks"
+
+class SearchTerm(models.Model):
+    """A normalized word of a user's username or name, kept up to date by api.search."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=150)
+
+    class Meta:
+        unique_together = ('term', 'user')
+
+    def __str__(self):
+        return f"{self.term} -> {self.user_id}"
+
+class Job(models.Model):
+    """A unit of background work, queued here and run by the ``run_jobs`` worker."""
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    )
+    KIND_CHOICES = (
+        ('report_cards', 'Report cards'),
+    )
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    cancel_requested = models.BooleanField(default=False)
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    result = models.FileField(upload_to='jobs/', blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Touched by every progress report, a running job that stops updating was abandoned
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # The worker takes the oldest queued job
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    @property
+    def progress(self):
+        if self.status == self.DONE:
+            return 100
+        return self.processed * 100 // self.total if self.total else 0
 
     def __str__(self):
-        return f"Hometask for {self.schedule}"
\ No newline at end of file
+        return f"{self.get_kind_display()} job {self.pk} ({self.status})"
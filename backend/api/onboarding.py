@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import worker
+from .caching import bump_model_version
+from .search import index_users
+from .models import Profile
+from .serializers import StudentImportRowSerializer
+
+# Below this many passwords the cost of starting worker processes outweighs the hashing
+PARALLEL_HASH_THRESHOLD = 16
+
+
+def parse_roster(content, roster_format):
+    """Rows of a CSV (with a header line) or JSON (a list of objects) roster."""
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    if roster_format == 'csv':
+        return [
+            {key.strip(): value for key, value in row.items() if key}
+            for row in csv.DictReader(io.StringIO(content))
+        ]
+    rows = json.loads(content)
+    if isinstance(rows, dict):
+        rows = rows.get('students', [])
+    if not isinstance(rows, list):
+        raise ValueError('Expected a list of students.')
+    return rows
+
+
+@lru_cache(maxsize=None)
+def _hash_pool(workers):
+    """One long-lived pool per size, shared by every import this process runs."""
+    # Forking a server process would copy its threads, event loop and
+    # database connections into the children
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=worker.setup)
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash passwords with the configured hasher, spread over a process pool."""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < PARALLEL_HASH_THRESHOLD:
+        return [make_password(password) for password in passwords]
+    hasher = type(get_hasher())
+    hash_password = partial(worker.hash_password, hasher=f'{hasher.__module__}.{hasher.__qualname__}')
+    chunksize = max(1, len(passwords) // (workers * 4))
+    return list(_hash_pool(workers).map(hash_password, passwords, chunksize=chunksize))
+
+
+def import_students(rows, workers=None):
+    """Validate and create a roster of students, returning a per-row report.
+
+    Valid rows are created in one transaction with two bulk inserts; rows
+    that fail validation, or whose username is taken, are reported and
+    skipped.
+    """
+    report, valid = [], []
+    for number, row in enumerate(rows, start=1):
+        serializer = StudentImportRowSerializer(data=row)
+        if serializer.is_valid():
+            valid.append((number, serializer.validated_data))
+            report.append({'row': number, 'username': serializer.validated_data['username'], 'status': 'created'})
+        else:
+            username = row.get('username', '') if isinstance(row, dict) else ''
+            report.append({'row': number, 'username': username, 'status': 'error', 'errors': serializer.errors})
+
+    taken = set(
+        User.objects.filter(username__in=[data['username'] for _, data in valid]).values_list('username', flat=True)
+    )
+    seen, accepted = set(), []
+    for number, data in valid:
+        if data['username'] in taken or data['username'] in seen:
+            report[number - 1].update(
+                status='error', errors={'username': ['A user with that username already exists.']}
+            )
+        else:
+            accepted.append(data)
+        seen.add(data['username'])
+
+    hashes = hash_passwords([data['password'] for data in accepted], workers=workers)
+    users = [
+        User(
+            username=data['username'],
+            password=password,
+            email=data.get('email', ''),
+            first_name=data.get('first_name', ''),
+            last_name=data.get('last_name', ''),
+        )
+        for data, password in zip(accepted, hashes)
+    ]
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=500)
+        Profile.objects.bulk_create(
+            [
+                Profile(
+                    user=user,
+                    role='student',
+                    date_of_birth=data.get('date_of_birth'),
+                    address=data.get('address'),
+                )
+                for user, data in zip(users, accepted)
+            ],
+            batch_size=500,
+        )
+        index_users(users, created=True)
+    # bulk_create skips the signals that invalidate the cached roster
+    if users:
+        bump_model_version(User)
+        bump_model_version(Profile)
+
+    ids = {user.username: user.pk for user in users}
+    for entry in report:
+        if entry['status'] == 'created':
+            entry['id'] = ids[entry['username']]
+    return {
+        'created': len(users),
+        'errors': sum(entry['status'] == 'error' for entry in report),
+        'rows': report,
+    }
@@ -0,0 +1,191 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def keyset_filter(fields, values, reverse=False):
+    """Rows strictly after ``values`` in the (possibly reversed) ``fields`` ordering."""
+    condition = Q(pk__in=[])
+    equal = Q()
+    for field, value in zip(fields, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-') != reverse
+        condition |= equal & Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination on a composite key, so every page costs one bounded query.
+
+    Unlike DRF's CursorPagination, which positions on the first ordering field
+    and then OFFSETs past ties, the cursor stores the values of every ordering
+    field of the boundary row and the next page is selected with a row-value
+    comparison. Orderings requested through OrderingFilter are honoured, with
+    ``id`` appended as a tie-breaker when the ordering is not already unique.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('id',)
+    unique_orderings = (('id',),)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.fields = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request, queryset)
+        reverse = bool(self.cursor and self.cursor['reverse'])
+
+        if self.cursor:
+            queryset = queryset.filter(self.boundary_filter(self.cursor['values'], reverse))
+        order_by = [self.invert(field) if reverse else field for field in self.fields]
+        rows = list(queryset.order_by(*order_by)[:self.page_size + 1])
+
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+        self.has_next = bool(self.cursor) if reverse else has_more
+        self.has_previous = has_more if reverse else bool(self.cursor)
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = list(ordering or self.ordering)
+        names = tuple(field.lstrip('-') for field in ordering)
+        if not any(names[:len(key)] == key for key in self.unique_orderings) and 'id' not in names:
+            ordering.append('id')
+        return ordering
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def boundary_filter(self, values, reverse):
+        return keyset_filter(self.fields, values, reverse)
+
+    def key_for(self, row):
+        values = []
+        for field in self.fields:
+            name = field.lstrip('-')
+            # values() rows from api.fastpath are keyed by the lookup
+            if isinstance(row, dict):
+                values.append(row[name])
+                continue
+            value = row
+            for attr in name.split('__'):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    @staticmethod
+    def model_field(model, lookup):
+        """The model field ``lookup`` ends on, or None for an annotation."""
+        field = None
+        for part in lookup.split('__'):
+            if field is not None:
+                model = field.related_model
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return None
+        return field
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            values, reverse = cursor['v'], bool(cursor['r'])
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError('Cursor values do not match the ordering')
+            # A tampered value would otherwise fail inside the query
+            for i, field in enumerate(self.fields):
+                model_field = self.model_field(queryset.model, field.lstrip('-'))
+                if model_field is not None and values[i] is not None:
+                    values[i] = model_field.to_python(values[i])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps({'v': values, 'r': int(reverse)}, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.key_for(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.key_for(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class MarkPagination(KeysetPagination):
+    ordering = ('schedule__date', 'id')
+
+
+class SchedulePagination(KeysetPagination):
+    ordering = ('date', 'period__number')
+    unique_orderings = (('id',), ('date', 'period__number'))
+
+
+class StudentPagination(KeysetPagination):
+    ordering = ('username',)
+    unique_orderings = (('id',), ('username',))
+
+
+class HomeTaskPagination(KeysetPagination):
+    ordering = ('schedule__date', 'id')
+
+
+class JobPagination(KeysetPagination):
+    ordering = ('-id',)
@@ -0,0 +1,164 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger('api.routing')
+
+ROUTED_PATH_PREFIX = '/api/'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_KEY = 'api:db:sticky:{}'
+
+# Replica -> (monotonic time of the check, usable)
+_health = {}
+
+
+class RoutingState:
+    def __init__(self, replica):
+        self.replica = replica
+        self.wrote = False
+
+
+_state = ContextVar('api_db_routing', default=None)
+
+
+def replica_lag(alias):
+    """Seconds the replica ``alias`` is behind the primary; raises DatabaseError when it is down."""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # An idle primary replays nothing, which is not lag
+            cursor.execute(
+                'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+                'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+            )
+            return float(cursor.fetchone()[0] or 0)
+        cursor.execute('SELECT 1')
+        return 0.0
+
+
+def replica_is_usable(alias):
+    """Whether ``alias`` answers and lags at most REPLICA_MAX_LAG, checked once per REPLICA_CHECK_INTERVAL."""
+    now = time.monotonic()
+    checked = _health.get(alias)
+    if checked is not None and now - checked[0] < settings.REPLICA_CHECK_INTERVAL:
+        return checked[1]
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError as exc:
+        logger.warning('Replica %s is unreachable, reading from the primary: %s', alias, exc)
+        usable = False
+    else:
+        usable = lag <= settings.REPLICA_MAX_LAG
+        if not usable:
+            logger.warning('Replica %s is %.1fs behind, reading from the primary', alias, lag)
+    _health[alias] = (now, usable)
+    return usable
+
+
+def reset_replica_health():
+    _health.clear()
+
+
+def choose_replica():
+    usable = [alias for alias in settings.DATABASE_REPLICAS if replica_is_usable(alias)]
+    return random.choice(usable) if usable else None
+
+
+def request_user_id(request):
+    """The user id claim of the request's bearer token, or None.
+
+    The signature is not checked: the id only picks a database, the view
+    still authenticates the request.
+    """
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        return AccessToken(header[7:], verify=False).get(api_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+def stick_to_primary(user_id):
+    cache.set(STICKY_KEY.format(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(user_id):
+    return user_id is not None and cache.get(STICKY_KEY.format(user_id)) is not None
+
+
+@contextmanager
+def primary_reads():
+    """Send the reads made inside the block to the primary, for results cached past the request."""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    replica, state.replica = state.replica, None
+    try:
+        yield
+    finally:
+        state.replica = replica
+
+
+class ReplicaRouter:
+    """Send the reads of routed requests to the replica chosen for the request, everything else to the primary.
+
+    Once anything is written during a request its remaining reads go to the
+    primary as well.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.wrote:
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """Route safe API requests to a usable replica unless their user wrote recently.
+
+    A request that writes makes its user's requests read from the primary
+    for REPLICA_STICKY_SECONDS, so they see their own changes before the
+    replicas do. Does nothing while DATABASE_REPLICAS is empty.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS or not request.path.startswith(ROUTED_PATH_PREFIX):
+            return self.get_response(request)
+
+        user_id = request_user_id(request)
+        replica = None
+        if request.method in SAFE_METHODS and not is_sticky(user_id):
+            replica = choose_replica()
+        state = RoutingState(replica)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.wrote and user_id is not None:
+            stick_to_primary(user_id)
+        return response
@@ -0,0 +1,77 @@
+import re
+import unicodedata
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import SearchTerm
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 50
+# Shorter substrings match most of the school and cannot use an index anyway
+MIN_SUBSTRING_LENGTH = 3
+# Sorts after any character a term can contain, so [word, word + END) is every term starting with word
+_END = '\U0010ffff'
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lower case ``text`` without accents, so 'Zoë' and 'ZOE' are both searched as 'zoe'."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def terms_for(user):
+    """Search terms of a user: the whole username and each word of it and of the names."""
+    username = normalize(user.username)
+    words = _WORD.findall(' '.join([username, normalize(user.first_name), normalize(user.last_name)]))
+    return {username, *words} - {''}
+
+
+def index_users(users, created=False):
+    """Replace the search terms of ``users``; bulk user writes call this since they skip the signals.
+
+    ``created`` users have no terms yet, which saves deleting them.
+    """
+    users = list(users)
+    if not users:
+        return
+    terms = [SearchTerm(user_id=user.pk, term=term[:150]) for user in users for term in terms_for(user)]
+    if created:
+        SearchTerm.objects.bulk_create(terms, batch_size=1000)
+        return
+    with transaction.atomic():
+        SearchTerm.objects.filter(user__in=users).delete()
+        SearchTerm.objects.bulk_create(terms, batch_size=1000)
+
+
+def display_name(row):
+    name = f"{row['first_name']} {row['last_name']}".strip()
+    return name or row['username']
+
+
+def search_students(query, limit=SEARCH_LIMIT):
+    """Students whose username or name words start with each word of ``query``.
+
+    Every word of the query must prefix-match a term of the student, which
+    is a range scan of the term index per word. When that finds fewer than
+    ``limit`` students, words of MIN_SUBSTRING_LENGTH or more also match in
+    the middle of terms, which scans the term table. Returns at most
+    ``limit`` rows of id, username and display name, prefix matches first.
+    """
+    words = _WORD.findall(normalize(query))
+    if not words:
+        return []
+    students = User.objects.filter(profile__role='student').order_by('last_name', 'first_name', 'username')
+    prefix = students
+    for word in words:
+        prefix = prefix.filter(id__in=SearchTerm.objects.filter(term__gte=word, term__lt=word + _END).values('user_id'))
+    rows = list(prefix.values('id', 'username', 'first_name', 'last_name')[:limit])
+
+    if len(rows) < limit and all(len(word) >= MIN_SUBSTRING_LENGTH for word in words):
+        substring = students.exclude(id__in=[row['id'] for row in rows])
+        for word in words:
+            substring = substring.filter(id__in=SearchTerm.objects.filter(term__contains=word).values('user_id'))
+        rows += substring.values('id', 'username', 'first_name', 'last_name')[:limit - len(rows)]
+
+    return [{'id': row['id'], 'username': row['username'], 'name': display_name(row)} for row in rows]
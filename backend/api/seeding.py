@@ -0,0 +1,134 @@
+import random
+from datetime import date, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .caching import bump_model_version, invalidate_dates
+from .models import Profile, Lesson, Period, Schedule, Mark, HomeTask, Holiday, TimetableSlot, TimetableTemplate
+from .search import index_users
+from .statistics import rebuild_mark_statistics
+from .timetable import apply_template
+
+SEED_PREFIX = 'seed'
+SEED_LESSONS = (
+    'Maths', 'Algebra', 'Geometry', 'English', 'Literature', 'History', 'Geography', 'Biology',
+    'Chemistry', 'Physics', 'Informatics', 'Art', 'Music', 'Physical Education', 'Economics', 'Law',
+)
+SEED_NAMES = (
+    'Alex', 'Anna', 'Daniel', 'Elena', 'Ivan', 'Maria', 'Max', 'Olga', 'Pavel', 'Sofia', 'Timur', 'Vera',
+)
+
+
+def _school_year(start):
+    # September to the end of May, with winter and spring breaks
+    end = date(start.year + 1, 5, 31)
+    breaks = [
+        (date(start.year, 12, 28), date(start.year + 1, 1, 8)),
+        (date(start.year + 1, 3, 24), date(start.year + 1, 3, 31)),
+    ]
+    holidays = [
+        first + timedelta(days=offset)
+        for first, last in breaks
+        for offset in range((last - first).days + 1)
+    ]
+    return end, holidays
+
+
+def seed_school(students=300, lessons=12, periods=6, start=None, end=None, mark_density=0.2,
+                hometask_density=0.6, password='secret', seed=0):
+    """Fill the database with a reproducible synthetic school.
+
+    Creates a ``seed-teacher`` and ``seed-student-NNNN`` users, lessons,
+    periods and a weekly timetable applied over the school year, then marks
+    a ``mark_density`` share of the class in every lesson and sets homework
+    for a ``hometask_density`` share of lessons. The same ``seed`` and
+    arguments always produce the same rows. Returns the row counts created.
+    """
+    if User.objects.filter(username=f'{SEED_PREFIX}-teacher').exists():
+        raise ValueError('This database has already been seeded.')
+    rng = random.Random(seed)
+    start = start or date(date.today().year - (date.today().month < 9), 9, 1)
+    year_end, holidays = _school_year(start)
+    end = end or year_end
+
+    with transaction.atomic():
+        # Every synthetic account shares one hash, hashing thousands is the slow part
+        encoded = make_password(password)
+        teacher = User.objects.create(username=f'{SEED_PREFIX}-teacher', password=encoded, first_name='Teacher')
+        Profile.objects.create(user=teacher, role='teacher')
+        users = User.objects.bulk_create(
+            User(
+                username=f'{SEED_PREFIX}-student-{n:04d}',
+                password=encoded,
+                first_name=rng.choice(SEED_NAMES),
+                last_name=f'Student{n}',
+            )
+            for n in range(students)
+        )
+        Profile.objects.bulk_create(
+            Profile(
+                user=user,
+                role='student',
+                date_of_birth=date(start.year - 15, 1, 1) + timedelta(days=rng.randrange(730)),
+            )
+            for user in users
+        )
+        index_users(users, created=True)
+
+        lesson_rows = [Lesson.objects.get_or_create(name=name)[0] for name in SEED_LESSONS[:lessons]]
+        period_rows = [
+            Period.objects.get_or_create(
+                number=n, defaults={'start_time': time(7 + n), 'end_time': time(7 + n, 45)}
+            )[0]
+            for n in range(1, periods + 1)
+        ]
+        Holiday.objects.bulk_create(
+            [Holiday(date=day, name='School break') for day in holidays if start <= day <= end],
+            ignore_conflicts=True,
+        )
+        template = TimetableTemplate.objects.create(name=f'{SEED_PREFIX}-{seed}')
+        TimetableSlot.objects.bulk_create(
+            TimetableSlot(template=template, weekday=weekday, period=period, lesson=rng.choice(lesson_rows))
+            for weekday in range(5)
+            for period in period_rows
+        )
+        apply_template(template, start, end)
+
+        schedules = list(
+            Schedule.objects.filter(date__range=(start, end)).order_by('date', 'period__number')
+            .values_list('id', flat=True)
+        )
+        marked = max(1, round(students * mark_density)) if students else 0
+        marks = 0
+        for offset in range(0, len(schedules), 200):
+            batch = [
+                Mark(schedule_id=schedule, student=student, mark=min(12, max(1, round(rng.gauss(8, 2.5)))))
+                for schedule in schedules[offset:offset + 200]
+                for student in rng.sample(users, marked)
+            ]
+            Mark.objects.bulk_create(batch, batch_size=1000)
+            marks += len(batch)
+        hometasks = HomeTask.objects.bulk_create(
+            (
+                HomeTask(schedule_id=schedule, description=f'Exercises {rng.randint(1, 60)}-{rng.randint(61, 120)}')
+                for schedule in schedules
+                if rng.random() < hometask_density
+            ),
+            batch_size=1000,
+        )
+        rebuild_mark_statistics()
+
+    for model in (User, Profile, Lesson, Period):
+        bump_model_version(model)
+    # apply_template() covers the new schedules, not homework set on existing ones
+    invalidate_dates(Schedule.objects.filter(date__range=(start, end)).values_list('date', flat=True).distinct())
+    return {
+        'students': students,
+        'lessons': len(lesson_rows),
+        'periods': len(period_rows),
+        'schedules': len(schedules),
+        'marks': marks,
+        'hometasks': len(hometasks),
+    }
@@ -1,34 +1,52 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Period, Lesson, Schedule, Mark, HomeTask, Profile
+from django.db import transaction
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from .authentication import is_revoked
+from .caching import invalidate_students
+from .expansion import ExpandableFieldsMixin
+from .events import mark_event, publish_on_commit, student_channel
+from .models import Period, Lesson, Schedule, Mark, HomeTask, Profile, Holiday, TimetableTemplate, TimetableSlot, Job
+from .statistics import lesson_pairs, refresh_mark_statistics
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
+        # Read by api.authentication.ClaimsUser when JWT_STATELESS_AUTH is on
+        token['username'] = user.username
+        token['first_name'] = user.first_name
+        token['last_name'] = user.last_name
         try:
             token['role'] = user.profile.role
         except Profile.DoesNotExist:
             token['role'] = None
         return token
 
-class LessonSerializer(serializers.ModelSerializer):
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        # The refreshed access token copies the role claim, so revoked users must log in again
+        if is_revoked(self.token_class(attrs['refresh'])):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return super().validate(attrs)
+
+class LessonSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Lesson
         fields = ['id', 'name']
 
-class PeriodSerializer(serializers.ModelSerializer):
+class PeriodSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Period
         fields = ['id', 'number', 'start_time', 'end_time']
 
-class ScheduleSerializer(serializers.ModelSerializer):
-    lesson = LessonSerializer(read_only=True)
+class ScheduleSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'lesson': LessonSerializer, 'period': PeriodSerializer}
     lesson_id = serializers.PrimaryKeyRelatedField(
         queryset=Lesson.objects.all(), source='lesson', write_only=True
     )
-    period = PeriodSerializer(read_only=True)
     period_id = serializers.PrimaryKeyRelatedField(
         queryset=Period.objects.all(), source='period', write_only=True
     )
@@ -36,6 +54,7 @@ class ScheduleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Schedule
         fields = ['id', 'date', 'lesson', 'lesson_id', 'period', 'period_id']
+        read_only_fields = ['lesson', 'period']
 
 class ScheduleCreateUpdateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -58,7 +77,115 @@ class ScheduleCreateUpdateSerializer(serializers.ModelSerializer):
         # Since all lessons are taught by the same teacher, and there's no teacher field
         return data
 
-class HomeTaskSerializer(serializers.ModelSerializer):
+class HolidaySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Holiday
+        fields = ['id', 'date', 'name']
+
+class TimetableSlotSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TimetableSlot
+        fields = ['weekday', 'period', 'lesson']
+
+class TimetableTemplateSerializer(serializers.ModelSerializer):
+    """A template with its whole week of slots; writes replace the slots wholesale."""
+    slots = TimetableSlotSerializer(many=True)
+
+    class Meta:
+        model = TimetableTemplate
+        fields = ['id', 'name', 'slots']
+
+    def validate_slots(self, slots):
+        taken = set()
+        for slot in slots:
+            key = (slot['weekday'], slot['period'].pk)
+            if key in taken:
+                raise serializers.ValidationError(
+                    f"Period {slot['period'].number} is used twice on {dict(TimetableSlot.WEEKDAY_CHOICES)[key[0]]}."
+                )
+            taken.add(key)
+        return slots
+
+    @transaction.atomic
+    def create(self, validated_data):
+        slots = validated_data.pop('slots')
+        template = TimetableTemplate.objects.create(**validated_data)
+        TimetableSlot.objects.bulk_create(TimetableSlot(template=template, **slot) for slot in slots)
+        return template
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        slots = validated_data.pop('slots', None)
+        instance = super().update(instance, validated_data)
+        if slots is not None:
+            instance.slots.all().delete()
+            TimetableSlot.objects.bulk_create(TimetableSlot(template=instance, **slot) for slot in slots)
+        return instance
+
+class ApplyTemplateSerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    dry_run = serializers.BooleanField(default=False)
+    # Keeps a mistyped year from writing thousands of rows
+    max_days = 400
+
+    def validate(self, data):
+        if data['end'] < data['start']:
+            raise serializers.ValidationError({'end': 'Must not be before start.'})
+        if (data['end'] - data['start']).days >= self.max_days:
+            raise serializers.ValidationError({'end': f'A range may span at most {self.max_days} days.'})
+        return data
+
+class ReportCardParamsSerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    # The whole class when left out
+    student = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.filter(profile__role='student'), required=False, allow_null=True
+    )
+    format = serializers.ChoiceField(choices=['json', 'csv'], default='json')
+
+    def validate(self, data):
+        if data['end'] < data['start']:
+            raise serializers.ValidationError({'end': 'Must not be before start.'})
+        return data
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data.get('student') is None:
+            data.pop('student', None)
+        return data
+
+class JobSerializer(serializers.ModelSerializer):
+    """A background job; ``params`` are validated by the serializer for its ``kind``."""
+    params_serializers = {'report_cards': ReportCardParamsSerializer}
+    progress = serializers.IntegerField(read_only=True)
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'params', 'status', 'progress', 'processed', 'total', 'error',
+            'created_at', 'started_at', 'finished_at', 'download',
+        ]
+        read_only_fields = ['status', 'processed', 'total', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def get_download(self, job):
+        if job.status != Job.DONE or not job.result:
+            return None
+        return reverse('jobs-download', args=[job.pk], request=self.context.get('request'))
+
+    def validate(self, data):
+        params = self.params_serializers[data['kind']](data=data.get('params') or {})
+        if not params.is_valid():
+            raise serializers.ValidationError({'params': params.errors})
+        # Stored as JSON, so dates and related objects go back to their representation
+        data['params'] = params.data
+        return data
+
+class HomeTaskSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'schedule': ScheduleSerializer}
+
     class Meta:
         model = HomeTask
         fields = ['id', 'schedule', 'description']
@@ -70,13 +197,13 @@ class HomeTaskSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("You can only assign hometasks for your own lessons.")
         return data
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Profile
         fields = ['role', 'date_of_birth', 'address']
         read_only_fields = ['role']  # We'll set role automatically
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     profile = ProfileSerializer()
 
     class Meta:
@@ -108,9 +235,24 @@ class UserSerializer(serializers.ModelSerializer):
 
         return instance
 
-class MarkSerializer(serializers.ModelSerializer):
-    student = UserSerializer(read_only=True)
-    schedule = ScheduleSerializer(read_only=True)
+class StudentImportRowSerializer(serializers.Serializer):
+    """One roster row for api.onboarding; uniqueness is checked there in bulk."""
+    username = serializers.CharField(max_length=150, validators=[User.username_validator])
+    password = serializers.CharField(write_only=True)
+    email = serializers.EmailField(required=False, allow_blank=True)
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    date_of_birth = serializers.DateField(required=False, allow_null=True)
+    address = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+    def to_internal_value(self, data):
+        # CSV rosters leave optional columns as empty strings
+        if hasattr(data, 'items'):
+            data = {key: value for key, value in data.items() if not (key == 'date_of_birth' and value == '')}
+        return super().to_internal_value(data)
+
+class MarkSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'student': UserSerializer, 'schedule': ScheduleSerializer}
     student_id = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.filter(profile__role='student'),
         source='student',
@@ -125,23 +267,126 @@ class MarkSerializer(serializers.ModelSerializer):
     class Meta:
         model = Mark
         fields = ['id', 'mark', 'student', 'student_id', 'schedule', 'schedule_id']
+        read_only_fields = ['student', 'schedule']
 
     def validate(self, data):
         return data
 
-class StudentScheduleSerializer(serializers.ModelSerializer):
-    lesson = LessonSerializer(read_only=True)
-    period = PeriodSerializer(read_only=True)
+class BulkMarkRowSerializer(serializers.Serializer):
+    student_id = serializers.IntegerField()
+    schedule_id = serializers.IntegerField(required=False)
+    mark = serializers.IntegerField()
+
+class BulkMarkSerializer(serializers.Serializer):
+    """Upserts many marks at once, for one schedule or across several.
+
+    Rows may omit ``schedule_id`` when it is given at the top level. Students
+    and schedules are checked with one query each and all rows are written in
+    a single transaction, or none are if any row is invalid.
+    """
+    schedule_id = serializers.IntegerField(required=False)
+    marks = BulkMarkRowSerializer(many=True, allow_empty=False)
+
+    def validate(self, data):
+        rows = data['marks']
+        for row in rows:
+            row.setdefault('schedule_id', data.get('schedule_id'))
+
+        student_ids = User.objects.filter(
+            id__in={row['student_id'] for row in rows}, profile__role='student'
+        ).values_list('id', flat=True)
+        schedule_ids = Schedule.objects.filter(
+            id__in={row['schedule_id'] for row in rows if row['schedule_id'] is not None}
+        ).values_list('id', flat=True)
+        student_ids, schedule_ids = set(student_ids), set(schedule_ids)
+
+        errors, seen = [], set()
+        for row in rows:
+            row_errors = {}
+            if row['schedule_id'] is None:
+                row_errors['schedule_id'] = ['This field is required.']
+            elif row['schedule_id'] not in schedule_ids:
+                row_errors['schedule_id'] = [f'Invalid pk "{row["schedule_id"]}" - object does not exist.']
+            if row['student_id'] not in student_ids:
+                row_errors['student_id'] = [f'Invalid pk "{row["student_id"]}" - object does not exist.']
+            key = (row['schedule_id'], row['student_id'])
+            if key in seen:
+                row_errors['non_field_errors'] = ['Duplicate mark for this student and schedule.']
+            seen.add(key)
+            errors.append(row_errors)
+        if any(errors):
+            raise serializers.ValidationError({'marks': errors})
+        return data
+
+    def create(self, validated_data):
+        rows = validated_data['marks']
+        with transaction.atomic():
+            existing = {
+                (mark.schedule_id, mark.student_id): mark
+                for mark in Mark.objects.select_for_update().filter(
+                    schedule_id__in={row['schedule_id'] for row in rows},
+                    student_id__in={row['student_id'] for row in rows},
+                ).only('id', 'schedule_id', 'student_id', 'mark')
+            }
+            results, changed = [], []
+            for row in rows:
+                current = existing.get((row['schedule_id'], row['student_id']))
+                if current is None:
+                    status = 'created'
+                elif current.mark != row['mark']:
+                    status = 'updated'
+                else:
+                    status = 'unchanged'
+                mark = Mark(
+                    schedule_id=row['schedule_id'],
+                    student_id=row['student_id'],
+                    mark=row['mark'],
+                )
+                if status != 'unchanged':
+                    changed.append(mark)
+                results.append((mark, current, status))
+            Mark.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['schedule', 'student'],
+                update_fields=['mark', 'updated_at'],
+            )
+            # bulk_create skips the Mark signals
+            refresh_mark_statistics(lesson_pairs(changed))
+            invalidate_students(mark.student_id for mark in changed)
+            for mark, current, status in results:
+                if status == 'unchanged':
+                    continue
+                if current is not None:
+                    mark.pk = current.pk
+                publish_on_commit(student_channel(mark.student_id), mark_event(mark, status))
+        return [
+            {
+                'id': current.id if current else mark.id,
+                'schedule_id': mark.schedule_id,
+                'student_id': mark.student_id,
+                'mark': mark.mark,
+                'status': status,
+            }
+            for mark, current, status in results
+        ]
+
+class StudentScheduleSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'lesson': LessonSerializer, 'period': PeriodSerializer}
     mark = serializers.SerializerMethodField()
 
     class Meta:
         model = Schedule
         fields = ['id', 'date', 'period', 'lesson', 'mark']
+        read_only_fields = ['period', 'lesson']
 
     def get_mark(self, obj):
+        # StudentScheduleView annotates the requesting student's mark on each row
+        if hasattr(obj, 'student_mark'):
+            return obj.student_mark
         user = self.context['request'].user
         try:
-            mark = Mark.objects.get(schedule=obj, student=user)
+            mark = Mark.objects.get(schedule=obj, student_id=user.pk)
             return mark.mark
         except Mark.DoesNotExist:
             return None
\ No newline at end of file
@@ -1,9 +1,186 @@
+import time
+
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
-from .models import Profile
+from .authentication import revoke_user_tokens
+from .caching import MARKED_SLOTS_TAG, bump_model_version, invalidate_dates, invalidate_students
+from .events import BROADCAST_CHANNEL, hometask_event, mark_event, publish_on_commit, student_channel
+from .models import Profile, Lesson, Period, Mark, Schedule, HomeTask, Tombstone
+from .search import index_users
+from .statistics import lesson_pairs, refresh_mark_statistics
+from .timetable import refresh_timetable
 
 # @receiver(post_save, sender=User)
 # def create_user_profile(sender, instance, created, **kwargs):
 #     if created:
-#         Profile.objects.get_or_create(user=instance)
\ No newline at end of file
+#         Profile.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Mark)
+def remember_mark_pair(sender, instance, raw=False, **kwargs):
+    # A regraded mark can move to another student or lesson; both pairs need a refresh
+    instance._previous_pairs = set()
+    if instance.pk and not raw:
+        instance._previous_pairs = set(
+            Mark.objects.filter(pk=instance.pk).values_list('student_id', 'schedule__lesson_id')
+        )
+
+
+@receiver(post_save, sender=Mark)
+@receiver(post_delete, sender=Mark)
+def update_mark_statistics(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    refresh_mark_statistics(lesson_pairs([instance]) | getattr(instance, '_previous_pairs', set()))
+
+
+@receiver(post_save, sender=Mark)
+@receiver(post_delete, sender=Mark)
+def expire_student_responses(sender, instance, **kwargs):
+    previous = {student for student, _ in getattr(instance, '_previous_pairs', ())}
+    invalidate_students(previous | {instance.student_id})
+
+
+@receiver(pre_save, sender=Schedule)
+def remember_schedule_lesson(sender, instance, raw=False, **kwargs):
+    instance._previous_lesson_id = instance._previous_date = None
+    if instance.pk and not raw:
+        instance._previous_lesson_id, instance._previous_date = (
+            Schedule.objects.filter(pk=instance.pk).values_list('lesson_id', 'date').first() or (None, None)
+        )
+
+
+@receiver(post_save, sender=Schedule)
+def move_schedule_statistics(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_lesson_id', None)
+    if created or raw or previous is None:
+        return
+    # A new date changes last_mark_date, a new lesson moves the marks to another pair
+    moved_date = str(getattr(instance, '_previous_date', None)) != str(instance.date)
+    if previous == instance.lesson_id and not moved_date:
+        return
+    students = Mark.objects.filter(schedule=instance).values_list('student_id', flat=True)
+    refresh_mark_statistics(
+        {(student, lesson) for student in students for lesson in (previous, instance.lesson_id)}
+    )
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+def expire_schedule_responses(sender, instance, **kwargs):
+    invalidate_dates({instance.date, getattr(instance, '_previous_date', None)})
+    # Expanded marks show the slot's date, lesson and period
+    invalidate_students(Mark.objects.filter(schedule=instance).values_list('student_id', flat=True), MARKED_SLOTS_TAG)
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+def refresh_schedule_snapshots(sender, instance, **kwargs):
+    refresh_timetable({instance.date, getattr(instance, '_previous_date', None)})
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Period)
+def refresh_reference_snapshots(sender, instance, created, raw=False, **kwargs):
+    # Deleting one deletes its schedules, which refresh their own dates
+    if created or raw:
+        return
+    field = 'lesson' if sender is Lesson else 'period'
+    refresh_timetable(Schedule.objects.filter(**{field: instance}).values_list('date', flat=True).distinct())
+
+
+@receiver(pre_save, sender=HomeTask)
+def remember_hometask_date(sender, instance, raw=False, **kwargs):
+    instance._previous_date = None
+    if instance.pk and not raw:
+        instance._previous_date = (
+            HomeTask.objects.filter(pk=instance.pk).values_list('schedule__date', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=HomeTask)
+@receiver(post_delete, sender=HomeTask)
+def expire_hometask_responses(sender, instance, **kwargs):
+    day = Schedule.objects.filter(pk=instance.schedule_id).values_list('date', flat=True).first()
+    invalidate_dates({day, getattr(instance, '_previous_date', None)})
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_save, sender=Period)
+@receiver(post_delete, sender=Period)
+def bump_reference_version(sender, **kwargs):
+    bump_model_version(sender)
+
+
+@receiver(pre_save, sender=Profile)
+def remember_profile_role(sender, instance, raw=False, **kwargs):
+    instance._previous_role = None
+    if instance.pk and not raw:
+        instance._previous_role = Profile.objects.filter(pk=instance.pk).values_list('role', flat=True).first()
+
+
+@receiver(post_save, sender=Profile)
+def revoke_tokens_on_role_change(sender, instance, created, **kwargs):
+    # Stateless authentication trusts the role claim, so old tokens must stop working
+    previous = getattr(instance, '_previous_role', None)
+    if not created and previous is not None and previous != instance.role:
+        revoke_user_tokens(instance.user_id, time.time())
+
+
+@receiver(post_save, sender=User)
+def update_search_terms(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Logins save last_login alone
+    if raw or (update_fields is not None and not {'username', 'first_name', 'last_name'} & set(update_fields)):
+        return
+    index_users([instance], created=created)
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_deactivation(sender, instance, created, **kwargs):
+    if not created and not instance.is_active:
+        revoke_user_tokens(instance.pk, time.time())
+
+
+@receiver(post_delete, sender=User)
+def revoke_tokens_on_delete(sender, instance, **kwargs):
+    revoke_user_tokens(instance.pk, time.time())
+
+
+@receiver(post_delete, sender=Mark)
+@receiver(post_delete, sender=Schedule)
+@receiver(post_delete, sender=HomeTask)
+def record_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        model=sender._meta.label_lower,
+        object_id=instance.pk,
+        student_id=getattr(instance, 'student_id', None),
+        schedule_id=getattr(instance, 'schedule_id', None),
+    )
+
+
+@receiver(post_save, sender=Mark)
+def push_mark_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        publish_on_commit(student_channel(instance.student_id), mark_event(instance, 'created' if created else 'updated'))
+
+
+@receiver(post_delete, sender=Mark)
+def push_mark_deleted(sender, instance, **kwargs):
+    publish_on_commit(student_channel(instance.student_id), mark_event(instance, 'deleted'))
+
+
+@receiver(post_save, sender=HomeTask)
+def push_hometask_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        publish_on_commit(BROADCAST_CHANNEL, hometask_event(instance, 'created' if created else 'updated'))
+
+
+@receiver(post_delete, sender=HomeTask)
+def push_hometask_deleted(sender, instance, **kwargs):
+    publish_on_commit(BROADCAST_CHANNEL, hometask_event(instance, 'deleted'))
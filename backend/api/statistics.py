@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+
+from .models import Mark, MarkStatistic, Schedule
+
+STAT_FIELDS = ['count', 'total', 'minimum', 'maximum', 'last_mark_date']
+
+
+def lesson_pairs(marks):
+    """(student_id, lesson_id) pairs of the given marks, resolving lessons in one query."""
+    marks = list(marks)
+    lessons = dict(
+        Schedule.objects.filter(id__in={mark.schedule_id for mark in marks}).values_list('id', 'lesson_id')
+    )
+    return {(mark.student_id, lessons[mark.schedule_id]) for mark in marks if mark.schedule_id in lessons}
+
+
+def aggregate_marks(marks):
+    """Aggregate a Mark queryset into MarkStatistic rows keyed by (student_id, lesson_id)."""
+    rows = (
+        marks.order_by()
+        .values('student_id', 'schedule__lesson_id')
+        .annotate(
+            count=Count('id'),
+            total=Sum('mark'),
+            minimum=Min('mark'),
+            maximum=Max('mark'),
+            last_mark_date=Max('schedule__date'),
+        )
+    )
+    return {
+        (row['student_id'], row['schedule__lesson_id']): MarkStatistic(
+            student_id=row['student_id'],
+            lesson_id=row['schedule__lesson_id'],
+            **{field: row[field] for field in STAT_FIELDS},
+        )
+        for row in rows
+    }
+
+
+def refresh_mark_statistics(pairs):
+    """Recompute the statistics of the given (student_id, lesson_id) pairs only.
+
+    Called from the Mark signals for single writes and directly by bulk write
+    paths, which bypass signals. Costs one aggregate and one upsert however
+    many pairs are passed.
+    """
+    pairs = {pair for pair in pairs if None not in pair}
+    if not pairs:
+        return
+    match = Q()
+    for student_id, lesson_id in pairs:
+        match |= Q(student_id=student_id, schedule__lesson_id=lesson_id)
+    fresh = aggregate_marks(Mark.objects.filter(match))
+
+    with transaction.atomic():
+        if fresh:
+            MarkStatistic.objects.bulk_create(
+                fresh.values(),
+                update_conflicts=True,
+                unique_fields=['student', 'lesson'],
+                update_fields=STAT_FIELDS,
+            )
+        emptied = pairs - fresh.keys()
+        if emptied:
+            gone = Q()
+            for student_id, lesson_id in emptied:
+                gone |= Q(student_id=student_id, lesson_id=lesson_id)
+            MarkStatistic.objects.filter(gone).delete()
+
+
+def find_statistics_drift():
+    """Compare stored statistics with the marks table.
+
+    Returns ``(expected, missing, stale, orphaned)`` where ``expected`` maps
+    every pair to its correct row.
+    """
+    expected = aggregate_marks(Mark.objects.all())
+    stored = {
+        (stat.student_id, stat.lesson_id): stat
+        for stat in MarkStatistic.objects.all()
+    }
+    missing = expected.keys() - stored.keys()
+    orphaned = stored.keys() - expected.keys()
+    stale = {
+        pair for pair in expected.keys() & stored.keys()
+        if any(getattr(expected[pair], field) != getattr(stored[pair], field) for field in STAT_FIELDS)
+    }
+    return expected, missing, stale, orphaned
+
+
+@transaction.atomic
+def rebuild_mark_statistics():
+    """Replace the whole statistics table with a fresh aggregate of every mark."""
+    MarkStatistic.objects.all().delete()
+    rows = aggregate_marks(Mark.objects.all()).values()
+    MarkStatistic.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -1,3 +1,1878 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import zipfile
+import tempfile
+import threading
+import warnings
+from base64 import urlsafe_b64encode
+from copy import deepcopy
+from datetime import date, time, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import messages
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, connections
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import ClaimsJWTAuthentication, revoke_token
+from .gradebook import build_gradebook
+from .events import InProcessBroker, get_broker, issue_stream_ticket, redeem_stream_ticket, student_channel
+from .benchmark import discover_routes, measure, run_benchmark
+from .caching import invalidate_dates, model_version, response_cache
+from .checks import check_stateless_auth_cache
+from . import dashboard, exports, fastpath, onboarding, routing, timetable
+from .instrumentation import registry
+from .jobs import claim_next_job, run_job
+from .onboarding import hash_passwords, import_students
+from .seeding import seed_school
+from .models import (
+    Profile, Lesson, Period, Schedule, Mark, HomeTask, MarkStatistic, Tombstone, Holiday, TimetableTemplate,
+    SearchTerm, Job, TimetableSlot,
+)
+from .statistics import find_statistics_drift, rebuild_mark_statistics
+from .timetable import snapshot_keys, timetable_snapshots
+from .serializers import CustomTokenObtainPairSerializer, MarkSerializer
+
+
+def grow_school(school, students=3, days=2):
+    """Add students and school days to a fixture, each day fully timetabled and graded."""
+    for _ in range(students):
+        school.students.append(school.make_user(f'student{len(school.students)}', 'student'))
+    for offset in range(school.days, school.days + days):
+        day = school.today + timedelta(days=offset)
+        for period, lesson in zip(school.periods, school.lessons):
+            schedule = Schedule.objects.create(date=day, period=period, lesson=lesson)
+            HomeTask.objects.create(schedule=schedule, description=f'{lesson.name} exercises')
+    school.days += days
+    existing = set(Mark.objects.values_list('schedule_id', 'student_id'))
+    Mark.objects.bulk_create(
+        Mark(schedule=schedule, student=student, mark=(schedule.id + student.id) % 12 + 1)
+        for schedule in Schedule.objects.all()
+        for student in school.students
+        if (schedule.id, student.id) not in existing
+    )
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SchoolTestCase(TestCase):
+    """Builds a small school and authenticates requests with real JWT tokens."""
+
+    today = date(2024, 11, 4)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = cls.make_user('teacher', 'teacher')
+        cls.periods = [
+            Period.objects.create(number=n, start_time=time(8 + n), end_time=time(8 + n, 45))
+            for n in range(1, 4)
+        ]
+        cls.lessons = [Lesson.objects.create(name=name) for name in ('Maths', 'History', 'Physics')]
+        cls.students = []
+        cls.days = 0
+        grow_school(cls)
+        cls.student = cls.students[0]
+
+    def setUp(self):
+        # grow_school() appends to this, keep each test's copy apart from the class fixture
+        self.students = list(self.students)
+        cache.clear()
+        response_cache.clear()
+
+    @classmethod
+    def make_user(cls, username, role):
+        user = User.objects.create_user(username=username, password='secret', first_name=username.title())
+        Profile.objects.create(user=user, role=role)
+        return user
+
+    def client_for(self, user):
+        client = APIClient()
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+
+
+class QueryBudgetTests(SchoolTestCase):
+    """Every route in api/urls.py runs a fixed number of queries, whatever the data size.
+
+    Budgets include the JWT user lookup and, for teacher routes, the profile
+    lookup done by IsTeacher.
+    """
+
+    def count_queries(self, user, url):
+        # Budgets are for the uncached path
+        cache.clear()
+        response_cache.clear()
+        client = self.client_for(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, getattr(response, 'content', None))
+        return len(queries)
+
+    def assertQueryBudget(self, user, url, budget, grow=None):
+        before = self.count_queries(user, url)
+        (grow or grow_school)(self)
+        after = self.count_queries(user, url)
+        self.assertEqual(before, after, f'{url} query count grows with the data')
+        self.assertLessEqual(after, budget, f'{url} ran {after} queries, budget is {budget}')
+
+    def test_api_root(self):
+        self.assertQueryBudget(self.teacher, '/api/', 1)
+
+    def test_teacher_students(self):
+        self.assertQueryBudget(self.teacher, '/api/teacher/students/', 3)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/students/{self.student.id}/', 3)
+
+    def test_teacher_lessons(self):
+        self.assertQueryBudget(self.teacher, '/api/teacher/lessons/', 3)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/lessons/{self.lessons[0].id}/', 3)
+
+    def test_teacher_schedules(self):
+        schedule = Schedule.objects.first()
+        self.assertQueryBudget(self.teacher, '/api/teacher/schedules/', 3)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/schedules/{schedule.id}/', 3)
+
+    def test_teacher_periods(self):
+        self.assertQueryBudget(self.teacher, '/api/teacher/periods/', 2)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/periods/{self.periods[0].id}/', 2)
+
+    def test_teacher_marks(self):
+        mark = Mark.objects.first()
+        self.assertQueryBudget(self.teacher, '/api/teacher/marks/', 3)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/marks/{mark.id}/', 3)
+
+    def test_teacher_student_marks(self):
+        self.assertQueryBudget(self.teacher, f'/api/teacher/students/{self.student.id}/marks/', 3)
+
+    def test_student_schedule(self):
+        # Cold timetable snapshots cost one query, the marks overlay another
+        self.assertQueryBudget(self.student, f'/api/student/schedule/?date={self.today}', 3)
+        self.assertQueryBudget(self.student, f'/api/student/schedule/?week={self.today}', 3)
+
+    def test_student_marks(self):
+        self.assertQueryBudget(self.student, '/api/student/marks/', 2)
+
+    def test_student_hometasks(self):
+        self.assertQueryBudget(self.student, f'/api/student/hometasks/?date={self.today}', 2)
+
+    def test_gradebooks(self):
+        self.assertQueryBudget(self.teacher, '/api/teacher/gradebook/', 7)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/gradebook/?student={self.student.id}', 5)
+        self.assertQueryBudget(self.student, '/api/student/gradebook/', 4)
+
+    def test_student_dashboard(self):
+        # The user, today's cold snapshots and the marks on them, recent marks and hometasks
+        self.assertQueryBudget(self.student, f'/api/student/dashboard/?date={self.today}', 5)
+
+    def test_teacher_holidays(self):
+        def grow(school):
+            for offset in range(3):
+                Holiday.objects.create(date=school.today + timedelta(days=100 + offset + Holiday.objects.count()))
+        grow(self)
+        holiday = Holiday.objects.first()
+        self.assertQueryBudget(self.teacher, '/api/teacher/holidays/', 3, grow)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/holidays/{holiday.id}/', 3, grow)
+
+    def test_teacher_timetables(self):
+        # The slots are prefetched in one query
+        def grow(school):
+            template = TimetableTemplate.objects.create(name=f'Term {TimetableTemplate.objects.count()}')
+            TimetableSlot.objects.bulk_create(
+                TimetableSlot(template=template, weekday=weekday, period=period, lesson=school.lessons[0])
+                for weekday in range(5) for period in school.periods
+            )
+        grow(self)
+        template = TimetableTemplate.objects.first()
+        self.assertQueryBudget(self.teacher, '/api/teacher/timetables/', 4, grow)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/timetables/{template.id}/', 4, grow)
+
+    def test_teacher_jobs(self):
+        def grow(school):
+            Job.objects.bulk_create(
+                Job(kind='report_cards', owner=school.teacher, params={'start': '2024-09-01', 'end': '2024-12-31'})
+                for _ in range(3)
+            )
+        grow(self)
+        job = Job.objects.first()
+        self.assertQueryBudget(self.teacher, '/api/teacher/jobs/', 3, grow)
+        self.assertQueryBudget(self.teacher, f'/api/teacher/jobs/{job.id}/', 3, grow)
+
+    def test_teacher_exports(self):
+        # One query per EXPORT_CHUNK_SIZE rows, a single chunk here
+        for dataset in ('marks', 'schedules', 'hometasks'):
+            self.assertQueryBudget(self.teacher, f'/api/teacher/export/{dataset}.csv', 3)
+
+    def test_student_search(self):
+        self.assertQueryBudget(self.teacher, '/api/teacher/students/search/?q=stu', 4)
+
+
+class StudentScheduleTests(SchoolTestCase):
+    url = '/api/student/schedule/'
+
+    def get(self, **params):
+        return self.client_for(self.student).get(self.url, params)
+
+    def test_day_includes_slots_without_marks(self):
+        Mark.objects.filter(student=self.student, schedule__period=self.periods[0]).delete()
+        response = self.get(date=self.today, expand='period')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['period']['number'] for row in response.data], [1, 2, 3])
+        self.assertIsNone(response.data[0]['mark'])
+        expected = Mark.objects.get(student=self.student, schedule_id=response.data[1]['id']).mark
+        self.assertEqual(response.data[1]['mark'], expected)
+
+    def test_week_returns_monday_to_sunday(self):
+        # self.today is a Monday; the fixture has lessons on Monday and Tuesday
+        response = self.get(week=self.today + timedelta(days=3))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 6)
+        self.assertEqual(response.data[0]['date'], str(self.today))
+
+    def test_range(self):
+        response = self.get(start=self.today + timedelta(days=1), end=self.today + timedelta(days=10))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row['date'] for row in response.data}, {str(self.today + timedelta(days=1))})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get(date='yesterday').status_code, 400)
+        self.assertEqual(self.get(start=self.today).status_code, 400)
+        self.assertEqual(self.get(start=self.today, end=self.today - timedelta(days=1)).status_code, 400)
+        self.assertEqual(self.get(start=self.today, end=self.today + timedelta(days=365)).status_code, 400)
+
+
+class KeysetPaginationTests(SchoolTestCase):
+
+    def walk(self, client, url, key='next'):
+        seen = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data[key]
+        return seen, response
+
+    def test_marks_walk_forward_and_back(self):
+        client = self.client_for(self.teacher)
+        ids, last = self.walk(client, '/api/teacher/marks/?page_size=7')
+        expected = list(Mark.objects.order_by('schedule__date', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertIsNone(last.data['next'])
+
+        back, first = self.walk(client, last.data['previous'], key='previous')
+        last_page = [row['id'] for row in last.data['results']]
+        self.assertEqual(sorted(back + last_page), sorted(expected))
+        self.assertEqual([row['id'] for row in first.data['results']], expected[:7])
+
+    def test_schedules_keyed_on_date_and_period(self):
+        client = self.client_for(self.teacher)
+        ids, _ = self.walk(client, '/api/teacher/schedules/?page_size=2')
+        expected = list(Schedule.objects.order_by('date', 'period__number').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_ordering_parameter_is_kept(self):
+        client = self.client_for(self.teacher)
+        url = f'/api/teacher/students/{self.student.id}/marks/?ordering=-mark&page_size=2'
+        ids, _ = self.walk(client, url)
+        expected = list(
+            Mark.objects.filter(student=self.student).order_by('-mark', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_deep_page_costs_the_same(self):
+        client = self.client_for(self.teacher)
+        url = '/api/teacher/marks/?page_size=2'
+        with CaptureQueriesContext(connection) as shallow:
+            response = client.get(url)
+        while response.data['next']:
+            url = response.data['next']
+            response = client.get(url)
+        with CaptureQueriesContext(connection) as deep:
+            client.get(url)
+        self.assertEqual(len(shallow), len(deep))
+        self.assertNotIn('OFFSET', deep.captured_queries[-1]['sql'])
+
+    def test_invalid_cursor(self):
+        response = self.client_for(self.teacher).get('/api/teacher/marks/?cursor=bogus')
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor_values(self):
+        client = self.client_for(self.teacher)
+        for values in (['notadate', 1], ['2024-11-04', 'one'], [[1], {}]):
+            cursor = urlsafe_b64encode(json.dumps({'v': values, 'r': 0}).encode()).decode()
+            response = client.get('/api/teacher/marks/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, values)
+        cursor = urlsafe_b64encode(json.dumps({'v': [str(self.today), 1], 'r': 0}).encode()).decode()
+        self.assertEqual(client.get('/api/teacher/marks/', {'cursor': cursor}).status_code, 200)
+
+
+class BulkMarkTests(SchoolTestCase):
+    url = '/api/teacher/marks/bulk/'
+
+    def setUp(self):
+        super().setUp()
+        self.schedule = Schedule.objects.first()
+        self.newcomer = self.make_user('newcomer', 'student')
+
+    def test_upserts_a_lesson_slot(self):
+        existing = Mark.objects.get(schedule=self.schedule, student=self.student)
+        unchanged = Mark.objects.get(schedule=self.schedule, student=self.students[1])
+        payload = {
+            'schedule_id': self.schedule.id,
+            'marks': [
+                {'student_id': self.student.id, 'mark': existing.mark % 12 + 1},
+                {'student_id': self.students[1].id, 'mark': unchanged.mark},
+                {'student_id': self.newcomer.id, 'mark': 9},
+            ],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(self.teacher).post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        statuses = [row['status'] for row in response.data['results']]
+        self.assertEqual(statuses, ['updated', 'unchanged', 'created'])
+        self.assertEqual(response.data['results'][0]['id'], existing.id)
+        created = Mark.objects.get(schedule=self.schedule, student=self.newcomer)
+        self.assertEqual((response.data['results'][2]['id'], created.mark), (created.id, 9))
+        existing.refresh_from_db()
+        self.assertEqual(existing.mark, payload['marks'][0]['mark'])
+        # Constant in the class size, savepoints and the statistics refresh included
+        self.assertLessEqual(len(queries), 13)
+
+    def test_batch_across_schedules(self):
+        schedules = list(Schedule.objects.all()[:3])
+        payload = {'marks': [
+            {'schedule_id': schedule.id, 'student_id': self.newcomer.id, 'mark': 5} for schedule in schedules
+        ]}
+        response = self.client_for(self.teacher).post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Mark.objects.filter(student=self.newcomer).count(), 3)
+
+    def test_invalid_rows_write_nothing(self):
+        payload = {
+            'schedule_id': self.schedule.id,
+            'marks': [
+                {'student_id': self.newcomer.id, 'mark': 9},
+                {'student_id': self.teacher.id, 'mark': 9},
+                {'student_id': self.newcomer.id, 'mark': 3},
+                {'student_id': self.newcomer.id, 'schedule_id': 0, 'mark': 3},
+            ],
+        }
+        response = self.client_for(self.teacher).post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['marks']
+        self.assertEqual(errors[0], {})
+        self.assertIn('student_id', errors[1])
+        self.assertIn('non_field_errors', errors[2])
+        self.assertIn('schedule_id', errors[3])
+        self.assertFalse(Mark.objects.filter(student=self.newcomer).exists())
+
+    def test_requires_teacher(self):
+        response = self.client_for(self.student).post(self.url, {'marks': []}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class GradebookTests(SchoolTestCase):
+
+    def test_student_matrix(self):
+        response = self.client_for(self.student).get('/api/student/gradebook/')
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual([lesson['name'] for lesson in data['lessons']], ['History', 'Maths', 'Physics'])
+        self.assertEqual(data['dates'], [self.today, self.today + timedelta(days=1)])
+        marks = Mark.objects.filter(student=self.student).select_related('schedule__lesson')
+        expected = sorted(
+            [data['lessons'].index({'id': m.schedule.lesson_id, 'name': m.schedule.lesson.name}),
+             data['dates'].index(m.schedule.date), m.mark]
+            for m in marks
+        )
+        self.assertEqual(sorted(data['cells']), expected)
+        maths = [m.mark for m in marks if m.schedule.lesson.name == 'Maths']
+        self.assertEqual(data['averages'][1], round(sum(maths) / len(maths), 2))
+
+    def test_class_matrix_with_date_range(self):
+        response = self.client_for(self.teacher).get('/api/teacher/gradebook/', {'start': self.today, 'end': self.today})
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['dates'], [self.today])
+        self.assertEqual(len(data['students']), len(self.students))
+        self.assertEqual(len(data['cells']), Mark.objects.filter(schedule__date=self.today).count())
+        self.assertEqual(len(data['student_averages']), len(self.students) * len(self.lessons))
+
+    def test_marks_written_between_the_reads_are_left_out(self):
+        later = Schedule.objects.create(
+            date=self.today + timedelta(days=9), period=self.periods[0], lesson=Lesson.objects.create(name='Art')
+        )
+        list_lessons = Lesson.objects.filter
+
+        def concurrent_write(*args, **kwargs):
+            # A mark on a lesson the grid rows did not include lands before the averages are read
+            Mark.objects.create(schedule=later, student=self.student, mark=7)
+            return list_lessons(*args, **kwargs)
+        with mock.patch.object(Lesson.objects, 'filter', concurrent_write):
+            data = build_gradebook(Mark.objects.all(), per_student=True)
+        self.assertNotIn('Art', [lesson['name'] for lesson in data['lessons']])
+        self.assertEqual(len(data['cells']), Mark.objects.count() - 1)
+        self.assertEqual(len(data['student_averages']), len(self.students) * len(self.lessons))
+
+    def test_payload_is_smaller_than_mark_list(self):
+        client = self.client_for(self.student)
+        matrix = client.get('/api/student/gradebook/')
+        listing = client.get('/api/student/marks/', {'expand': 'student,schedule.lesson,schedule.period'})
+        self.assertLess(len(matrix.content) * 4, len(listing.content))
+
+    def test_teacher_only(self):
+        self.assertEqual(self.client_for(self.student).get('/api/teacher/gradebook/').status_code, 403)
+        self.assertEqual(self.client_for(self.teacher).get('/api/teacher/gradebook/?student=x').status_code, 400)
+
+
+class MarkStatisticTests(SchoolTestCase):
+
+    def assertNoDrift(self):
+        _, missing, stale, orphaned = find_statistics_drift()
+        self.assertEqual((missing, stale, orphaned), (set(), set(), set()))
+
+    def stat(self, student, lesson):
+        return MarkStatistic.objects.get(student=student, lesson=lesson)
+
+    def test_bulk_fixture_needs_rebuild(self):
+        # The fixture writes marks with bulk_create, which bypasses the signals
+        self.assertTrue(any(find_statistics_drift()[1:]))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_mark_statistics', '--check', stdout=out)
+        call_command('rebuild_mark_statistics', stdout=out)
+        call_command('rebuild_mark_statistics', '--check', stdout=out)
+        self.assertNoDrift()
+
+    def test_signals_keep_statistics_current(self):
+        rebuild_mark_statistics()
+        maths = self.lessons[0]
+        mark = Mark.objects.filter(student=self.student, schedule__lesson=maths).first()
+        before = self.stat(self.student, maths)
+
+        mark.mark = 12
+        mark.save()
+        self.assertEqual(self.stat(self.student, maths).maximum, 12)
+        self.assertNoDrift()
+
+        schedule = Schedule.objects.create(date=self.today + timedelta(days=30), period=self.periods[0], lesson=maths)
+        Mark.objects.create(student=self.student, schedule=schedule, mark=1)
+        stat = self.stat(self.student, maths)
+        self.assertEqual((stat.count, stat.minimum, stat.last_mark_date), (before.count + 1, 1, schedule.date))
+
+        schedule.lesson = self.lessons[1]
+        schedule.save()
+        self.assertEqual(self.stat(self.student, maths).count, before.count)
+        self.assertNoDrift()
+
+        Mark.objects.filter(student=self.student, schedule__lesson=maths).delete()
+        self.assertFalse(MarkStatistic.objects.filter(student=self.student, lesson=maths).exists())
+        self.assertNoDrift()
+
+    def test_moving_a_schedule_refreshes_last_mark_date(self):
+        rebuild_mark_statistics()
+        schedule = Schedule.objects.filter(date=self.today + timedelta(days=1)).first()
+        later = self.today + timedelta(days=40)
+        response = self.client_for(self.teacher).patch(
+            f'/api/teacher/schedules/{schedule.id}/', {'date': later}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stat(self.student, schedule.lesson).last_mark_date, later)
+        self.assertNoDrift()
+
+    def test_bulk_upsert_refreshes_statistics(self):
+        rebuild_mark_statistics()
+        schedule = Schedule.objects.first()
+        payload = {'schedule_id': schedule.id, 'marks': [{'student_id': s.id, 'mark': 2} for s in self.students]}
+        response = self.client_for(self.teacher).post('/api/teacher/marks/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNoDrift()
+
+
+class VersionedCacheTests(SchoolTestCase):
+    url = '/api/teacher/lessons/'
+
+    def test_conditional_get_is_answered_without_queries(self):
+        client = self.client_for(self.teacher)
+        first = client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        self.assertEqual(first['Last-Modified'], http_date(model_version(Lesson) // 1000))
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = client.get(self.url)
+        self.assertEqual(cached.data, first.data)
+        # Only authentication and the IsTeacher profile lookup remain
+        self.assertEqual(len(queries), 2)
+
+        not_modified = client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_if_modified_since(self):
+        client = self.client_for(self.teacher)
+        first = client.get(self.url)
+        # Lessons may have changed later within the same second
+        self.assertEqual(client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 200)
+        later = http_date(model_version(Lesson) // 1000 + 1)
+        self.assertEqual(client.get(self.url, HTTP_IF_MODIFIED_SINCE=later).status_code, 304)
+        # If-None-Match takes precedence
+        response = client.get(self.url, HTTP_IF_MODIFIED_SINCE=later, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+        Lesson.objects.create(name='Chemistry')
+        self.assertEqual(client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 200)
+
+    def test_version_is_bumped_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.create(name='Chemistry')
+            during = model_version(Lesson)
+        self.assertGreater(model_version(Lesson), during)
+
+    def test_saves_and_deletes_invalidate(self):
+        client = self.client_for(self.teacher)
+        first = client.get(self.url)
+        Lesson.objects.create(name='Chemistry')
+        changed = client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertIn('Chemistry', [lesson['name'] for lesson in changed.data])
+
+        Lesson.objects.get(name='Chemistry').delete()
+        self.assertNotIn('Chemistry', [lesson['name'] for lesson in client.get(self.url).data])
+
+    def test_roster_follows_profile_changes(self):
+        client = self.client_for(self.teacher)
+        url = f'/api/teacher/students/{self.student.id}/'
+        client.get(url)
+        profile = self.student.profile
+        profile.address = 'Main Street 1'
+        profile.save()
+        self.assertEqual(client.get(url).data['profile']['address'], 'Main Street 1')
+
+    def test_permissions_still_apply(self):
+        self.client_for(self.teacher).get(self.url)
+        self.assertEqual(self.client_for(self.student).get(self.url).status_code, 403)
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+        }}):
+            client = self.client_for(self.teacher)
+            first = client.get('/api/teacher/periods/')
+            self.assertEqual(client.get('/api/teacher/periods/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+            Period.objects.create(number=9, start_time=time(16), end_time=time(16, 45))
+            self.assertEqual(client.get('/api/teacher/periods/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+class StatelessAuthenticationTests(SchoolTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Views read DEFAULT_AUTHENTICATION_CLASSES at import time, as JWT_STATELESS_AUTH does
+        patcher = mock.patch.object(APIView, 'authentication_classes', [ClaimsJWTAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def count_queries(self, user, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(user).get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def test_student_reads_cost_no_auth_queries(self):
+        self.assertEqual(self.count_queries(self.student, '/api/student/marks/'), 1)
+        timetable_snapshots([self.today])
+        self.assertEqual(self.count_queries(self.student, f'/api/student/schedule/?date={self.today}'), 1)
+
+    def test_teacher_role_comes_from_the_token(self):
+        self.assertEqual(self.count_queries(self.teacher, '/api/teacher/lessons/'), 1)
+        self.assertEqual(self.client_for(self.student).get('/api/teacher/lessons/').status_code, 403)
+
+    def test_claims_user(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.student).access_token
+        user = ClaimsJWTAuthentication().get_user(AccessToken(str(token)))
+        self.assertEqual((user.pk, user.username, user.profile.role), (self.student.pk, 'student0', 'student'))
+
+    def test_revoked_token(self):
+        client = self.client_for(self.student)
+        token = AccessToken(client._credentials['HTTP_AUTHORIZATION'].split()[1])
+        revoke_token(token)
+        self.assertEqual(client.get('/api/student/marks/').status_code, 401)
+        self.assertEqual(self.client_for(self.students[1]).get('/api/student/marks/').status_code, 200)
+
+    def test_role_change_and_deactivation_revoke_tokens(self):
+        client = self.client_for(self.teacher)
+        refresh = CustomTokenObtainPairSerializer.get_token(self.teacher)
+        profile = self.teacher.profile
+        profile.role = 'student'
+        profile.save()
+        self.assertEqual(client.get('/api/teacher/periods/').status_code, 401)
+        response = APIClient().post('/api/token/refresh/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+        client = self.client_for(self.student)
+        self.student.is_active = False
+        self.student.save()
+        self.assertEqual(client.get('/api/student/marks/').status_code, 401)
+
+    def test_refused_without_a_shared_cache(self):
+        with override_settings(JWT_STATELESS_AUTH=True):
+            self.assertEqual([error.id for error in check_stateless_auth_cache(None)], ['api.E001'])
+            shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp'}}
+            with override_settings(CACHES=shared):
+                self.assertEqual(check_stateless_auth_cache(None), [])
+        self.assertEqual(check_stateless_auth_cache(None), [])
+
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+class QueryPlanTests(SchoolTestCase):
+    """The hot view queries are served by the indexes added for them."""
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor != 'sqlite':
+            self.skipTest('Plans are asserted against SQLite index names')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index}', plan)
+
+    def test_student_marks(self):
+        marks = Mark.objects.filter(student_id=self.student.id).order_by('schedule__date', 'id')
+        self.assertUsesIndex(marks, 'mark_student_schedule_idx')
+
+    def test_timetable_range(self):
+        schedules = Schedule.objects.filter(date__range=(self.today, self.today + timedelta(days=6)))
+        self.assertUsesIndex(schedules, 'api_schedule_date_period')
+
+    def test_hometasks_from_date(self):
+        self.assertUsesIndex(HomeTask.objects.filter(schedule__date__gte=self.today), 'api_schedule_date_period')
+
+    def test_roster(self):
+        self.assertUsesIndex(User.objects.filter(profile__role='student'), 'profile_role_user_idx')
+
+    def test_student_lesson_marks(self):
+        marks = Mark.objects.filter(student_id=self.student.id, schedule__lesson_id=self.lessons[0].id)
+        self.assertUsesIndex(marks, 'schedule_lesson_date_idx')
+        self.assertUsesIndex(marks, 'mark_student_schedule_idx')
+
+    def test_student_search_prefix(self):
+        terms = SearchTerm.objects.filter(term__gte='stu', term__lt='stu\U0010ffff')
+        self.assertUsesIndex(terms, 'api_searchterm_term_user_id')
+
+
+class ChangeFeedTests(SchoolTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.client_for(self.student)
+        # Rewind every row so the feed's overlap window does not pick up the fixture
+        long_ago = timezone.now() - timedelta(days=1)
+        for model in (Mark, Schedule, HomeTask):
+            model.objects.update(updated_at=long_ago)
+
+    def cursor(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Sync-Cursor']
+
+    def test_student_marks_feed(self):
+        cursor = self.cursor('/api/student/marks/')
+        response = self.client.get('/api/student/marks/', {'since': cursor})
+        self.assertEqual((response.data['changed'], response.data['deleted']), ([], []))
+
+        changed = Mark.objects.filter(student=self.student).first()
+        changed.mark = 1
+        changed.save()
+        removed = Mark.objects.filter(student=self.student).last()
+        removed_id = removed.id
+        removed.delete()
+        Mark.objects.filter(student=self.students[1]).last().delete()
+
+        response = self.client.get('/api/student/marks/', {'since': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['changed']], [changed.id])
+        self.assertEqual(response.data['deleted'], [removed_id])
+        self.assertEqual(response['X-Sync-Cursor'], response.data['cursor'])
+
+    def test_student_schedule_feed_includes_mark_changes(self):
+        url = '/api/student/schedule/'
+        cursor = self.client.get(url, {'week': self.today})['X-Sync-Cursor']
+        mark = Mark.objects.filter(student=self.student).first()
+        mark.delete()
+        response = self.client.get(url, {'week': self.today, 'since': cursor})
+        self.assertEqual([(row['id'], row['mark']) for row in response.data['changed']], [(mark.schedule_id, None)])
+
+    def test_teacher_schedule_feed(self):
+        client = self.client_for(self.teacher)
+        cursor = client.get('/api/teacher/schedules/')['X-Sync-Cursor']
+        schedule = Schedule.objects.first()
+        schedule.lesson = self.lessons[2]
+        schedule.save()
+        deleted = Schedule.objects.last()
+        deleted_id = deleted.id
+        deleted.delete()
+        response = client.get('/api/teacher/schedules/', {'since': cursor})
+        self.assertEqual([row['id'] for row in response.data['changed']], [schedule.id])
+        self.assertEqual(response.data['deleted'], [deleted_id])
+
+    def test_bulk_upsert_touches_updated_at(self):
+        client = self.client_for(self.teacher)
+        cursor = client.get('/api/teacher/marks/')['X-Sync-Cursor']
+        schedule = Schedule.objects.first()
+        client.post('/api/teacher/marks/bulk/', {
+            'schedule_id': schedule.id, 'marks': [{'student_id': self.student.id, 'mark': 12}],
+        }, format='json')
+        response = client.get('/api/teacher/marks/', {'since': cursor})
+        self.assertEqual(len(response.data['changed']), 1)
+
+    def test_stale_or_invalid_cursor(self):
+        old = (timezone.now() - timedelta(days=60)).isoformat().replace('+00:00', 'Z')
+        self.assertEqual(self.client.get('/api/student/marks/', {'since': old}).status_code, 410)
+        self.assertEqual(self.client.get('/api/student/marks/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_prune_tombstones(self):
+        Mark.objects.first().delete()
+        Tombstone.objects.update(deleted_at=timezone.now() - timedelta(days=31))
+        call_command('prune_tombstones', stdout=StringIO())
+        self.assertFalse(Tombstone.objects.exists())
+
+
+class StudentEventStreamTests(SchoolTestCase):
+    url = '/api/student/events/'
+
+    def listen(self, ticket, publish):
+        """Open the stream, publish once subscribed and return the next chunk."""
+        async def run():
+            response = await AsyncClient().get(self.url, {'ticket': ticket})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = response.streaming_content
+            self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+            publish()
+            try:
+                return await asyncio.wait_for(anext(stream), 1)
+            finally:
+                await stream.aclose()
+        return async_to_sync(run)()
+
+    def test_student_receives_own_marks_and_hometasks(self):
+        broker = get_broker()
+
+        def publish():
+            broker.publish(student_channel(self.students[1].pk), {'type': 'mark', 'id': 0})
+            broker.publish(student_channel(self.student.pk), {'type': 'mark', 'id': 1})
+        chunk = self.listen(issue_stream_ticket(self.student.pk), publish)
+        self.assertEqual(chunk, b'id: 1\nevent: mark\ndata: {"type":"mark","id":1}\n\n')
+
+        chunk = self.listen(
+            issue_stream_ticket(self.student.pk), lambda: broker.publish('students', {'type': 'hometask', 'id': 2})
+        )
+        self.assertTrue(chunk.startswith(b'id: 1\nevent: hometask\n'))
+        self.assertEqual(broker._subscribers, {})
+
+    def test_tickets_are_issued_over_asgi_only(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.student).access_token
+
+        async def post():
+            return await AsyncClient().post(f'{self.url}ticket/', headers={'Authorization': f'Bearer {token}'})
+        response = async_to_sync(post)()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(async_to_sync(redeem_stream_ticket)(response.json()['ticket']), self.student.pk)
+        # Under WSGI the stream would never send anything, clients poll instead
+        self.assertEqual(self.client_for(self.student).post(f'{self.url}ticket/').status_code, 501)
+        self.assertEqual(self.client.get(self.url, {'ticket': issue_stream_ticket(self.student.pk)}).status_code, 501)
+
+    def test_rejects_missing_used_or_revoked_credentials(self):
+        async def get(headers=None, **params):
+            return await AsyncClient().get(self.url, params, headers=headers)
+        self.assertEqual(async_to_sync(get)().status_code, 401)
+        self.assertEqual(async_to_sync(get)(ticket='garbage').status_code, 401)
+        ticket = issue_stream_ticket(self.student.pk)
+        self.assertEqual(async_to_sync(redeem_stream_ticket)(ticket), self.student.pk)
+        self.assertEqual(async_to_sync(get)(ticket=ticket).status_code, 401)
+        # Access tokens are no longer taken from the query string
+        access = CustomTokenObtainPairSerializer.get_token(self.student).access_token
+        self.assertEqual(async_to_sync(get)(token=str(access)).status_code, 401)
+        revoke_token(access)
+        self.assertEqual(async_to_sync(get)({'Authorization': f'Bearer {access}'}).status_code, 401)
+
+    def test_writes_publish_after_commit(self):
+        mark = Mark.objects.filter(student=self.student).first()
+        with mock.patch.object(InProcessBroker, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                mark.mark = 3
+                mark.save()
+                HomeTask.objects.first().delete()
+                self.client_for(self.teacher).post('/api/teacher/marks/bulk/', {
+                    'schedule_id': mark.schedule_id,
+                    'marks': [{'student_id': self.students[1].id, 'mark': 11}],
+                }, format='json')
+        events = [(channel, event['type'], event['action']) for (channel, event), _ in publish.call_args_list]
+        self.assertEqual(events, [
+            (student_channel(self.student.pk), 'mark', 'updated'),
+            ('students', 'hometask', 'deleted'),
+            (student_channel(self.students[1].pk), 'mark', 'updated'),
+        ])
+
+
+class StudentImportTests(SchoolTestCase):
+    url = '/api/teacher/students/import/'
+
+    def test_imports_json_roster_and_reports_bad_rows(self):
+        roster = [
+            {'username': 'new1', 'password': 'pw1', 'first_name': 'Ann', 'date_of_birth': '2012-05-01'},
+            {'username': 'student0', 'password': 'pw2'},
+            {'username': 'new2', 'password': 'pw3', 'email': 'not-an-email'},
+            {'username': 'new1', 'password': 'pw4'},
+            {'username': 'new3', 'password': 'pw5', 'address': 'Main st. 1'},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(self.teacher).post(self.url, {'students': roster}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'], 3)
+        self.assertEqual([row['status'] for row in response.data['rows']],
+                         ['created', 'error', 'error', 'error', 'created'])
+        self.assertIn('email', response.data['rows'][2]['errors'])
+        self.assertIn('username', response.data['rows'][3]['errors'])
+        # Authentication, the username check and three bulk inserts, independent of roster size
+        self.assertLessEqual(len(queries), 9)
+
+        user = User.objects.select_related('profile').get(username='new1')
+        self.assertEqual(response.data['rows'][0]['id'], user.id)
+        self.assertTrue(user.check_password('pw1'))
+        self.assertEqual((user.first_name, user.profile.role, user.profile.date_of_birth),
+                         ('Ann', 'student', date(2012, 5, 1)))
+        self.assertEqual(User.objects.get(username='new3').profile.address, 'Main st. 1')
+
+    def test_imports_csv_upload(self):
+        content = 'username,password,first_name,date_of_birth\ncsv1,pw,Bob,\ncsv2,pw,Eve,2011-01-02\n'
+        upload = SimpleUploadedFile('roster.csv', content.encode(), content_type='text/csv')
+        response = self.client_for(self.teacher).post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(Profile.objects.filter(user__username__startswith='csv', role='student').count(), 2)
+
+    def test_imported_students_appear_in_cached_roster(self):
+        client = self.client_for(self.teacher)
+        before = client.get('/api/teacher/students/').data['results']
+        client.post(self.url, [{'username': 'late', 'password': 'pw'}], format='json')
+        after = client.get('/api/teacher/students/').data['results']
+        self.assertEqual(len(after), len(before) + 1)
+
+    def test_requires_teacher(self):
+        response = self.client_for(self.student).post(self.url, [{'username': 'x', 'password': 'pw'}], format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client_for(self.teacher).post(self.url, [], format='json').status_code, 400)
+
+    def test_hashes_in_worker_processes(self):
+        passwords = [f'secret{n}' for n in range(20)]
+        hashes = hash_passwords(passwords, workers=2)
+        self.assertTrue(all(check_password(password, encoded) for password, encoded in zip(passwords, hashes)))
+        # One spawned pool serves every import, the server process is never forked
+        pool = onboarding._hash_pool(2)
+        self.assertEqual(pool._mp_context.get_start_method(), 'spawn')
+        hash_passwords(passwords, workers=2)
+        self.assertIs(onboarding._hash_pool(2), pool)
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as roster:
+            roster.write('[{"username": "cli1", "password": "pw"}, {"username": "", "password": "pw"}]')
+            roster.flush()
+            out, err = StringIO(), StringIO()
+            call_command('import_students', roster.name, workers=1, stdout=out, stderr=err)
+        self.assertIn('Created 1 students, 1 errors.', out.getvalue())
+        self.assertIn('row 2', err.getvalue())
+
+
+class ExportTests(SchoolTestCase):
+    def export(self, path, **params):
+        response = self.client_for(self.teacher).get(f'/api/teacher/export/{path}', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_marks_csv(self):
+        rows = list(csv.reader(StringIO(self.export('marks.csv').decode())))
+        self.assertEqual(rows[0], ['id', 'date', 'period', 'lesson', 'student_id', 'username',
+                                   'first_name', 'last_name', 'mark'])
+        self.assertEqual(len(rows) - 1, Mark.objects.count())
+        mark = Mark.objects.select_related('schedule__lesson').get(pk=int(rows[1][0]))
+        self.assertEqual(rows[1][1:4], [str(mark.schedule.date), '1', mark.schedule.lesson.name])
+
+    def test_date_range_and_ndjson(self):
+        day = str(self.today)
+        lines = self.export('hometasks.ndjson', start=day, end=day).decode().splitlines()
+        self.assertEqual(len(lines), HomeTask.objects.filter(schedule__date=self.today).count())
+        self.assertEqual(json.loads(lines[0])['date'], day)
+
+    def test_xlsx_is_a_workbook(self):
+        with zipfile.ZipFile(BytesIO(self.export('schedules.xlsx'))) as workbook:
+            self.assertIsNone(workbook.testzip())
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), Schedule.objects.count() + 1)
+        self.assertIn('<t xml:space="preserve">Maths</t>', sheet)
+        self.assertIn('<c s="1"><v>45600</v></c>', sheet)  # 2024-11-04 as a date serial
+
+    def test_query_count_does_not_grow(self):
+        for size in range(2):
+            grow_school(self, students=2, days=2)
+            with CaptureQueriesContext(connection) as queries:
+                self.export('marks.csv')
+            self.assertLessEqual(len(queries), 3)
+
+    def test_chunks_follow_the_ordering(self):
+        grow_school(self, students=2, days=2)
+        with mock.patch.object(exports, 'EXPORT_CHUNK_SIZE', 7), \
+                CaptureQueriesContext(connection) as queries:
+            rows = list(csv.reader(StringIO(self.export('marks.csv').decode())))[1:]
+        expected = Mark.objects.order_by('schedule__date', 'schedule__period__number', 'student_id', 'id')
+        self.assertEqual([int(row[0]) for row in rows], list(expected.values_list('id', flat=True)))
+        # Authentication, the teacher check and one bounded query per chunk
+        self.assertEqual(len(queries), 2 + len(rows) // 7 + 1)
+
+    def test_asgi_streams_without_buffering(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.teacher).access_token
+
+        async def download():
+            response = await AsyncClient().get(
+                '/api/teacher/export/schedules.csv', headers={'Authorization': f'Bearer {token}'}
+            )
+            self.assertTrue(response.is_async)
+            return b''.join([part async for part in response])
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            body = async_to_sync(download)()
+        self.assertEqual([str(warning.message) for warning in caught], [])
+        self.assertEqual(body, self.export('schedules.csv'))
+
+    def test_unknown_and_forbidden(self):
+        self.assertEqual(self.client_for(self.teacher).get('/api/teacher/export/users.csv').status_code, 404)
+        self.assertEqual(self.client_for(self.teacher).get('/api/teacher/export/marks.pdf').status_code, 404)
+        self.assertEqual(self.client_for(self.student).get('/api/teacher/export/marks.csv').status_code, 403)
+
+
+class TimetableTemplateTests(SchoolTestCase):
+    def create_template(self):
+        maths, history, physics = self.lessons
+        slots = [
+            {'weekday': weekday, 'period': period.id, 'lesson': lesson.id}
+            for weekday in range(5)
+            for period, lesson in zip(self.periods, (maths, history, physics))
+        ]
+        response = self.client_for(self.teacher).post(
+            '/api/teacher/timetables/', {'name': 'Autumn', 'slots': slots}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def apply(self, template_id, **data):
+        return self.client_for(self.teacher).post(f'/api/teacher/timetables/{template_id}/apply/', data, format='json')
+
+    def test_expands_term_skipping_weekends_and_holidays(self):
+        template_id = self.create_template()
+        Holiday.objects.create(date=date(2024, 11, 13), name='Staff day')
+        start, end = date(2024, 11, 11), date(2024, 11, 24)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.apply(template_id, start=start, end=end)
+        self.assertEqual(response.status_code, 200)
+        # Two weeks of five days less the holiday, three periods a day
+        self.assertEqual(response.data['created'], 9 * 3)
+        self.assertEqual(response.data['holidays'], [date(2024, 11, 13)])
+        # Authentication, the template, its slots, holidays, existing lessons and one insert
+        self.assertLessEqual(len(queries), 9)
+        days = set(Schedule.objects.filter(date__range=(start, end)).values_list('date', flat=True))
+        self.assertEqual(len(days), 9)
+        self.assertTrue(all(day.weekday() < 5 for day in days))
+
+        again = self.apply(template_id, start=start, end=end)
+        self.assertEqual((again.data['created'], again.data['unchanged']), (0, 27))
+
+    def test_counts_follow_a_concurrent_run(self):
+        template_id = self.create_template()
+        start = end = date(2024, 11, 11)
+        plan = timetable._plan_template
+        plans = []
+
+        def race(*args):
+            planned, unchanged, conflicts = plan(*args)
+            plans.append(len(planned))
+            if len(plans) == 1:
+                # Another run fills the first slot with the same lesson after it was read
+                Schedule.objects.create(date=start, period=planned[0].period, lesson=planned[0].lesson)
+            return planned, unchanged, conflicts
+        with mock.patch.object(timetable, '_plan_template', race):
+            response = self.apply(template_id, start=start, end=end)
+        self.assertEqual(plans, [3, 2])
+        self.assertEqual((response.data['created'], response.data['unchanged']), (2, 1))
+        self.assertEqual(Schedule.objects.filter(date=start).count(), 3)
+
+        with mock.patch.object(Schedule.objects, 'bulk_create', side_effect=IntegrityError):
+            self.assertEqual(self.apply(template_id, start=start, end=date(2024, 11, 12)).status_code, 409)
+
+    def test_reports_conflicts_without_overwriting(self):
+        template_id = self.create_template()
+        # The fixture already timetables 2024-11-04 and 11-05 with the same lessons
+        Schedule.objects.filter(date=self.today, period=self.periods[0]).update(lesson=self.lessons[2])
+        response = self.apply(template_id, start=self.today, end=self.today + timedelta(days=2))
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['unchanged'], 5)
+        self.assertEqual(response.data['conflicts'], [{
+            'date': self.today, 'period_id': self.periods[0].id,
+            'lesson_id': self.lessons[0].id, 'existing_lesson_id': self.lessons[2].id,
+        }])
+        self.assertEqual(Schedule.objects.get(date=self.today, period=self.periods[0]).lesson, self.lessons[2])
+
+    def test_dry_run_and_validation(self):
+        template_id = self.create_template()
+        response = self.apply(template_id, start='2024-12-02', end='2024-12-06', dry_run=True)
+        self.assertEqual(response.data['created'], 15)
+        self.assertFalse(Schedule.objects.filter(date__gte=date(2024, 12, 2)).exists())
+        self.assertEqual(self.apply(template_id, start='2024-12-06', end='2024-12-02').status_code, 400)
+
+        period = self.periods[0].id
+        response = self.client_for(self.teacher).post('/api/teacher/timetables/', {'name': 'Twice', 'slots': [
+            {'weekday': 0, 'period': period, 'lesson': self.lessons[0].id},
+            {'weekday': 0, 'period': period, 'lesson': self.lessons[1].id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_replaces_slots(self):
+        template_id = self.create_template()
+        response = self.client_for(self.teacher).patch(f'/api/teacher/timetables/{template_id}/', {
+            'slots': [{'weekday': 2, 'period': self.periods[1].id, 'lesson': self.lessons[0].id}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TimetableTemplate.objects.get(pk=template_id).slots.count(), 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SeedAndBenchmarkTests(TestCase):
+    term = {'start': date(2024, 9, 2), 'end': date(2024, 9, 29)}
+
+    def seed(self, **options):
+        return seed_school(students=10, lessons=5, periods=4, seed=7, **self.term, **options)
+
+    def test_seeds_a_reproducible_school(self):
+        counts = self.seed()
+        self.assertEqual(counts['schedules'], 20 * 4)
+        self.assertEqual(counts['marks'], 20 * 4 * 2)
+        self.assertEqual(Profile.objects.filter(role='student').count(), 10)
+        self.assertEqual(find_statistics_drift()[1:], (set(), set(), set()))
+        first = list(Mark.objects.order_by('schedule__date', 'schedule__period__number', 'student__username')
+                     .values_list('schedule__lesson__name', 'student__username', 'mark'))
+        with self.assertRaises(ValueError):
+            self.seed()
+
+        Mark.objects.all().delete()
+        User.objects.filter(username__startswith='seed-').delete()
+        Schedule.objects.all().delete()
+        TimetableTemplate.objects.all().delete()
+        self.seed()
+        second = list(Mark.objects.order_by('schedule__date', 'schedule__period__number', 'student__username')
+                      .values_list('schedule__lesson__name', 'student__username', 'mark'))
+        self.assertEqual(first, second)
+
+    def test_benchmark_covers_every_get_route(self):
+        self.seed()
+        teacher = User.objects.get(username='seed-teacher')
+        student = User.objects.get(username='seed-student-0000')
+        routes = discover_routes(student)
+        self.assertIn(f'/api/teacher/students/{student.pk}/marks/', routes)
+        self.assertIn('/api/teacher/export/marks.csv', routes)
+        self.assertIn('/api/student/gradebook/', routes)
+        first_student = Profile.objects.filter(role='student').order_by('user_id')[0].user_id
+        self.assertIn(f'/api/teacher/students/{first_student}/', routes)
+        self.assertNotIn('/api/student/events/', routes)
+
+        results = run_benchmark({'teacher': teacher, 'student': student}, repeat=2)
+        self.assertEqual(len(results), 2 * len(routes))
+        by_role = {(row['path'], row['role']): row for row in results}
+        self.assertEqual(by_role['/api/teacher/marks/', 'teacher']['status'], 200)
+        self.assertEqual(by_role['/api/teacher/marks/', 'student']['status'], 403)
+        self.assertGreater(by_role['/api/student/marks/', 'student']['bytes'], 0)
+        self.assertTrue(all(row['p95_ms'] >= row['p50_ms'] > 0 for row in results))
+
+    def test_commands(self):
+        out = StringIO()
+        call_command('seed_school', students=3, lessons=2, periods=2, start=self.term['start'],
+                     end=self.term['end'], stdout=out)
+        self.assertIn('Seeded 3 students', out.getvalue())
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark_api', repeat=1, output=output.name, stdout=StringIO())
+            saved = json.load(output)
+            call_command('benchmark_api', repeat=1, compare=output.name, stdout=out)
+        self.assertEqual(saved['repeat'], 1)
+        self.assertIn('Change against', out.getvalue())
+
+
+class RequestMetricsTests(SchoolTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(self.student).get('/api/student/marks/')
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'db', 'serialize', 'view', 'render', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timing['db'])
+
+    def test_serializer_time_is_its_own_timing(self):
+        def serialize_seconds(url, **settings):
+            registry.clear()
+            with override_settings(**settings):
+                response = self.client_for(self.teacher).get(url)
+            self.assertIn('serialize;dur=', response['Server-Timing'])
+            return float(registry.serialize._series[(url.lstrip('/'), 'GET')][1])
+        # The fast path's row building and the serializers' data are both timed
+        self.assertGreater(serialize_seconds('/api/teacher/marks/', FAST_READ_PATH=True), 0)
+        self.assertGreater(serialize_seconds('/api/teacher/marks/', FAST_READ_PATH=False), 0)
+        self.assertEqual(serialize_seconds('/api/teacher/gradebook/'), 0)
+
+    def test_metrics_endpoint_aggregates_by_route(self):
+        client = self.client_for(self.student)
+        client.get('/api/student/marks/')
+        client.get('/api/student/marks/')
+        self.teacher.is_staff = True
+        self.teacher.save()
+        body = self.client_for(self.teacher).get('/metrics').content.decode()
+        self.assertIn('# TYPE ediary_request_duration_seconds histogram', body)
+        self.assertIn('ediary_request_queries_count{route="api/student/marks/",method="GET"} 2', body)
+        self.assertIn('ediary_request_render_seconds_bucket{route="api/student/marks/",method="GET",le="+Inf"} 2', body)
+
+    @override_settings(METRICS_TOKEN='scrape')
+    def test_metrics_token(self):
+        self.assertEqual(APIClient().get('/metrics').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+
+    def test_metrics_need_staff_without_token(self):
+        self.assertEqual(APIClient().get('/metrics').status_code, 403)
+        self.assertEqual(self.client_for(self.teacher).get('/metrics').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer garbage').status_code, 403)
+        admin = User.objects.create_superuser('admin', password='secret')
+        client = APIClient()
+        client.force_login(admin)
+        self.assertEqual(client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_timed(self):
+        response = self.client_for(self.student).get('/api/student/marks/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('ediary_request_queries_count', registry.expose())
+
+    @override_settings(METRICS_SLOW_QUERY_MS=0)
+    def test_slow_query_log(self):
+        with self.assertLogs('api.slow_queries', 'WARNING') as logs:
+            self.client_for(self.student).get('/api/student/marks/')
+        self.assertIn('GET api/student/marks/: SELECT', logs.output[-1])
+        self.assertFalse(hasattr(logs.records[-1], 'params'))
+        self.assertIn('ediary_slow_queries_total{route="api/student/marks/",method="GET"}', registry.expose())
+
+
+class FastReadPathParityTests(SchoolTestCase):
+    """The fast path must send exactly the bytes the serializers and JSONRenderer send."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        profile = cls.students[0].profile
+        profile.date_of_birth = date(2010, 2, 3)
+        profile.address = 'Ул. Шевченка 5\u2028кв. 7 "A" \\ 😀'
+        profile.save()
+        User.objects.filter(pk=cls.students[1].pk).update(first_name='Zoë', email='zoe@example.com')
+        HomeTask.objects.filter(pk=HomeTask.objects.first().pk).update(description='Line\nbreak\ttab \x01 ✓')
+
+    def fetch_pages(self, user, url, params):
+        client = self.client_for(user)
+        pages, response = [], client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.content)
+            next_link = response.json().get('next') if isinstance(response.json(), dict) else None
+            if not next_link:
+                return pages
+            response = client.get(next_link)
+
+    def assertParity(self, user, url, params=None):
+        fast = self.fetch_pages(user, url, params or {})
+        with override_settings(FAST_READ_PATH=False):
+            cache.clear()
+            slow = self.fetch_pages(user, url, params or {})
+        cache.clear()
+        with mock.patch.object(fastpath, 'orjson', None):
+            stdlib = self.fetch_pages(user, url, params or {})
+        self.assertEqual(fast, slow)
+        self.assertEqual(stdlib, slow)
+        return fast
+
+    def test_teacher_mark_list(self):
+        self.assertParity(self.teacher, '/api/teacher/marks/', {'page_size': 4})
+        self.assertParity(self.teacher, '/api/teacher/marks/', {'fields': 'id,schedule.date', 'expand': 'schedule'})
+        pages = self.assertParity(
+            self.teacher, '/api/teacher/marks/', {'page_size': 4, 'expand': 'student,schedule.lesson,schedule.period'}
+        )
+        self.assertGreater(len(pages), 2)
+        self.assertIn('Шевченка'.encode(), b''.join(pages))
+        self.assertIn(b'\\u2028', b''.join(pages))
+
+    def test_student_marks(self):
+        self.assertParity(self.student, '/api/student/marks/', {'page_size': 3, 'expand': 'schedule.lesson'})
+
+    def test_student_hometasks(self):
+        self.assertParity(self.student, '/api/student/hometasks/', {'date': '2024-11-01', 'page_size': 2})
+        self.assertParity(self.student, '/api/student/hometasks/', {'date': '2024-11-01', 'expand': 'schedule.period'})
+
+    def test_periods(self):
+        self.assertParity(self.student, '/api/teacher/periods/')
+
+    def test_fast_path_skips_serializers(self):
+        with mock.patch.object(MarkSerializer, 'to_representation') as to_representation:
+            self.client_for(self.teacher).get('/api/teacher/marks/', {'expand': 'student'})
+        to_representation.assert_not_called()
+
+
+class FieldExpansionTests(SchoolTestCase):
+    def get(self, url, user=None, **params):
+        response = self.client_for(user or self.teacher).get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_relations_are_ids_and_not_joined_by_default(self):
+        with CaptureQueriesContext(connection) as queries:
+            row = self.get('/api/teacher/marks/')['results'][0]
+        self.assertEqual(set(row), {'id', 'mark', 'student', 'schedule'})
+        self.assertIsInstance(row['student'], int)
+        marks_query = next(q['sql'] for q in queries.captured_queries if 'api_mark' in q['sql'])
+        self.assertNotIn('auth_user', marks_query)
+        self.assertNotIn('api_lesson', marks_query)
+
+    def test_expand_and_nested_fields(self):
+        with override_settings(FAST_READ_PATH=False), CaptureQueriesContext(connection) as queries:
+            rows = self.get('/api/teacher/marks/', expand='student,schedule.lesson',
+                            fields='id,student.username,schedule.date,schedule.lesson')['results']
+        self.assertEqual(rows[0]['student'], {'username': rows[0]['student']['username']})
+        self.assertEqual(set(rows[0]['schedule']), {'date', 'lesson'})
+        self.assertEqual(set(rows[0]['schedule']['lesson']), {'id', 'name'})
+        # Expanded relations are joined rather than fetched per row
+        self.assertLessEqual(len(queries), 3)
+
+    def test_detail_and_schedule_views(self):
+        mark = Mark.objects.first()
+        detail = self.get(f'/api/teacher/marks/{mark.pk}/', expand='schedule.period')
+        self.assertEqual(detail['schedule']['period']['number'], mark.schedule.period.number)
+        self.assertEqual(detail['student'], mark.student_id)
+        day = self.get('/api/student/schedule/', self.student, date=self.today, expand='lesson')
+        self.assertEqual(set(day[0]), {'id', 'date', 'period', 'lesson', 'mark'})
+        self.assertIn('name', day[0]['lesson'])
+        self.assertIsInstance(day[0]['period'], int)
+
+    def test_sideloaded_relations_are_listed_once(self):
+        data = self.get('/api/teacher/marks/', expand='student,schedule.lesson', sideload='1', page_size=100)
+        rows, included = data['results'], data['included']
+        self.assertTrue(all(isinstance(row['student'], int) and isinstance(row['schedule'], int) for row in rows))
+        self.assertEqual(sorted(user['id'] for user in included['users']), sorted({row['student'] for row in rows}))
+        self.assertEqual(len(included['schedules']), len({row['schedule'] for row in rows}))
+        self.assertEqual(len(included['lessons']), len(self.lessons))
+        self.assertIsInstance(included['schedules'][0]['lesson'], int)
+
+    def test_writes_ignore_query_parameters(self):
+        response = self.client_for(self.teacher).post(
+            '/api/teacher/schedules/?fields=id',
+            {'date': '2024-12-02', 'lesson_id': self.lessons[0].id, 'period_id': self.periods[0].id},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['lesson'], self.lessons[0].id)
+        self.assertEqual(response.data['date'], '2024-12-02')
+
+
+class MarkAdminTests(SchoolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('admin', password='secret')
+        self.browser = Client()
+        self.browser.force_login(self.admin)
+        rebuild_mark_statistics()
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.browser.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        urls = ['/admin/api/mark/', '/admin/api/schedule/', '/admin/api/hometask/']
+        before = [self.changelist_queries(url) for url in urls]
+        grow_school(self, students=4, days=3)
+        self.assertEqual([self.changelist_queries(url) for url in urls], before)
+
+    @override_settings(ADMIN_COUNT_LIMIT=5)
+    def test_counts_stop_at_the_limit(self):
+        response = self.browser.get('/admin/api/mark/')
+        self.assertEqual(response.context['cl'].result_count, 5)
+        lesson = self.lessons[0]
+        response = self.browser.get(f'/admin/api/mark/?schedule__lesson__id__exact={lesson.pk}&schedule__date={self.today}')
+        self.assertEqual(response.context['cl'].result_count, len(self.students))
+
+    def test_edit_form_uses_autocomplete(self):
+        mark = Mark.objects.first()
+        response = self.browser.get(f'/admin/api/mark/{mark.pk}/change/')
+        self.assertContains(response, 'class="admin-autocomplete"', count=2)
+        self.assertNotContains(response, f'>{self.students[-1].username}<')
+        response = self.browser.get(
+            '/admin/autocomplete/',
+            {'app_label': 'api', 'model_name': 'mark', 'field_name': 'schedule', 'term': str(self.today)},
+        )
+        self.assertEqual(len(response.json()['results']), len(self.periods))
+        response = self.browser.get(
+            '/admin/autocomplete/',
+            {'app_label': 'api', 'model_name': 'mark', 'field_name': 'student', 'term': 'e'},
+        )
+        self.assertNotIn(str(self.teacher.pk), [row['id'] for row in response.json()['results']])
+
+    def test_regrade_action_refreshes_statistics(self):
+        marks = list(Mark.objects.filter(schedule__date=self.today))
+        since = timezone.now()
+        response = self.browser.post('/admin/api/mark/', {
+            'action': 'regrade_marks', '_selected_action': [mark.pk for mark in marks], 'mark': 12,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Mark.objects.filter(pk__in=[mark.pk for mark in marks]).values_list('mark', flat=True)), {12})
+        self.assertEqual(Mark.objects.filter(updated_at__gte=since).count(), len(marks))
+        self.assertEqual(find_statistics_drift()[1:], (set(), set(), set()))
+
+    def test_actions_reject_malformed_values(self):
+        marks = list(Mark.objects.filter(schedule__date=self.today).values_list('pk', flat=True))
+        before = list(Mark.objects.order_by('pk').values_list('schedule_id', 'mark'))
+        for action, field, value in [
+            ('regrade_marks', 'mark', '--5'), ('regrade_marks', 'mark', '\u00b2'), ('regrade_marks', 'mark', ''),
+            ('move_marks', 'schedule', '--5'), ('move_marks', 'schedule', '\u00b2'), ('move_marks', 'schedule', '0'),
+        ]:
+            response = self.browser.post(
+                '/admin/api/mark/', {'action': action, '_selected_action': marks, field: value}, follow=True
+            )
+            self.assertEqual(response.status_code, 200)
+            # The changelist refuses a form that does not validate before calling the action
+            levels = [message.level for message in response.context['messages']]
+            self.assertEqual(levels, [messages.ERROR if value in ('', '0') else messages.WARNING])
+        self.assertEqual(list(Mark.objects.order_by('pk').values_list('schedule_id', 'mark')), before)
+
+    def test_move_action_keeps_one_mark_per_student(self):
+        source = Schedule.objects.filter(date=self.today).first()
+        target = Schedule.objects.create(date=self.today - timedelta(days=1), period=self.periods[0], lesson=self.lessons[1])
+        Mark.objects.create(schedule=target, student=self.student, mark=3)
+        marks = list(Mark.objects.filter(schedule=source))
+        self.browser.post('/admin/api/mark/', {
+            'action': 'move_marks', '_selected_action': [mark.pk for mark in marks], 'schedule': target.pk,
+        })
+        self.assertEqual(Mark.objects.filter(schedule=target).count(), len(self.students))
+        self.assertEqual(Mark.objects.get(schedule=target, student=self.student).mark, 3)
+        self.assertEqual(list(Mark.objects.filter(schedule=source).values_list('student_id', flat=True)), [self.student.pk])
+        self.assertEqual(find_statistics_drift()[1:], (set(), set(), set()))
+
+
+class StudentDashboardTests(SchoolTestCase):
+    def get(self, client, path, **params):
+        response = client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_matches_the_separate_endpoints(self):
+        client = self.client_for(self.student)
+        dashboard = self.get(client, '/api/student/dashboard/', date=self.today)
+        self.assertEqual(dashboard['user']['username'], self.student.username)
+        self.assertEqual(dashboard['date'], str(self.today))
+        schedule = self.get(client, '/api/student/schedule/', date=self.today, expand='lesson,period')
+        self.assertEqual(dashboard['today'], schedule)
+        marks = self.get(client, '/api/student/marks/', expand='schedule.lesson,schedule.period', page_size=100)
+        ordered = sorted(marks['results'], key=lambda mark: (mark['schedule']['date'], mark['id']), reverse=True)
+        self.assertEqual(dashboard['recent_marks'], ordered[:10])
+        hometasks = self.get(client, '/api/student/hometasks/', date=self.today, expand='schedule.lesson,schedule.period')
+        self.assertEqual(
+            sorted(task['id'] for task in dashboard['hometasks']),
+            sorted(task['id'] for task in hometasks['results']),
+        )
+
+    def test_query_count_does_not_grow(self):
+        client = self.client_for(self.student)
+        # Builds today's timetable snapshot
+        self.get(client, '/api/student/dashboard/', date=self.today)
+        with CaptureQueriesContext(connection) as before:
+            self.get(client, '/api/student/dashboard/', date=self.today)
+        grow_school(self, students=3, days=5)
+        with CaptureQueriesContext(connection) as after:
+            self.get(client, '/api/student/dashboard/', date=self.today)
+        # The user, then one query per part
+        self.assertEqual(len(before), 4)
+        self.assertEqual(len(after), len(before))
+
+
+class StudentDashboardConcurrencyTests(TransactionTestCase):
+    today = SchoolTestCase.today
+    make_user = SchoolTestCase.make_user
+    client_for = SchoolTestCase.client_for
+
+    def setUp(self):
+        self.periods = [Period.objects.create(number=n, start_time=time(8 + n), end_time=time(8 + n, 45)) for n in (1, 2)]
+        self.lessons = [Lesson.objects.create(name=name) for name in ('Maths', 'History')]
+        self.students, self.days = [], 0
+        grow_school(self, students=2, days=3)
+
+    @override_settings(DASHBOARD_WORKERS=3)
+    def test_parts_run_on_the_pool(self):
+        threads = set()
+        original = dashboard._serialize
+
+        def record(*args, **kwargs):
+            threads.add(threading.current_thread().name)
+            return original(*args, **kwargs)
+
+        with mock.patch.object(dashboard, '_serialize', record):
+            response = self.client_for(self.students[0]).get('/api/student/dashboard/', {'date': self.today})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith('dashboard') for name in threads))
+        self.assertEqual(len(response.json()['today']), len(self.periods))
+        self.assertEqual(len(response.json()['recent_marks']), self.days * len(self.periods))
+
+    @override_settings(DASHBOARD_WORKERS=3)
+    def test_parts_run_in_the_callers_context(self):
+        state = routing.RoutingState(None)
+        token = routing._state.set(state)
+        try:
+            seen = dashboard.run_parts({'state': routing._state.get, 'other': routing._state.get})
+        finally:
+            routing._state.reset(token)
+        self.assertEqual(seen, {'state': state, 'other': state})
+
+    @override_settings(DASHBOARD_WORKERS=3)
+    def test_pool_queries_are_measured(self):
+        cache.clear()
+        client = self.client_for(self.students[0])
+        response = client.get('/api/student/dashboard/', {'date': self.today})
+        # The user, the timetable snapshot, the marks overlay, recent marks and hometasks
+        self.assertIn('desc="5 queries"', response['Server-Timing'])
+        result = measure(client, f'/api/student/dashboard/?date={self.today}', repeat=1)
+        self.assertEqual(result['queries'], 4)
+
+
+class StudentSearchTests(SchoolTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.zoe = cls.make_user('zmiller', 'student')
+        cls.zoe.first_name, cls.zoe.last_name = 'Zoë', 'Miller-Brown'
+        cls.zoe.save()
+
+    def search(self, q, **params):
+        response = self.client_for(self.teacher).get('/api/teacher/students/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_of_any_name_word(self):
+        for q in ('zoe', 'ZO', 'mill', 'brown', 'zmil', 'zoe mil'):
+            self.assertEqual([row['id'] for row in self.search(q)], [self.zoe.pk], q)
+        self.assertEqual(self.search('zoe')[0], {'id': self.zoe.pk, 'username': 'zmiller', 'name': 'Zoë Miller-Brown'})
+        self.assertEqual(self.search('zoe smith'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_only_students_are_found(self):
+        self.assertEqual(self.search('teacher'), [])
+        self.assertEqual(len(self.search('student')), len(self.students))
+
+    def test_substring_fills_up_after_prefix_matches(self):
+        self.assertEqual([row['id'] for row in self.search('ille')], [self.zoe.pk])
+        # Too short to scan for
+        self.assertEqual(self.search('il'), [])
+        rows = self.search('stu', limit=2)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(self.client_for(self.teacher).get('/api/teacher/students/search/?limit=500').status_code, 400)
+
+    def test_terms_follow_renames_and_bulk_imports(self):
+        self.zoe.last_name = 'Garcia'
+        self.zoe.save()
+        self.assertEqual(self.search('brown'), [])
+        self.assertEqual(len(self.search('garc')), 1)
+        import_students([{'username': 'newkid', 'password': 'pw-123456', 'first_name': 'Nadia', 'last_name': 'Khan'}])
+        self.assertEqual([row['username'] for row in self.search('nad kh')], ['newkid'])
+
+    def test_query_count_does_not_grow_with_the_roster(self):
+        client = self.client_for(self.teacher)
+        with CaptureQueriesContext(connection) as before:
+            client.get('/api/teacher/students/search/', {'q': 'ille'})
+        grow_school(self, students=10, days=0)
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            client.get('/api/teacher/students/search/', {'q': 'ille'})
+        self.assertEqual(len(after), len(before))
+
+
+class BackgroundJobTests(SchoolTestCase):
+    url = '/api/teacher/jobs/'
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.teacher_client = self.client_for(self.teacher)
+
+    def submit(self, **params):
+        params = {'start': str(self.today), 'end': str(self.today + timedelta(days=6)), **params}
+        response = self.teacher_client.post(self.url, {'kind': 'report_cards', 'params': params}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def run_worker(self):
+        call_command('run_jobs', '--workers', '0', '--once', stdout=StringIO())
+
+    def test_report_cards_for_the_class(self):
+        job = self.submit()
+        self.assertEqual((job['status'], job['progress'], job['download']), ('queued', 0, None))
+        self.run_worker()
+        job = self.teacher_client.get(f"{self.url}{job['id']}/").data
+        self.assertEqual((job['status'], job['progress'], job['total']), ('done', 100, len(self.students)))
+
+        response = self.teacher_client.get(job['download'])
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(report['students']), len(self.students))
+        card = next(card for card in report['students'] if card['student_id'] == self.student.pk)
+        maths = next(lesson for lesson in card['lessons'] if lesson['lesson'] == 'Maths')
+        marks = list(Mark.objects.filter(student=self.student, schedule__lesson__name='Maths').values_list('mark', flat=True))
+        self.assertEqual(maths['count'], len(marks))
+        self.assertEqual(maths['average'], round(sum(marks) / len(marks), 2))
+
+    def test_csv_report_card_for_one_student(self):
+        job = self.submit(student=self.student.pk, format='csv')
+        self.assertEqual(job['params']['student'], self.student.pk)
+        self.run_worker()
+        job = Job.objects.get(pk=job['id'])
+        rows = list(csv.DictReader(StringIO(job.result.read().decode())))
+        self.assertEqual({row['student_id'] for row in rows}, {str(self.student.pk)})
+        self.assertEqual(len(rows), len(self.lessons))
+
+    def test_invalid_params_are_rejected(self):
+        response = self.teacher_client.post(
+            self.url, {'kind': 'report_cards', 'params': {'start': '2024-11-10', 'end': '2024-11-01'}}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('end', response.data['params'])
+        response = self.teacher_client.post(self.url, {'kind': 'reindex', 'params': {}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_cancelling(self):
+        queued = self.submit()
+        response = self.teacher_client.post(f"{self.url}{queued['id']}/cancel/")
+        self.assertEqual(response.data['status'], 'cancelled')
+        self.run_worker()
+        self.assertEqual(Job.objects.get(pk=queued['id']).status, 'cancelled')
+
+        running = self.submit()
+        self.assertEqual(claim_next_job().pk, running['id'])
+        self.teacher_client.post(f"{self.url}{running['id']}/cancel/")
+        self.assertEqual(run_job(running['id']), 'cancelled')
+        self.assertEqual(self.teacher_client.get(f"{self.url}{running['id']}/download/").status_code, 404)
+
+    def test_failures_and_abandoned_jobs(self):
+        job = self.submit(student=self.student.pk)
+        Job.objects.filter(pk=job['id']).update(params={'start': 'not a date'})
+        claim_next_job()
+        with self.assertLogs('api.jobs', 'ERROR'):
+            self.assertEqual(run_job(job['id']), 'failed')
+        self.assertIn('KeyError', Job.objects.get(pk=job['id']).error)
+
+        abandoned = self.submit()
+        claim_next_job()
+        Job.objects.filter(pk=abandoned['id']).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.run_worker()
+        self.assertEqual(Job.objects.get(pk=abandoned['id']).status, 'done')
+
+    def test_jobs_are_private_to_their_owner(self):
+        job = self.submit()
+        other = self.make_user('teacher2', 'teacher')
+        self.assertEqual(self.client_for(other).get(f"{self.url}{job['id']}/").status_code, 404)
+        self.assertEqual(self.client_for(other).get(self.url).data['results'], [])
+        self.assertEqual(self.client_for(self.student).get(self.url).status_code, 403)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=60, REPLICA_CHECK_INTERVAL=60)
+class ReplicaRoutingTests(SchoolTestCase):
+    url = '/api/teacher/holidays/'
+
+    @classmethod
+    def setUpClass(cls):
+        # A second SQLite database stands in for the read replica. It exists
+        # for this class only, so the test runner and other tests never see it.
+        replica = {**deepcopy(connections.settings['default']), 'NAME': ':memory:'}
+        cls.enterClassContext(mock.patch.dict(connections.settings, {'replica': replica}))
+        cls.addClassCleanup(cls.drop_replica)
+        connections['replica'].creation.create_test_db(verbosity=0, autoclobber=True)
+        cls.databases = {'default', 'replica'}
+        super().setUpClass()
+
+    @classmethod
+    def drop_replica(cls):
+        connections['replica'].creation.destroy_test_db(':memory:', verbosity=0)
+        del connections['replica']
+
+    def setUp(self):
+        super().setUp()
+        routing.reset_replica_health()
+        self.addCleanup(routing.reset_replica_health)
+        # The replica has the accounts, so authentication works there too
+        User.objects.using('replica').bulk_create(User.objects.using('default').all())
+        Profile.objects.using('replica').bulk_create(Profile.objects.using('default').all())
+        Holiday.objects.using('replica').create(date=self.today, name='Only on the replica')
+        self.teacher_api = self.client_for(self.teacher)
+
+    def holiday_names(self, client=None):
+        response = (client or self.teacher_api).get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [holiday['name'] for holiday in response.data]
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.holiday_names(), ['Only on the replica'])
+        # Outside the API everything stays on the primary
+        self.assertFalse(Holiday.objects.exists())
+
+    def test_writers_read_their_writes(self):
+        response = self.teacher_api.post(self.url, {'date': '2024-12-31', 'name': 'New year'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Holiday.objects.using('replica').filter(name='New year').exists())
+        self.assertEqual(self.holiday_names(), ['New year'])
+        # Other users are not held on the primary
+        other = self.client_for(self.make_user('teacher2', 'teacher'))
+        User.objects.using('replica').bulk_create(User.objects.filter(username='teacher2'))
+        Profile.objects.using('replica').bulk_create(Profile.objects.filter(user__username='teacher2'))
+        self.assertEqual(self.holiday_names(other), ['Only on the replica'])
+
+        cache.delete(routing.STICKY_KEY.format(self.teacher.pk))
+        self.assertEqual(self.holiday_names(), ['Only on the replica'])
+
+    def test_unusable_replicas_fall_back_to_the_primary(self):
+        Holiday.objects.create(date=self.today, name='On the primary')
+        with mock.patch.object(routing, 'replica_lag', side_effect=DatabaseError('down')), \
+                self.assertLogs('api.routing', 'WARNING'):
+            self.assertEqual(self.holiday_names(), ['On the primary'])
+        # The failed check is remembered for REPLICA_CHECK_INTERVAL
+        self.assertEqual(self.holiday_names(), ['On the primary'])
+
+        routing.reset_replica_health()
+        with mock.patch.object(routing, 'replica_lag', return_value=30.0), self.assertLogs('api.routing', 'WARNING'):
+            self.assertEqual(self.holiday_names(), ['On the primary'])
+        routing.reset_replica_health()
+        with mock.patch.object(routing, 'replica_lag', return_value=1.0):
+            self.assertEqual(self.holiday_names(), ['Only on the replica'])
+
+    def test_timetable_snapshots_are_built_on_the_primary(self):
+        # The replica has no schedules, reads routed to it would find none
+        token = routing._state.set(routing.RoutingState('replica'))
+        try:
+            slots = timetable_snapshots([self.today])[self.today]
+        finally:
+            routing._state.reset(token)
+        self.assertEqual(len(slots), Schedule.objects.filter(date=self.today).count())
+
+    def test_cached_student_responses_are_built_on_the_primary(self):
+        # The replica has no marks yet, as if it had not replayed them
+        response = self.client_for(self.student).get('/api/student/marks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), Mark.objects.filter(student=self.student).count())
+        self.assertTrue(response.data['results'])
+
+
+class StudentResponseCacheTests(SchoolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = self.students[1]
+
+    def get(self, user, url, **params):
+        response = self.client_for(user).get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def assertLookups(self, hits, misses):
+        stats = response_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (hits, misses))
+
+    def test_repeated_request_is_served_from_cache(self):
+        first = self.get(self.student, '/api/student/marks/', expand='schedule.lesson')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.get(self.student, '/api/student/marks/', expand='schedule.lesson')
+        # Authentication's user lookup only
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(second.content, first.content)
+        # Entries hold the rendered body only
+        self.assertIsNone(second.data)
+        self.assertEqual(second['Content-Type'], 'application/json')
+        self.assertIn('X-Sync-Cursor', second)
+        self.assertLookups(hits=1, misses=1)
+        self.assertIn('ediary_student_cache_hits_total{route="api/student/marks/",method="GET"}', registry.expose())
+
+    def test_mark_write_expires_only_its_student(self):
+        for user in (self.student, self.other):
+            self.get(user, '/api/student/marks/')
+            self.get(user, '/api/student/schedule/', date=self.today)
+        mark = Mark.objects.filter(student=self.student, schedule__date=self.today).first()
+        mark.mark = 12 if mark.mark != 12 else 1
+        mark.save()
+
+        self.get(self.other, '/api/student/marks/')
+        self.get(self.other, '/api/student/schedule/', date=self.today)
+        self.assertLookups(hits=2, misses=4)
+        marks = self.get(self.student, '/api/student/marks/').data['results']
+        self.assertIn(mark.mark, [row['mark'] for row in marks if row['id'] == mark.id])
+        schedule = self.get(self.student, '/api/student/schedule/', date=self.today).data
+        self.assertEqual([row['mark'] for row in schedule if row['id'] == mark.schedule_id], [mark.mark])
+        self.assertLookups(hits=2, misses=6)
+
+    def test_bulk_marks_expire_their_students(self):
+        self.get(self.student, '/api/student/marks/')
+        self.get(self.other, '/api/student/marks/')
+        schedule = Schedule.objects.filter(date=self.today).first()
+        payload = {'schedule_id': schedule.id, 'marks': [{'student_id': self.student.id, 'mark': 1}]}
+        response = self.client_for(self.teacher).post('/api/teacher/marks/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.get(self.other, '/api/student/marks/')
+        marks = self.get(self.student, '/api/student/marks/').data['results']
+        self.assertIn(1, [row['mark'] for row in marks if row['schedule'] == schedule.id])
+        self.assertLookups(hits=1, misses=3)
+
+    def test_schedule_change_expires_only_its_dates(self):
+        tomorrow = self.today + timedelta(days=1)
+        self.get(self.student, '/api/student/schedule/', date=self.today)
+        self.get(self.student, '/api/student/schedule/', date=tomorrow)
+        self.get(self.student, '/api/student/marks/', expand='schedule')
+        schedule = Schedule.objects.filter(date=tomorrow, period=self.periods[0]).get()
+        schedule.lesson = self.lessons[2]
+        schedule.save()
+
+        self.get(self.student, '/api/student/schedule/', date=self.today)
+        self.assertLookups(hits=1, misses=3)
+        rows = self.get(self.student, '/api/student/schedule/', date=tomorrow).data
+        self.assertEqual(rows[0]['lesson'], self.lessons[2].id)
+        # The slot's marks show its lesson when expanded
+        marks = self.get(self.student, '/api/student/marks/', expand='schedule').data['results']
+        lessons = {row['schedule']['lesson'] for row in marks if row['schedule']['id'] == schedule.id}
+        self.assertEqual(lessons, {self.lessons[2].id})
+        self.assertLookups(hits=1, misses=5)
+
+    def test_hometask_change_expires_listings_from_before_its_date(self):
+        today = date.today()
+        soon, later = today + timedelta(days=10), today + timedelta(days=100)
+        Schedule.objects.create(date=later, period=self.periods[0], lesson=self.lessons[0])
+        self.get(self.student, '/api/student/hometasks/', date=today)
+        self.get(self.other, '/api/student/hometasks/', date=later)
+        schedule = Schedule.objects.create(date=soon, period=self.periods[0], lesson=self.lessons[0])
+        HomeTask.objects.create(schedule=schedule, description='Read chapter 3')
+
+        self.get(self.student, '/api/student/hometasks/', date=later)
+        self.assertLookups(hits=1, misses=2)
+        rows = self.get(self.other, '/api/student/hometasks/', date=today).data['results']
+        self.assertIn('Read chapter 3', [row['description'] for row in rows])
+        self.assertLookups(hits=1, misses=3)
+
+    def test_change_feed_requests_bypass_the_cache(self):
+        cursor = self.get(self.student, '/api/student/marks/')['X-Sync-Cursor']
+        self.get(self.student, '/api/student/marks/', since=cursor)
+        self.get(self.student, '/api/student/marks/', since=cursor)
+        self.assertLookups(hits=0, misses=1)
+
+    def test_memory_is_bounded(self):
+        size = len(self.get(self.student, '/api/student/schedule/', date=self.today).content)
+        response_cache.clear()
+        with override_settings(STUDENT_CACHE_MAX_BYTES=size * 8):
+            # Unknown parameters still make separate entries
+            for n in range(12):
+                self.get(self.student, '/api/student/schedule/', date=self.today, n=n)
+            stats = response_cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']), (8, size * 8, 4))
+        # The oldest went first
+        self.get(self.student, '/api/student/schedule/', date=self.today, n=11)
+        self.get(self.student, '/api/student/schedule/', date=self.today, n=0)
+        self.assertEqual(response_cache.stats()['hits'], 1)
+
+
+class TimetableSnapshotTests(SchoolTestCase):
+    url = '/api/student/schedule/'
+
+    def count_queries(self, user, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(user).get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data
+
+    def snapshot(self, day):
+        key, = snapshot_keys([day])
+        return cache.get(key)
+
+    def test_shared_by_every_student(self):
+        first, _ = self.count_queries(self.student, week=self.today)
+        second, rows = self.count_queries(self.students[1], week=self.today, expand='lesson,period')
+        # The user and the student's marks; the slots were built by the first request
+        self.assertEqual((first, second), (3, 2))
+        # Asking for fields takes the serializer path
+        _, serialized = self.count_queries(
+            self.students[1], week=self.today, expand='lesson,period', fields='id,date,period,lesson,mark'
+        )
+        self.assertEqual(rows, serialized)
+        self.assertEqual(len(rows), 6)
+
+    def test_schedule_change_rebuilds_only_its_date(self):
+        tomorrow = self.today + timedelta(days=1)
+        timetable_snapshots([self.today, tomorrow])
+        today_slots = self.snapshot(self.today)
+        schedule = Schedule.objects.get(date=tomorrow, period=self.periods[0])
+        schedule.lesson = self.lessons[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule.save()
+        self.assertEqual(self.snapshot(tomorrow)[0]['lesson']['name'], self.lessons[2].name)
+        self.assertEqual(self.snapshot(self.today), today_slots)
+
+    def test_snapshots_follow_the_shared_date_version(self):
+        timetable_snapshots([self.today])
+        # As when another process changed the day: no refresh here, only the version moved on
+        Schedule.objects.filter(date=self.today, period=self.periods[0]).update(lesson=self.lessons[2])
+        invalidate_dates([self.today])
+        slots = timetable_snapshots([self.today])[self.today]
+        self.assertEqual(slots[0]['lesson']['name'], self.lessons[2].name)
+        key, = snapshot_keys([self.today])
+        self.assertIsNotNone(cache._expire_info[cache.make_key(key)])
+
+    def test_moved_schedule_leaves_its_old_date(self):
+        later = self.today + timedelta(days=7)
+        timetable_snapshots([self.today, later])
+        schedule = Schedule.objects.get(date=self.today, period=self.periods[0])
+        schedule.date = later
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule.save()
+        self.assertNotIn(schedule.id, [slot['id'] for slot in self.snapshot(self.today)])
+        self.assertEqual([slot['id'] for slot in self.snapshot(later)], [schedule.id])
+
+    def test_lesson_rename_rebuilds_the_dates_showing_it(self):
+        timetable_snapshots([self.today])
+        lesson = self.lessons[0]
+        lesson.name = 'Algebra'
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson.save()
+        self.assertIn('Algebra', [slot['lesson']['name'] for slot in self.snapshot(self.today)])
+        rows = self.client_for(self.student).get(self.url, {'date': self.today, 'expand': 'lesson'}).data
+        self.assertIn('Algebra', [row['lesson']['name'] for row in rows])
@@ -0,0 +1,199 @@
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .caching import DATE_TAG, bump_tags, invalidate_dates, tag_versions
+from .expansion import parse_paths
+from .models import Holiday, Mark, Schedule
+from .routing import primary_reads
+from .serializers import ScheduleSerializer
+
+SNAPSHOT_KEY = 'api:timetable:{}:{}'
+# Seconds a snapshot is kept, so one that a missed refresh left stale heals
+SNAPSHOT_TIMEOUT = 5 * 60
+SNAPSHOT_RELATIONS = ('lesson', 'period')
+# Plans apply_template() makes before giving up on a timetable that keeps changing
+APPLY_ATTEMPTS = 3
+
+
+def _days(start, end):
+    for offset in range((end - start).days + 1):
+        yield start + timedelta(days=offset)
+
+
+def build_snapshots(days):
+    """day -> the slots of ``days`` serialized with their lesson and period, read in one query."""
+    snapshots = {day: [] for day in days}
+    schedules = (
+        Schedule.objects.filter(date__in=snapshots)
+        .select_related(*SNAPSHOT_RELATIONS)
+        .order_by('date', 'period__number')
+    )
+    for row in ScheduleSerializer(schedules, many=True, expand=','.join(SNAPSHOT_RELATIONS)).data:
+        snapshots[date.fromisoformat(row['date'])].append(dict(row))
+    return snapshots
+
+
+def snapshot_keys(days):
+    """Cache key -> day for each of ``days``, under the date version invalidate_dates() bumps."""
+    days = list(days)
+    versions = tag_versions([DATE_TAG.format(day.isoformat()) for day in days])
+    return {SNAPSHOT_KEY.format(day.isoformat(), version): day for day, version in zip(days, versions)}
+
+
+def timetable_snapshots(days):
+    """day -> the shared timetable of each of ``days``, the same for every user.
+
+    Read from the cache in two round trips, the date versions and then the
+    snapshots under them. Days missing there are built with one query and
+    cached for everyone for SNAPSHOT_TIMEOUT.
+    """
+    keys = snapshot_keys(days)
+    snapshots = {keys[key]: slots for key, slots in cache.get_many(keys).items()}
+    missing = [day for day in keys.values() if day not in snapshots]
+    if missing:
+        # Cached for everyone, so never from a replica that is behind
+        with primary_reads():
+            built = build_snapshots(missing)
+        for key, day in keys.items():
+            if day in built:
+                # add() rather than set(): a refresh may have stored newer slots since they were read
+                cache.add(key, built[day], timeout=SNAPSHOT_TIMEOUT)
+        snapshots.update(built)
+    return snapshots
+
+
+def refresh_timetable(days):
+    """Rebuild the snapshots of ``days`` after a change to their schedules or to a lesson or period they show.
+
+    Their date versions are bumped now and again on commit, as for any
+    cached response, so no process sharing the cache reads the old
+    snapshots. The new ones are built once the transaction commits.
+    """
+    days = {date.fromisoformat(day) if isinstance(day, str) else day for day in days if day is not None}
+    if not days:
+        return
+    bump_tags(DATE_TAG.format(day.isoformat()) for day in days)
+
+    def rebuild():
+        built = build_snapshots(days)
+        cache.set_many({key: built[day] for key, day in snapshot_keys(days).items()}, timeout=SNAPSHOT_TIMEOUT)
+    # Registered after the bump's own callback, so it stores under the final versions
+    transaction.on_commit(rebuild)
+
+
+def student_timetable(student_id, start, end, expand=()):
+    """The timetable from ``start`` to ``end`` as StudentScheduleSerializer outputs it.
+
+    The shared snapshots carry the slots, a query for the student's marks
+    in the range overlays the ``mark`` of each. Relations not in ``expand``
+    are output as their id.
+    """
+    snapshots = timetable_snapshots(list(_days(start, end)))
+    marks = dict(
+        Mark.objects.filter(student_id=student_id, schedule__date__range=(start, end))
+        .values_list('schedule_id', 'mark')
+    )
+    rows = []
+    for day in _days(start, end):
+        for slot in snapshots[day]:
+            rows.append({
+                'id': slot['id'],
+                'date': slot['date'],
+                'period': slot['period'] if 'period' in expand else slot['period']['id'],
+                'lesson': slot['lesson'] if 'lesson' in expand else slot['lesson']['id'],
+                'mark': marks.get(slot['id']),
+            })
+    return rows
+
+
+class TimetableSnapshotMixin:
+    """Answer the student timetable's list requests from student_timetable().
+
+    The view provides ``get_date_range()``. Requests for sparse fields,
+    side-loading or expansions beyond the lesson and period take the
+    serializer path.
+    """
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        expand = parse_paths(params.get('expand')) or {}
+        if 'fields' in params or 'sideload' in params or set(expand) - set(SNAPSHOT_RELATIONS) or any(expand.values()):
+            return super().list(request, *args, **kwargs)
+        start, end = self.get_date_range()
+        return Response(student_timetable(request.user.pk, start, end, expand))
+
+
+class TimetableChanged(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The timetable kept changing while the template was applied, try again.'
+    default_code = 'timetable_changed'
+
+
+def _plan_template(slots, holidays, start, end):
+    existing = {
+        (day, period_id): lesson_id
+        for day, period_id, lesson_id in Schedule.objects.filter(date__range=(start, end))
+        .values_list('date', 'period_id', 'lesson_id')
+    }
+    planned, unchanged, conflicts = [], 0, []
+    for day in _days(start, end):
+        if day in holidays:
+            continue
+        for period_id, lesson_id in slots.get(day.weekday(), ()):
+            current = existing.get((day, period_id))
+            if current is None:
+                planned.append(Schedule(date=day, period_id=period_id, lesson_id=lesson_id))
+            elif current == lesson_id:
+                unchanged += 1
+            else:
+                conflicts.append({
+                    'date': day,
+                    'period_id': period_id,
+                    'lesson_id': lesson_id,
+                    'existing_lesson_id': current,
+                })
+    return planned, unchanged, conflicts
+
+
+def apply_template(template, start, end, dry_run=False):
+    """Expand a weekly TimetableTemplate into Schedule rows between two dates.
+
+    Holidays are skipped. Existing lessons for a date and period are read in
+    one query: a slot that already holds the template's lesson is left as is,
+    so re-running is a no-op, and a slot holding another lesson is reported
+    as a conflict and never overwritten. Everything else is written with one
+    bulk insert. When a concurrent run fills a slot in between, the insert
+    fails as a whole and the slots are read and planned again, so the counts
+    always describe what this run did.
+    """
+    slots = {}
+    for weekday, period_id, lesson_id in template.slots.values_list('weekday', 'period_id', 'lesson_id'):
+        slots.setdefault(weekday, []).append((period_id, lesson_id))
+    holidays = set(Holiday.objects.filter(date__range=(start, end)).values_list('date', flat=True))
+
+    for _ in range(APPLY_ATTEMPTS):
+        planned, unchanged, conflicts = _plan_template(slots, holidays, start, end)
+        if dry_run or not planned:
+            break
+        try:
+            with transaction.atomic():
+                Schedule.objects.bulk_create(planned, batch_size=500)
+                invalidate_dates({schedule.date for schedule in planned})
+                refresh_timetable({schedule.date for schedule in planned})
+            break
+        except IntegrityError:
+            continue
+    else:
+        raise TimetableChanged()
+    return {
+        'created': len(planned),
+        'unchanged': unchanged,
+        'conflicts': conflicts,
+        'holidays': sorted(holidays),
+        'dry_run': dry_run,
+    }
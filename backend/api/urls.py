@@ -8,6 +8,9 @@ router.register(r'teacher/lessons', LessonViewSet, basename='teacher-lessons')
 router.register(r'teacher/schedules', ScheduleViewSet, basename='teacher-schedule')
 router.register(r'teacher/periods', PeriodViewSet, basename='periods')
 router.register(r'teacher/marks', MarkViewSet, basename='mark')
+router.register(r'teacher/holidays', HolidayViewSet, basename='holidays')
+router.register(r'teacher/timetables', TimetableTemplateViewSet, basename='timetables')
+router.register(r'teacher/jobs', JobViewSet, basename='jobs')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -16,4 +19,10 @@ urlpatterns = [
     path('student/marks/', StudentMarkView.as_view(), name='student-marks'),
     path('student/hometasks/', StudentHomeTaskView.as_view(), name='student-hometasks'),
     path('teacher/students/<int:student_id>/marks/', StudentMarksView.as_view(), name='student-marks'),
+    path('teacher/gradebook/', GradebookView.as_view(), name='teacher-gradebook'),
+    path('student/gradebook/', StudentGradebookView.as_view(), name='student-gradebook'),
+    path('student/dashboard/', StudentDashboardView.as_view(), name='student-dashboard'),
+    path('teacher/export/<str:dataset>.<str:extension>', ExportView.as_view(), name='teacher-export'),
+    path('student/events/', student_events, name='student-events'),
+    path('student/events/ticket/', StudentEventTicketView.as_view(), name='student-events-ticket'),
 ]
\ No newline at end of file
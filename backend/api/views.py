@@ -1,102 +1,442 @@
 # diary_app/views.py
 
-from rest_framework import viewsets, permissions, generics
-from rest_framework.exceptions import PermissionDenied
-from .models import Period, Lesson, Schedule, Mark, HomeTask
+from datetime import date as dt_date, timedelta
+
+from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from rest_framework import viewsets, permissions, generics, mixins
+from rest_framework.decorators import action
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from .models import Period, Lesson, Schedule, Mark, HomeTask, Tombstone, Holiday, TimetableTemplate, Job, Profile
 from .serializers import *
 from .permissions import IsTeacher
+from .authentication import user_from_raw_token
+from .caching import (
+    DATE_TAG, MARKED_SLOTS_TAG, STUDENT_TAG, StudentCacheMixin, VersionedCacheMixin, from_month_tag, model_tag,
+)
+from .exports import EXPORTS, FORMATS, export_response
+from .events import (
+    BROADCAST_CHANNEL, STREAM_HEARTBEAT, STREAM_TICKET_SECONDS, format_sse, get_broker, issue_stream_ticket,
+    redeem_stream_ticket, student_channel,
+)
+from .expansion import ExpandableViewMixin
+from .fastpath import FastJSONRenderer, FastListMixin
+from .instrumentation import SerializerTimingMixin
+from .dashboard import build_student_dashboard, schedule_with_marks
+from .feeds import ChangeFeedMixin
+from .gradebook import build_gradebook
+from .jobs import cancel_job
+from .onboarding import import_students, parse_roster
+from .search import MAX_SEARCH_LIMIT, SEARCH_LIMIT, search_students
+from .timetable import TimetableSnapshotMixin, apply_template
+from .pagination import MarkPagination, SchedulePagination, StudentPagination, HomeTaskPagination, JobPagination
 from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+
+def parse_date_param(params, name):
+    value = params.get(name)
+    try:
+        parsed = parse_date(value) if value else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Enter a valid date in YYYY-MM-DD format.'})
+    return parsed
+
+
+def filter_date_range(queryset, params, field):
+    """Apply optional ``start``/``end`` query parameters to a date field."""
+    if params.get('start'):
+        queryset = queryset.filter(**{f'{field}__gte': parse_date_param(params, 'start')})
+    if params.get('end'):
+        queryset = queryset.filter(**{f'{field}__lte': parse_date_param(params, 'end')})
+    return queryset
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
-class ScheduleViewSet(viewsets.ModelViewSet):
+class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = CustomTokenRefreshSerializer
+
+class ScheduleViewSet(SerializerTimingMixin, ChangeFeedMixin, ExpandableViewMixin, viewsets.ModelViewSet):
     queryset = Schedule.objects.all()
     serializer_class = ScheduleSerializer
     permission_classes = [IsTeacher]
+    pagination_class = SchedulePagination
+    feed_model = Schedule
+
+class HolidayViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = Holiday.objects.order_by('date')
+    serializer_class = HolidaySerializer
+    permission_classes = [permissions.IsAuthenticated, IsTeacher]
 
-class StudentListView(generics.ListAPIView):
-    queryset = User.objects.filter(profile__role='student')
+class TimetableTemplateViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = TimetableTemplate.objects.prefetch_related('slots')
+    serializer_class = TimetableTemplateSerializer
+    permission_classes = [permissions.IsAuthenticated, IsTeacher]
+
+    def get_queryset(self):
+        # apply reads the slots itself as plain tuples
+        if self.action == 'apply':
+            return TimetableTemplate.objects.all()
+        return super().get_queryset()
+
+    @action(detail=True, methods=['post'], url_path='apply')
+    def apply(self, request, pk=None):
+        """Fill ``start``..``end`` with the template's lessons; ``dry_run`` only reports."""
+        serializer = ApplyTemplateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(apply_template(self.get_object(), **serializer.validated_data))
+
+class StudentListView(SerializerTimingMixin, VersionedCacheMixin, generics.ListAPIView):
+    queryset = User.objects.filter(profile__role='student').select_related('profile')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_models = (User, Profile)
+    pagination_class = StudentPagination
 
-class LessonListView(generics.ListAPIView):
+class LessonListView(SerializerTimingMixin, VersionedCacheMixin, generics.ListAPIView):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [IsTeacher]
+    cache_models = (Lesson,)
 
-class PeriodListView(generics.ListAPIView):
+class PeriodListView(SerializerTimingMixin, VersionedCacheMixin, generics.ListAPIView):
     queryset = Period.objects.all()
     serializer_class = PeriodSerializer
     permission_classes = [IsTeacher]
+    cache_models = (Period,)
 
-class PeriodViewSet(viewsets.ReadOnlyModelViewSet):
+class PeriodViewSet(SerializerTimingMixin, VersionedCacheMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Period.objects.all()
     serializer_class = PeriodSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_models = (Period,)
 
-class StudentViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.filter(profile__role='student')
+class StudentViewSet(SerializerTimingMixin, VersionedCacheMixin, viewsets.ModelViewSet):
+    queryset = User.objects.filter(profile__role='student').select_related('profile')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    cache_models = (User, Profile)
+    pagination_class = StudentPagination
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """Enrol a CSV (multipart ``file``) or JSON roster of students in one request."""
+        upload = request.FILES.get('file')
+        try:
+            if upload is not None:
+                roster_format = 'json' if upload.name.lower().endswith('.json') else 'csv'
+                rows = parse_roster(upload.read(), roster_format)
+            elif isinstance(request.data, list):
+                rows = request.data
+            else:
+                rows = request.data.get('students', [])
+        except ValueError as exc:
+            raise ValidationError({'file': f'Could not read roster: {exc}'})
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError({'students': 'Provide a non-empty list of students.'})
+        return Response(import_students(rows))
 
-class LessonViewSet(viewsets.ModelViewSet):
+    @action(detail=False, url_path='search')
+    def search(self, request):
+        """Up to ``limit`` students matching ``?q=``, as id, username and display name for pickers."""
+        limit = request.query_params.get('limit', str(SEARCH_LIMIT))
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_SEARCH_LIMIT:
+            raise ValidationError({'limit': f'Enter a number from 1 to {MAX_SEARCH_LIMIT}.'})
+        return self.versioned_response(
+            lambda request: Response(search_students(request.query_params.get('q', ''), int(limit))), request
+        )
+
+class LessonViewSet(SerializerTimingMixin, VersionedCacheMixin, viewsets.ModelViewSet):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    cache_models = (Lesson,)
 
-class MarkViewSet(viewsets.ModelViewSet):
+class MarkViewSet(SerializerTimingMixin, ChangeFeedMixin, ExpandableViewMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Mark.objects.all()
     serializer_class = MarkSerializer
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    pagination_class = MarkPagination
+    feed_model = Mark
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Create or regrade all marks for a lesson slot in one request."""
+        serializer = BulkMarkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'results': serializer.save()})
 
-class HomeTaskViewSet(viewsets.ModelViewSet):
+class HomeTaskViewSet(SerializerTimingMixin, ChangeFeedMixin, ExpandableViewMixin, viewsets.ModelViewSet):
     queryset = HomeTask.objects.all()
     serializer_class = HomeTaskSerializer
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    pagination_class = HomeTaskPagination
+    feed_model = HomeTask
     
-class StudentMarksView(generics.ListAPIView):
+class StudentMarksView(SerializerTimingMixin, ChangeFeedMixin, ExpandableViewMixin, generics.ListAPIView):
     serializer_class = MarkSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    pagination_class = MarkPagination
+    feed_model = Mark
     filter_backends = [DjangoFilterBackend, OrderingFilter]
-    filterset_fields = ['schedule__date', 'lesson__name']
-    ordering_fields = ['schedule__date', 'lesson__name', 'mark']
+    filterset_fields = ['schedule__date', 'schedule__lesson__name']
+    ordering_fields = ['schedule__date', 'schedule__lesson__name', 'mark']
     ordering = ['schedule__date']
 
+    def get_feed_tombstones(self, since):
+        return super().get_feed_tombstones(since).filter(student_id=self.kwargs['student_id'])
+
     def get_queryset(self):
-        return Mark.objects.filter(student=self.request.user).select_related('lesson', 'schedule__period').order_by('schedule__date', 'lesson__name')
+        return (
+            Mark.objects.filter(student_id=self.kwargs['student_id'])
+            .order_by('schedule__date', 'schedule__lesson__name')
+        )
     
-class StudentScheduleView(generics.ListAPIView):
+class StudentScheduleView(
+    SerializerTimingMixin, StudentCacheMixin, ChangeFeedMixin, TimetableSnapshotMixin, ExpandableViewMixin,
+    generics.ListAPIView,
+):
+    """Full timetable for one day, a week or a date range, with the student's mark on each slot.
+
+    Accepts ``?date=YYYY-MM-DD`` (default today), ``?week=YYYY-MM-DD`` for the
+    Monday-Sunday week containing that date, or ``?start=...&end=...``. The
+    slots come from the timetable snapshots shared by every student.
+    """
     serializer_class = StudentScheduleSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['date']
+    feed_model = Schedule
+    max_range_days = 62
+
+    def get_date_range(self):
+        params = self.request.query_params
+        if 'start' in params or 'end' in params:
+            start = parse_date_param(params, 'start')
+            end = parse_date_param(params, 'end')
+            if start > end:
+                raise ValidationError({'end': 'End date must not be before start date.'})
+            if (end - start).days >= self.max_range_days:
+                raise ValidationError({'end': f'Date range is limited to {self.max_range_days} days.'})
+            return start, end
+        if 'week' in params:
+            day = parse_date_param(params, 'week')
+            monday = day - timedelta(days=day.weekday())
+            return monday, monday + timedelta(days=6)
+        # If no date is provided, default to today
+        day = parse_date_param(params, 'date') if params.get('date') else dt_date.today()
+        return day, day
+
+    def get_feed_changes(self, queryset, since):
+        # A slot also changes for the student when their mark on it is written or deleted
+        user_id = self.request.user.pk
+        removed_marks = Tombstone.objects.filter(
+            model='api.mark', student_id=user_id, deleted_at__gt=since
+        ).values('schedule_id')
+        return queryset.filter(
+            Q(updated_at__gt=since)
+            | Q(id__in=Mark.objects.filter(student_id=user_id, updated_at__gt=since).values('schedule_id'))
+            | Q(id__in=removed_marks)
+        )
+
+    def get_cache_tags(self):
+        start, end = self.get_date_range()
+        days = (start + timedelta(days=offset) for offset in range((end - start).days + 1))
+        return [
+            STUDENT_TAG.format(self.request.user.pk),
+            model_tag(Lesson),
+            model_tag(Period),
+            *(DATE_TAG.format(day.isoformat()) for day in days),
+        ]
 
     def get_queryset(self):
-        user = self.request.user
-        date = self.request.query_params.get('date', None)
-        if date:
-            return Schedule.objects.filter(mark__student=user, date=date).distinct().order_by('period__number')
-        else:
-            # If no date is provided, default to today
-            from datetime import date as dt_date
-            return Schedule.objects.filter(mark__student=user, date=dt_date.today()).distinct().order_by('period__number')
-
-class StudentMarkView(generics.ListAPIView):
+        start, end = self.get_date_range()
+        return schedule_with_marks(self.request.user.pk, start, end)
+
+class StudentMarkView(
+    SerializerTimingMixin, StudentCacheMixin, ChangeFeedMixin, ExpandableViewMixin, FastListMixin, generics.ListAPIView
+):
     serializer_class = MarkSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MarkPagination
+    feed_model = Mark
+
+    def get_feed_tombstones(self, since):
+        return super().get_feed_tombstones(since).filter(student_id=self.request.user.pk)
+
+    def get_cache_tags(self):
+        user_id = self.request.user.pk
+        tags = [STUDENT_TAG.format(user_id), MARKED_SLOTS_TAG.format(user_id), model_tag(Lesson), model_tag(Period)]
+        if 'student' in self.request.query_params.get('expand', ''):
+            tags += [model_tag(User), model_tag(Profile)]
+        return tags
 
     def get_queryset(self):
-        return Mark.objects.filter(student=self.request.user)
+        return Mark.objects.filter(student_id=self.request.user.pk)
 
-class StudentHomeTaskView(generics.ListAPIView):
+class StudentHomeTaskView(
+    SerializerTimingMixin, StudentCacheMixin, ChangeFeedMixin, ExpandableViewMixin, FastListMixin, generics.ListAPIView
+):
     serializer_class = HomeTaskSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = HomeTaskPagination
+    feed_model = HomeTask
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['schedule__date']
+    # The same for every student
+    cache_per_user = False
+
+    def get_start_date(self):
+        params = self.request.query_params
+        return parse_date_param(params, 'date') if params.get('date') else dt_date.today()
+
+    def get_cache_tags(self):
+        tag = from_month_tag(self.get_start_date())
+        if tag is None:
+            return None
+        return [tag, model_tag(Lesson), model_tag(Period)]
 
     def get_queryset(self):
-        return HomeTask.objects.filter(schedule__date__gte=self.request.query_params.get('date', None))
+        return HomeTask.objects.filter(schedule__date__gte=self.get_start_date())
+
+class StudentDashboardView(generics.GenericAPIView):
+    """Today's timetable with marks, recent marks and upcoming hometasks in one response.
+
+    Takes ``?date=YYYY-MM-DD`` (default today); the parts are queried concurrently.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        day = parse_date_param(request.query_params, 'date') if request.query_params.get('date') else dt_date.today()
+        return Response(build_student_dashboard(request, day))
+
+class GradebookView(generics.GenericAPIView):
+    """Lesson x date mark matrix for one student (``?student=``) or the whole class."""
+    permission_classes = [permissions.IsAuthenticated, IsTeacher]
+
+    def get(self, request):
+        marks = filter_date_range(Mark.objects.all(), request.query_params, 'schedule__date')
+        student = request.query_params.get('student')
+        if student:
+            if not student.isdigit():
+                raise ValidationError({'student': 'A valid integer is required.'})
+            marks = marks.filter(student_id=student)
+        return Response(build_gradebook(marks, per_student=not student))
+
+class StudentGradebookView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        marks = filter_date_range(Mark.objects.filter(student_id=request.user.pk), request.query_params, 'schedule__date')
+        return Response(build_gradebook(marks))
+
+class JobViewSet(
+    SerializerTimingMixin, mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """Submit background jobs, poll their progress, cancel them and download their results.
+
+    Jobs are run by the ``run_jobs`` worker; a teacher sees the jobs they submitted.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    pagination_class = JobPagination
+
+    def get_queryset(self):
+        return Job.objects.filter(owner_id=self.request.user.pk)
+
+    def perform_create(self, serializer):
+        serializer.save(owner_id=self.request.user.pk)
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        job = self.get_object()
+        cancel_job(job)
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data)
+
+    @action(detail=True)
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != Job.DONE or not job.result:
+            raise NotFound('The job has no result yet.')
+        return FileResponse(job.result.open('rb'), as_attachment=True, filename=job.result.name.rsplit('/', 1)[-1])
+
+class ExportView(generics.GenericAPIView):
+    """Download marks, schedules or hometasks as CSV, NDJSON or XLSX, optionally within ``start``/``end``."""
+    permission_classes = [permissions.IsAuthenticated, IsTeacher]
+
+    def get(self, request, dataset, extension):
+        if dataset not in EXPORTS or extension not in FORMATS:
+            raise NotFound()
+        spec = EXPORTS[dataset]
+        queryset = filter_date_range(spec['queryset'](), request.query_params, spec['date_field'])
+        asynchronous = isinstance(request._request, ASGIRequest)
+        return export_response(dataset, queryset, extension, asynchronous=asynchronous)
+
+STREAM_NEEDS_ASGI = 'The event stream needs an ASGI server, see backend/asgi.py.'
+
+
+class StudentEventTicketView(generics.GenericAPIView):
+    """Issue a single use ticket for opening /api/student/events/ with ``?ticket=``.
+
+    Answers 501 when served over WSGI, where the stream cannot work, so
+    clients know to poll instead.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if not isinstance(request._request, ASGIRequest):
+            return Response({'detail': STREAM_NEEDS_ASGI}, status=501)
+        return Response({'ticket': issue_stream_ticket(request.user.pk), 'expires_in': STREAM_TICKET_SECONDS})
+
+
+async def student_events(request):
+    """Server-Sent Events stream of the student's marks and the school's hometasks.
+
+    Takes the access token from the Authorization header or, since browsers'
+    EventSource cannot set headers, a ticket from StudentEventTicketView in
+    the ``ticket`` query parameter. Requires backend.asgi: under WSGI Django
+    would collect the endless stream into a list before sending anything.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': STREAM_NEEDS_ASGI}, status=501)
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        user = user_from_raw_token(header[7:])
+        user_id = user.pk if user is not None else None
+    else:
+        ticket = request.GET.get('ticket')
+        user_id = await redeem_stream_ticket(ticket) if ticket else None
+    if user_id is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=401)
+
+    async def stream():
+        subscription = get_broker().subscribe(
+            [student_channel(user_id), BROADCAST_CHANNEL], heartbeat=STREAM_HEARTBEAT
+        )
+        try:
+            yield 'retry: 3000\n\n'
+            event_id = 0
+            async for event in subscription:
+                if event is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                event_id += 1
+                yield format_sse(event, event_id)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,34 @@
+"""Entry points of the ``run_jobs`` and password hashing process pools.
+
+Spawned processes import this module before Django is set up, so it must
+not import models at module level.
+"""
+import os
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+
+def run(job_id):
+    from django.db import connections
+    from .jobs import run_job
+
+    try:
+        return run_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def hash_password(password, hasher):
+    """make_password() with the parent's hasher, given by dotted path.
+
+    Spawned processes load settings afresh and would miss any hasher
+    configured at runtime, such as a test override.
+    """
+    from django.utils.module_loading import import_string
+
+    hasher = import_string(hasher)()
+    return hasher.encode(password, hasher.salt())
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.RequestMetricsMiddleware',
+    'api.routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -79,13 +82,148 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# Configured from the environment: DB_ENGINE=postgresql with DB_NAME, DB_USER,
+# DB_PASSWORD, DB_HOST and DB_PORT, or the default SQLite file tuned for many
+# concurrent readers. DB_CONN_MAX_AGE keeps connections open between requests.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'ediary'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', '').lower() in ('1', 'true', 'yes')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Seconds to wait for a lock before raising "database is locked"
+                'timeout': 20,
+                # Take the write lock up front instead of failing to upgrade a read lock
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    # WAL lets readers run alongside a writer; NORMAL sync is safe in WAL mode.
+                    # It is written into the database file, so only on request: the
+                    # repository's db.sqlite3 would otherwise change on the first connection.
+                    ('PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;' if SQLITE_WAL else '')
+                    + 'PRAGMA cache_size=-20000;'
+                    'PRAGMA busy_timeout=20000;'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            },
+        }
+    }
+
+# Read replicas
+# DB_REPLICAS lists replica hosts (PostgreSQL) or database files (SQLite),
+# comma separated, added as replica1, replica2, ... Safe API requests read
+# from a replica that answers and lags at most REPLICA_MAX_LAG seconds,
+# checked every REPLICA_CHECK_INTERVAL seconds. A user who writes reads from
+# the primary for REPLICA_STICKY_SECONDS. See api/routing.py.
+
+DATABASE_REPLICAS = []
+for number, location in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST' if DB_ENGINE == 'postgresql' else 'NAME': location.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.routing.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 10))
+
+
+# Cache
+# Reference data (lessons, periods, the student roster) is cached per model
+# version, see api/caching.py. The student marks, schedule and hometask
+# responses are kept in each process, up to STUDENT_CACHE_MAX_BYTES, keyed
+# by per-student and per-date versions held in this cache. By default the
+# cache, versions included, is per process: a write only expires what the
+# process that handled it cached, and other workers serve stale data. Set
+# CACHE_DIR to share the cache between worker processes through the file
+# system whenever more than one runs.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'e-diary',
+        # Evicted versions read as changed, keep room for one per student and date
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
+if os.environ.get('CACHE_DIR'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['CACHE_DIR'],
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
+STUDENT_CACHE_MAX_BYTES = int(os.environ.get('STUDENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+
+# Real-time events
+# Fan-out layer for the /api/student/events/ stream, see api/events.py. The
+# in-process broker only reaches clients connected to the same process.
+# Stream tickets are kept in the default cache: with more than one worker
+# it must be shared (CACHE_DIR), or a stream opened on another worker than
+# the one that issued its ticket is refused with 401.
+
+EVENT_BROKER = 'api.events.InProcessBroker'
+
+
+# Request metrics
+# api.instrumentation times SQL, views and rendering for a share of
+# requests, adds Server-Timing headers and serves per route histograms at
+# /metrics (Bearer METRICS_TOKEN when set, staff users only otherwise).
+# Each process keeps its own.
+
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+METRICS_SLOW_QUERY_MS = float(os.environ.get('METRICS_SLOW_QUERY_MS', 200))
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+# Student dashboard
+# /api/student/dashboard/ queries its parts on a thread pool of this many
+# workers, each holding its own database connection. 1 runs them in turn.
+
+DASHBOARD_WORKERS = int(os.environ.get('DASHBOARD_WORKERS', 3))
+
+
+# Background jobs
+# Queued in the database and run by `manage.py run_jobs`, see api/jobs.py.
+# Results are written to MEDIA_ROOT; a running job that has not reported
+# progress for JOB_STALE_AFTER seconds is queued again on worker start.
+
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR / 'media')
+MEDIA_URL = 'media/'
+JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 15 * 60))
+
+
+# Admin
+# Changelists of marks, schedules and hometasks count at most this many
+# rows, see api.admin.EstimatedCountPaginator.
+
+ADMIN_COUNT_LIMIT = int(os.environ.get('ADMIN_COUNT_LIMIT', 10000))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -132,4 +270,20 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
-}   
+}
+
+# Serve the busiest read-only lists from values() rows rendered with orjson,
+# see api/fastpath.py. Responses are identical to the serializer path.
+FAST_READ_PATH = os.environ.get('FAST_READ_PATH', 'true').lower() in ('1', 'true', 'yes')
+
+# Authorize from the token's id and role claims without loading the User or
+# Profile on each request. Revoked tokens are kept in a deny-list in the
+# default cache, which must be shared by every worker process (set CACHE_DIR
+# or use a shared backend), or a demotion only reaches the process that
+# handled it. The api.E001 system check refuses a per-process cache.
+JWT_STATELESS_AUTH = os.environ.get('JWT_STATELESS_AUTH', '').lower() in ('1', 'true', 'yes')
+
+if JWT_STATELESS_AUTH:
+    REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] = (
+        'api.authentication.ClaimsJWTAuthentication',
+    )   
@@ -22,12 +22,14 @@ import {
     InputLabel,
     Snackbar,
     Alert,
+    Autocomplete,
 } from '@mui/material';
-import api from '../services/api';
+import api, { fetchAll } from '../services/api';
 
 function ManageMarks() {
-    // State to manage students, marks, schedules, and dialog visibility
-    const [students, setStudents] = useState([]);
+    // State to manage student search, marks, schedules, and dialog visibility
+    const [studentOptions, setStudentOptions] = useState([]);
+    const [studentQuery, setStudentQuery] = useState('');
     const [marks, setMarks] = useState([]);
     const [schedules, setSchedules] = useState([]);
     const [open, setOpen] = useState(false);
@@ -53,29 +55,37 @@ function ManageMarks() {
         severity: 'success', // 'success' | 'error' | 'warning' | 'info'
     });
 
-    // Fetch students, marks, and schedules on component mount
+    // Fetch marks and schedules on component mount
     useEffect(() => {
-        fetchStudents();
         fetchMarks();
         fetchSchedules();
     }, []);
 
-    // Function to fetch students
-    const fetchStudents = async () => {
-        try {
-            const response = await api.get('/teacher/students/'); // Ensure this endpoint exists
-            setStudents(response.data);
-        } catch (error) {
-            console.error('Error fetching students:', error);
-            showSnackbar('Failed to fetch students.', 'error');
+    // Search students as the teacher types instead of loading the whole roster
+    useEffect(() => {
+        if (!studentQuery.trim()) {
+            setStudentOptions([]);
+            return undefined;
         }
-    };
+        const timer = setTimeout(async () => {
+            try {
+                const response = await api.get('/teacher/students/search/', {
+                    params: { q: studentQuery },
+                });
+                setStudentOptions(response.data);
+            } catch (error) {
+                console.error('Error searching students:', error);
+                showSnackbar('Failed to search students.', 'error');
+            }
+        }, 250);
+        return () => clearTimeout(timer);
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, [studentQuery]);
 
     // Function to fetch marks
     const fetchMarks = async () => {
         try {
-            const response = await api.get('/teacher/marks/');
-            setMarks(response.data);
+            setMarks(await fetchAll('/teacher/marks/', { params: { expand: 'student,schedule.lesson' } }));
         } catch (error) {
             console.error('Error fetching marks:', error);
             showSnackbar('Failed to fetch marks.', 'error');
@@ -85,8 +95,7 @@ function ManageMarks() {
     // Function to fetch schedules
     const fetchSchedules = async () => {
         try {
-            const response = await api.get('/teacher/schedules/');
-            setSchedules(response.data);
+            setSchedules(await fetchAll('/teacher/schedules/', { params: { expand: 'lesson,period' } }));
         } catch (error) {
             console.error('Error fetching schedules:', error);
             showSnackbar('Failed to fetch schedules.', 'error');
@@ -106,6 +115,7 @@ function ManageMarks() {
             schedule: false,
             mark: false,
         });
+        setStudentQuery('');
         setOpen(true);
     };
 
@@ -304,25 +314,25 @@ function ManageMarks() {
                 <DialogTitle>Assign Mark</DialogTitle>
                 <DialogContent>
                     <form onSubmit={handleSubmit}>
-                        {/* Select Student */}
+                        {/* Search Student */}
                         <FormControl fullWidth margin="normal" required error={errors.student}>
-                            <InputLabel id="student-label">Select Student</InputLabel>
-                            <Select
-                                labelId="student-label"
-                                name="student"
-                                value={formData.student}
-                                label="Select Student"
-                                onChange={handleInputChange}
-                            >
-                                <MenuItem value="">
-                                    <em>None</em>
-                                </MenuItem>
-                                {students.map((student) => (
-                                    <MenuItem key={student.id} value={student.id}>
-                                        {student.username} ({student.first_name} {student.last_name})
-                                    </MenuItem>
-                                ))}
-                            </Select>
+                            <Autocomplete
+                                options={studentOptions}
+                                // The server already filtered the options
+                                filterOptions={(options) => options}
+                                getOptionLabel={(option) => `${option.name} (${option.username})`}
+                                isOptionEqualToValue={(option, value) => option.id === value.id}
+                                onInputChange={(event, value) => setStudentQuery(value)}
+                                onChange={(event, value) =>
+                                    handleInputChange({
+                                        target: { name: 'student', value: value ? value.id : '' },
+                                    })
+                                }
+                                noOptionsText={studentQuery ? 'No students found' : 'Type a name'}
+                                renderInput={(params) => (
+                                    <TextField {...params} label="Search Student" error={errors.student} />
+                                )}
+                            />
                             {errors.student && (
                                 <Typography variant="caption" color="error">
                                     Please select a student.
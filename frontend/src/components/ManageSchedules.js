@@ -19,7 +19,7 @@ import {
   Select,
   MenuItem,
 } from '@mui/material';
-import api from '../services/api';
+import api, { fetchAll } from '../services/api';
 
 function ManageSchedules() {
     const [schedules, setSchedules] = useState([]);
@@ -41,8 +41,7 @@ function ManageSchedules() {
 
     const fetchSchedules = async () => {
         try {
-        const response = await api.get('/teacher/schedules/');
-        setSchedules(response.data);
+        setSchedules(await fetchAll('/teacher/schedules/', { params: { expand: 'lesson,period' } }));
         } catch (error) {
         console.error(error);
         }
@@ -18,7 +18,7 @@ import {
   DialogActions,
   TextField,
 } from '@mui/material';
-import api from '../services/api';
+import api, { fetchAll } from '../services/api';
 
 function ManageStudents() {
   const [students, setStudents] = useState([]);
@@ -44,8 +44,7 @@ function ManageStudents() {
 
   const fetchStudents = async () => {
     try {
-      const response = await api.get('/teacher/students/');
-      setStudents(response.data);
+      setStudents(await fetchAll('/teacher/students/'));
     } catch (error) {
       console.error(error);
     }
@@ -23,6 +23,7 @@ import {
 import AuthService from '../services/authService';
 import StudentSchedule from './StudentSchedule';
 import StudentMarksTable from './StudentMarksTable';
+import StudentOverview from './StudentOverview';
 // ... import other student-related components if any ...
 
 function StudentDashboard() {
@@ -87,14 +88,7 @@ function StudentDashboard() {
         {/* Routes */}
         <Routes>
           {/* Default Route */}
-          <Route
-            path="/"
-            element={
-              <Typography paragraph>
-                Welcome to your dashboard! Use the menu to view your schedule.
-              </Typography>
-            }
-          />
+          <Route path="/" element={<StudentOverview />} />
           {/* My Schedule */}
           <Route path="schedule" element={<StudentSchedule />} />
           {/* Catch-All Route */}
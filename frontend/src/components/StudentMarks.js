@@ -12,7 +12,7 @@ import {
   TableRow,
   Paper,
 } from '@mui/material';
-import api from '../services/api';
+import { fetchAll } from '../services/api';
 
 function StudentMarks() {
     const { studentId } = useParams();
@@ -24,8 +24,9 @@ function StudentMarks() {
 
     const fetchStudentMarks = async () => {
         try {
-        const response = await api.get(`/teacher/students/${studentId}/marks/`);
-        setMarks(response.data);
+        setMarks(await fetchAll(`/teacher/students/${studentId}/marks/`, {
+            params: { expand: 'schedule.lesson' },
+        }));
         } catch (error) {
         console.error(error);
         }
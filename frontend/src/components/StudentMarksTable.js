@@ -15,14 +15,20 @@ import {
   Snackbar,
   Alert,
 } from '@mui/material';
-import api from '../services/api';
+import api, { API_URL } from '../services/api';
 import { format, parseISO } from 'date-fns';
 
+const RECONNECT_DELAY = 3000;
+const POLL_INTERVAL = 60000;
+
 function StudentMarksTable() {
-  const [marks, setMarks] = useState([]);
+  const [gradebook, setGradebook] = useState({
+    lessons: [],
+    dates: [],
+    cells: [],
+    averages: [],
+  });
   const [loading, setLoading] = useState(true);
-  const [dates, setDates] = useState([]);
-  const [lessons, setLessons] = useState([]);
   const [snackbar, setSnackbar] = useState({
     open: false,
     message: '',
@@ -31,28 +37,65 @@ function StudentMarksTable() {
 
   useEffect(() => {
     fetchMarks();
+
+    // Reload when the server pushes a new or changed mark instead of polling.
+    // Each connection needs a fresh single-use ticket, so the access token
+    // never lands in a URL and reconnects survive token refreshes.
+    let closed = false;
+    let events = null;
+    let retry = null;
+    let poll = null;
+
+    const connect = async () => {
+      try {
+        const response = await api.post('/student/events/ticket/');
+        if (closed) return;
+        events = new EventSource(
+          `${API_URL}/student/events/?ticket=${encodeURIComponent(
+            response.data.ticket
+          )}`
+        );
+        events.addEventListener('mark', () => fetchMarks());
+        events.onerror = () => {
+          // The browser would retry with the spent ticket, reopen instead
+          events.close();
+          scheduleReconnect();
+        };
+      } catch (error) {
+        if (closed) return;
+        if (error.response && error.response.status === 501) {
+          // The server runs without ASGI and cannot stream, fall back to polling
+          poll = setInterval(fetchMarks, POLL_INTERVAL);
+        } else {
+          scheduleReconnect();
+        }
+      }
+    };
+
+    const scheduleReconnect = () => {
+      if (closed) return;
+      retry = setTimeout(() => {
+        // Catch up on marks missed while disconnected
+        fetchMarks();
+        connect();
+      }, RECONNECT_DELAY);
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      if (events) events.close();
+      clearTimeout(retry);
+      clearInterval(poll);
+    };
   }, []);
 
   const fetchMarks = async () => {
     setLoading(true);
     try {
-      const response = await api.get('/student/marks/');
-      const data = response.data;
-      console.log('Fetched Marks:', data); // For debugging
-
-      setMarks(data);
-
-      // Extract unique dates
-      const uniqueDates = Array.from(
-        new Set(data.map((mark) => mark.schedule.date))
-      ).sort((a, b) => new Date(a) - new Date(b));
-      setDates(uniqueDates);
-
-      // Extract unique lessons
-      const uniqueLessons = Array.from(
-        new Set(data.map((mark) => mark.schedule.lesson.name))
-      ).sort();
-      setLessons(uniqueLessons);
+      // The server returns the lesson x date matrix already pivoted
+      const response = await api.get('/student/gradebook/');
+      setGradebook(response.data);
     } catch (error) {
       console.error('Error fetching marks:', error);
       setSnackbar({
@@ -69,18 +112,12 @@ function StudentMarksTable() {
     setSnackbar({ ...snackbar, open: false });
   };
 
-  // Create a map for quick lookup: lesson -> date -> mark
-  const marksMap = {};
-  marks.forEach((mark) => {
-    const lessonName = mark.schedule?.lesson?.name;
-    const date = mark.schedule?.date;
+  const { lessons, dates, cells, averages } = gradebook;
 
-    if (lessonName && date) {
-      if (!marksMap[lessonName]) {
-        marksMap[lessonName] = {};
-      }
-      marksMap[lessonName][date] = mark.mark;
-    }
+  // Create a lookup: lesson index -> date index -> mark
+  const marksMap = lessons.map(() => ({}));
+  cells.forEach(([lessonIndex, dateIndex, mark]) => {
+    marksMap[lessonIndex][dateIndex] = mark;
   });
 
   return (
@@ -98,7 +135,7 @@ function StudentMarksTable() {
         >
           <CircularProgress />
         </Box>
-      ) : marks.length === 0 ? (
+      ) : cells.length === 0 ? (
         <Typography>No marks available.</Typography>
       ) : (
         <TableContainer component={Paper}>
@@ -111,21 +148,25 @@ function StudentMarksTable() {
                     {format(parseISO(date), 'dd.MM')}
                   </TableCell>
                 ))}
+                <TableCell align="center">Average</TableCell>
               </TableRow>
             </TableHead>
             <TableBody>
-              {lessons.map((lesson) => (
-                <TableRow key={lesson}>
+              {lessons.map((lesson, lessonIndex) => (
+                <TableRow key={lesson.id}>
                   <TableCell component="th" scope="row">
-                    {lesson}
+                    {lesson.name}
                   </TableCell>
-                  {dates.map((date) => (
+                  {dates.map((date, dateIndex) => (
                     <TableCell key={date} align="center">
-                      {marksMap[lesson][date] !== undefined
-                        ? marksMap[lesson][date]
+                      {marksMap[lessonIndex][dateIndex] !== undefined
+                        ? marksMap[lessonIndex][dateIndex]
                         : 'N/A'}
                     </TableCell>
                   ))}
+                  <TableCell align="center">
+                    {averages[lessonIndex] ?? 'N/A'}
+                  </TableCell>
                 </TableRow>
               ))}
             </TableBody>
@@ -0,0 +1,109 @@
+// src/components/StudentOverview.js
+
+import React, { useEffect, useState } from 'react';
+import {
+  Typography,
+  List,
+  ListItem,
+  ListItemText,
+  Paper,
+  CircularProgress,
+  Box,
+  Alert,
+} from '@mui/material';
+import api from '../services/api';
+
+// Today's lessons, recent marks and upcoming homework from one request
+function StudentOverview() {
+  const [dashboard, setDashboard] = useState(null);
+  const [error, setError] = useState('');
+
+  useEffect(() => {
+    const fetchDashboard = async () => {
+      try {
+        const response = await api.get('/student/dashboard/');
+        setDashboard(response.data);
+      } catch (err) {
+        console.error('Error fetching dashboard:', err);
+        setError('Failed to load your dashboard. Please try again.');
+      }
+    };
+    fetchDashboard();
+  }, []);
+
+  if (error) {
+    return <Alert severity="error">{error}</Alert>;
+  }
+
+  if (!dashboard) {
+    return (
+      <Box display="flex" justifyContent="center" alignItems="center" height="50vh">
+        <CircularProgress />
+      </Box>
+    );
+  }
+
+  return (
+    <div>
+      <Typography variant="h4" gutterBottom>
+        Welcome, {dashboard.user.first_name || dashboard.user.username}!
+      </Typography>
+
+      <Typography variant="h6">Today</Typography>
+      <Paper sx={{ mb: 3 }}>
+        {dashboard.today.length === 0 ? (
+          <Typography sx={{ p: 2 }}>No lessons today.</Typography>
+        ) : (
+          <List dense>
+            {dashboard.today.map((slot) => (
+              <ListItem key={slot.id}>
+                <ListItemText
+                  primary={`${slot.period.number}. ${slot.lesson.name}`}
+                  secondary={slot.mark !== null ? `Mark: ${slot.mark}` : null}
+                />
+              </ListItem>
+            ))}
+          </List>
+        )}
+      </Paper>
+
+      <Typography variant="h6">Recent Marks</Typography>
+      <Paper sx={{ mb: 3 }}>
+        {dashboard.recent_marks.length === 0 ? (
+          <Typography sx={{ p: 2 }}>No marks yet.</Typography>
+        ) : (
+          <List dense>
+            {dashboard.recent_marks.map((mark) => (
+              <ListItem key={mark.id}>
+                <ListItemText
+                  primary={`${mark.schedule.lesson.name}: ${mark.mark}`}
+                  secondary={mark.schedule.date}
+                />
+              </ListItem>
+            ))}
+          </List>
+        )}
+      </Paper>
+
+      <Typography variant="h6">Upcoming Hometasks</Typography>
+      <Paper>
+        {dashboard.hometasks.length === 0 ? (
+          <Typography sx={{ p: 2 }}>No hometasks for the coming week.</Typography>
+        ) : (
+          <List dense>
+            {dashboard.hometasks.map((task) => (
+              <ListItem key={task.id}>
+                <ListItemText
+                  primary={`${task.schedule.lesson.name}: ${task.description}`}
+                  secondary={task.schedule.date}
+                />
+              </ListItem>
+            ))}
+          </List>
+        )}
+      </Paper>
+    </div>
+  );
+}
+
+export default StudentOverview;
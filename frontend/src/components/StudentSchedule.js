@@ -45,7 +45,7 @@ function StudentSchedule() {
     try {
       const formattedDate = date.toISOString().split('T')[0]; // YYYY-MM-DD
       const response = await api.get('/student/schedule/', {
-        params: { date: formattedDate },
+        params: { date: formattedDate, expand: 'lesson,period' },
       });
       setSchedule(response.data);
     } catch (error) {
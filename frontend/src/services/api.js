@@ -1,7 +1,7 @@
 import axios from 'axios';
 import { jwtDecode } from 'jwt-decode';
 
-const API_URL = 'http://localhost:8000/api';
+export const API_URL = 'http://localhost:8000/api';
 
 const api = axios.create({
     baseURL: API_URL,
@@ -29,4 +29,18 @@ api.interceptors.request.use(
     (error) => Promise.reject(error)
 );
 
+// Follow cursor pagination links and return every row of a list endpoint
+export const fetchAll = async (url, config) => {
+    let response = await api.get(url, config);
+    if (!response.data || !Array.isArray(response.data.results)) {
+        return response.data;
+    }
+    const rows = [...response.data.results];
+    while (response.data.next) {
+        response = await api.get(response.data.next);
+        rows.push(...response.data.results);
+    }
+    return rows;
+};
+
 export default api;